@@ -1,20 +1,22 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Depends
 from fastapi.responses import Response
 from typing import List, Optional
 from datetime import datetime
 from app.models.schemas import AnalysisResult, AnalysisListResponse, DetectResponse
+from app.core.container import get_analysis_service
+from app.core.metrics import TimedJSONResponse
 from app.services.analysis_service import AnalysisService
 import uuid
 import json
 
 router = APIRouter()
-analysis_service = AnalysisService()
 
-@router.get("/", response_model=AnalysisListResponse)
+@router.get("/", response_model=AnalysisListResponse, response_class=TimedJSONResponse)
 async def get_analyses(
     search: Optional[str] = None,
     status: Optional[str] = None,
-    sort_by: Optional[str] = "date"
+    sort_by: Optional[str] = "date",
+    analysis_service: AnalysisService = Depends(get_analysis_service)
 ):
     """Get all analysis results with optional filtering and sorting"""
     try:
@@ -23,8 +25,8 @@ async def get_analyses(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/{analysis_id}", response_model=AnalysisResult)
-async def get_analysis(analysis_id: str):
+@router.get("/{analysis_id}", response_model=AnalysisResult, response_class=TimedJSONResponse)
+async def get_analysis(analysis_id: str, analysis_service: AnalysisService = Depends(get_analysis_service)):
     """Get a specific analysis by ID"""
     try:
         analysis = analysis_service.get_analysis_by_id(analysis_id)
@@ -39,7 +41,8 @@ async def save_analysis(
     filename: str = Form(...),
     detection_result: str = Form(...),
     processing_time: str = Form(...),
-    image_file: UploadFile = File(...)
+    image_file: UploadFile = File(...),
+    analysis_service: AnalysisService = Depends(get_analysis_service)
 ):
     """Save a new analysis result"""
     try:
@@ -63,7 +66,7 @@ async def save_analysis(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{analysis_id}")
-async def delete_analysis(analysis_id: str):
+async def delete_analysis(analysis_id: str, analysis_service: AnalysisService = Depends(get_analysis_service)):
     """Delete an analysis"""
     try:
         success = analysis_service.delete_analysis(analysis_id)
@@ -74,7 +77,7 @@ async def delete_analysis(analysis_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{analysis_id}/image")
-async def get_analysis_image(analysis_id: str):
+async def get_analysis_image(analysis_id: str, analysis_service: AnalysisService = Depends(get_analysis_service)):
     """Get the original image for an analysis"""
     try:
         image_data = analysis_service.get_analysis_image(analysis_id)
@@ -1,16 +1,56 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from app.services.yolo_service import YoloService
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from app.core.container import get_inference_graph
+from app.core.metrics import TimedJSONResponse
+from app.pipelines.inference_graph import GraphError, InferenceGraph
 from app.models.schemas import DetectResponse
 
 router = APIRouter()
-service = YoloService()
 
 
-@router.post("/", response_model=DetectResponse)
-async def detect(file: UploadFile = File(...)):
+def _graph_error(e: GraphError) -> HTTPException:
+    return HTTPException(status_code=504 if e.timed_out else 500, detail=str(e))
+
+
+@router.post("/", response_model=DetectResponse, response_class=TimedJSONResponse)
+async def detect(file: UploadFile = File(...), graph: InferenceGraph = Depends(get_inference_graph)):
+    content = await file.read()
+    try:
+        run = await run_in_threadpool(graph.run, {"image_bytes": content}, ["verify"])
+    except GraphError as e:
+        raise _graph_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    # Memoized outputs are shared between requests
+    result = run.outputs["verify"].model_copy(deep=True)
+    result.timings = run.timings()
+    return result
+
+
+@router.post("/pipeline", response_class=TimedJSONResponse)
+async def detect_pipeline(
+    file: UploadFile = File(...),
+    instruction: Optional[str] = Form(None),
+    adapter: Optional[str] = Form(None),
+    max_new_tokens: int = Form(128),
+    persist: bool = Form(False),
+    graph: InferenceGraph = Depends(get_inference_graph),
+):
+    """Detections plus, optionally, a VLM answer to ``instruction`` and a saved analysis, with per-stage status."""
     content = await file.read()
+    params = {"image_bytes": content, "instruction": instruction, "adapter": adapter,
+              "max_new_tokens": max_new_tokens, "persist": persist, "filename": file.filename}
     try:
-        result = service.infer_bytes(content)
-        return result
+        run = await run_in_threadpool(graph.run, params, ["verify", "vlm", "persist"])
+    except GraphError as e:
+        raise _graph_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "detections": run.outputs["verify"],
+        "answer": run.outputs["vlm"],
+        "analysis": run.outputs["persist"],
+        "stages": run.to_dict()["stages"],
+        "timings": run.timings(),
+    }
@@ -1,13 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from app.core.container import get_training_service
 from app.models.schemas import FeedbackIn
 from app.services.training_service import TrainingService
 
 router = APIRouter()
-train_svc = TrainingService()
 
 
 @router.post("/")
-async def submit_feedback(payload: FeedbackIn):
+async def submit_feedback(payload: FeedbackIn, train_svc: TrainingService = Depends(get_training_service)):
     try:
         train_svc.save_feedback(payload)
         return {"status": "saved", "id": payload.id}
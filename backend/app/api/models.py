@@ -0,0 +1,66 @@
+from fastapi import APIRouter, Form, HTTPException, Depends
+from typing import Optional
+from app.core.container import container, get_model_registry
+from app.services.model_registry import ModelRegistry
+import json
+
+router = APIRouter()
+
+
+def _swap_fn(kind: str):
+    # Resolved on the promotion thread so building a service never blocks the request
+    if kind == "yolo":
+        return lambda path, version: container.yolo.swap_weights(path, version)
+    return lambda path, version: container.vlm.swap_adapter(path, version)
+
+
+@router.get("/{kind}")
+def list_versions(kind: str, registry: ModelRegistry = Depends(get_model_registry)):
+    try:
+        return {"versions": registry.list(kind), "deployment": registry.deployment_status(kind)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/{kind}/register")
+def register_version(kind: str, path: str = Form(...), metrics: Optional[str] = Form(None), notes: str = Form(""),
+                     registry: ModelRegistry = Depends(get_model_registry)):
+    try:
+        return registry.register(kind, path, metrics=json.loads(metrics) if metrics else None, notes=notes)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/{kind}/{version}/promote", status_code=202)
+def promote_version(kind: str, version: str, registry: ModelRegistry = Depends(get_model_registry)):
+    """Load and warm up the version in the background, then swap it in."""
+    try:
+        return registry.promote(kind, version, _swap_fn(kind))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/{kind}/rollback", status_code=202)
+def rollback(kind: str, registry: ModelRegistry = Depends(get_model_registry)):
+    try:
+        return registry.rollback(kind, _swap_fn(kind))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get("/{kind}/deployment")
+def deployment_status(kind: str, registry: ModelRegistry = Depends(get_model_registry)):
+    try:
+        return registry.deployment_status(kind)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
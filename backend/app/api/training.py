@@ -1,14 +1,76 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from app.core.container import get_training_service
+from app.models.schemas import TrainingRequest
 from app.services.training_service import TrainingService
+import asyncio
+import json
 
 router = APIRouter()
-service = TrainingService()
 
 
 @router.post("/trigger")
-def trigger_training():
+def trigger_training(request: Optional[TrainingRequest] = None,
+                     service: TrainingService = Depends(get_training_service)):
+    request = request or TrainingRequest()
     try:
-        job = service.trigger_training()
+        job = service.trigger_training(request.mode, epochs=request.epochs, use_sahi=request.use_sahi,
+                                       incremental=request.incremental)
         return {"job": job}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/jobs")
+def list_jobs(status: Optional[str] = None, service: TrainingService = Depends(get_training_service)):
+    return {"jobs": service.list_jobs(status)}
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, service: TrainingService = Depends(get_training_service)):
+    job = service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/logs")
+def get_job_logs(job_id: str, offset: int = 0, service: TrainingService = Depends(get_training_service)):
+    """Incremental log read; pass the returned next_offset to continue."""
+    chunk = service.read_job_log(job_id, offset)
+    if chunk is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return chunk
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, service: TrainingService = Depends(get_training_service)):
+    """Server-sent events with log output and metrics until the job finishes."""
+    if service.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        offset = 0
+        while True:
+            job = service.get_job(job_id)
+            chunk = service.read_job_log(job_id, offset)
+            offset = chunk["next_offset"]
+            if chunk["data"]:
+                yield f"event: log\ndata: {json.dumps(chunk['data'])}\n\n"
+            yield f"event: status\ndata: {json.dumps({'status': job['status'], 'metrics': job['metrics']})}\n\n"
+            if job["status"] not in ("queued", "running") and not chunk["data"]:
+                break
+            await asyncio.sleep(1.0)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str, service: TrainingService = Depends(get_training_service)):
+    job = service.cancel_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
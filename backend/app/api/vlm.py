@@ -1,27 +1,158 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
+from typing import List, Optional
+from app.core.config import settings
+from app.core.container import get_instruction_router, get_vlm_service, get_yolo_service
+from app.models.schemas import Box
+from app.services.instruction_router import InstructionRouter
 from app.services.vlm_service import VLMService
+from app.services.yolo_service import YoloService
+from pathlib import Path
+import asyncio
+import json
+import threading
+import logging
+
+log = logging.getLogger(__name__)
 
 router = APIRouter()
-service = VLMService()
 
 
 class VLMRequest(BaseModel):
     instruction: str
 
 
+def _adapter_error(e: Exception):
+    """Unknown or invalid adapter names are client errors."""
+    if isinstance(e, FileNotFoundError):
+        return HTTPException(status_code=404, detail=str(e))
+    if isinstance(e, ValueError):
+        return HTTPException(status_code=400, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/query")
-async def query(file: UploadFile = File(...), instruction: str = Form(...)):
+async def query(file: UploadFile = File(...), instruction: str = Form(...), adapter: Optional[str] = Form(None),
+                instruction_router: InstructionRouter = Depends(get_instruction_router)):
+    """Answer from detections for count/location questions, otherwise generate with the VLM.
+
+    The response's ``path`` is "detector" or "vlm"; ``route`` explains the decision.
+    ``adapter`` names a LoRA adapter directory in settings.adapter_dir (default adapter if omitted).
+    """
     content = await file.read()
     try:
-        answer = service.answer_bytes(content, instruction)
-        return {"answer": answer}
+        # Off the event loop so concurrent questions can be batched together
+        return await run_in_threadpool(instruction_router.answer, content, instruction, adapter=adapter)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        raise _adapter_error(e)
+
+
+@router.post("/query_stream")
+async def query_stream(file: UploadFile = File(...), instruction: str = Form(...), max_new_tokens: int = Form(128),
+                       adapter: Optional[str] = Form(None), service: VLMService = Depends(get_vlm_service)):
+    """Server-sent events with the answer as it is generated.
+
+    Emits ``token`` events with text deltas and a final ``done`` event with token count,
+    time to first token and tokens per second. Generation stops if the client disconnects.
+    """
+    content = await file.read()
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    cancel = threading.Event()
+
+    def publish(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed, nobody is listening
+            cancel.set()
+
+    def produce():
+        try:
+            for item in service.stream_answer(content, instruction, max_new_tokens, cancel=cancel, adapter=adapter):
+                publish(item)
+        except Exception as e:
+            log.exception("VLM stream failed: %s", e)
+            publish({"error": str(e)})
+        finally:
+            publish(None)
+
+    async def events():
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                if "error" in item:
+                    yield f"event: error\ndata: {json.dumps(item)}\n\n"
+                elif item.get("done"):
+                    yield f"event: done\ndata: {json.dumps(item)}\n\n"
+                else:
+                    yield f"event: token\ndata: {json.dumps(item)}\n\n"
+        finally:
+            # Runs when the response is cancelled on client disconnect too
+            cancel.set()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.post("/query_regions")
+async def query_regions(file: UploadFile = File(...), instruction: str = Form(...),
+                        region: Optional[str] = Form(None), max_new_tokens: int = Form(128),
+                        adapter: Optional[str] = Form(None), service: VLMService = Depends(get_vlm_service),
+                        detector: YoloService = Depends(get_yolo_service)):
+    """Ask about the detected symbols (or ``region`` given as "x,y,w,h") instead of the whole sheet."""
+    content = await file.read()
+    selected = None
+    if region:
+        try:
+            x, y, w, h = (int(float(v)) for v in region.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="region must be 'x,y,w,h'")
+        if w <= 0 or h <= 0:
+            raise HTTPException(status_code=400, detail="region width and height must be positive")
+        selected = Box(x=x, y=y, w=w, h=h)
+    try:
+        boxes = [] if selected else (await run_in_threadpool(detector.infer_bytes, content)).boxes
+        return await run_in_threadpool(service.answer_regions, content, instruction, boxes=boxes, region=selected,
+                                       max_new_tokens=max_new_tokens, adapter=adapter)
+    except Exception as e:
+        raise _adapter_error(e)
+
+
+@router.post("/query_batch")
+async def query_batch(file: UploadFile = File(...), instructions: List[str] = Form(...),
+                      adapter: Optional[str] = Form(None), service: VLMService = Depends(get_vlm_service)):
+    """Answer several questions about one image in a single batched generation."""
+    content = await file.read()
+    try:
+        answers = await run_in_threadpool(service.answer_many, content, instructions, adapter=adapter)
+        return {"answers": answers}
+    except Exception as e:
+        raise _adapter_error(e)
+
+
+@router.get("/status")
+def status(service: VLMService = Depends(get_vlm_service)):
+    """Whether the VLM is loaded, with load time, quantization, memory and measured speed."""
+    return {"loaded": service.is_loaded, "stats": service.load_stats}
+
+
+@router.get("/adapters")
+def list_adapters(service: VLMService = Depends(get_vlm_service)):
+    """Adapters available in settings.adapter_dir, the resident set and batching stats."""
+    adapter_dir = Path(settings.adapter_dir)
+    available = sorted(p.name for p in adapter_dir.iterdir() if p.is_dir()) if adapter_dir.exists() else []
+    return {"default": service.adapter_name, "available": available,
+            "pool": service.adapters.stats(), "batching": service.batcher.stats()}
 
 
 @router.post("/reload_adapter")
-async def reload_adapter(path: str = Form(...)):
+async def reload_adapter(path: str = Form(...), service: VLMService = Depends(get_vlm_service)):
     try:
         service.load_adapter(path)
         return {"status": "adapter_loaded", "path": path}
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Optional
+import queue
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collects requests arriving within a short window and runs them in groups.
+
+    ``submit(key, item)`` blocks until ``handler(key, items)`` has produced the result for
+    ``item``. Requests with the same key that arrive within ``window_s`` of the first one
+    (up to ``max_batch``) are handed to the handler together; different keys are run one
+    group after the other. The handler may return an exception in place of an item's
+    result to fail only that request.
+    """
+
+    def __init__(self, handler: Callable[[Hashable, List[Any]], List[Any]], window_s: float, max_batch: int):
+        self.handler = handler
+        self.window_s = window_s
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+
+    def _ensure_worker(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, key: Hashable, item: Any) -> Any:
+        future: Future = Future()
+        self._ensure_worker()
+        self._queue.put((key, item, future))
+        return future.result()
+
+    def _collect(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_s
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            groups: "OrderedDict[Hashable, List]" = OrderedDict()
+            for key, item, future in self._collect():
+                groups.setdefault(key, []).append((item, future))
+            for key, requests in groups.items():
+                self.batches += 1
+                self.requests += len(requests)
+                try:
+                    results = self.handler(key, [item for item, _ in requests])
+                except Exception as e:
+                    # The submitters re-raise it, so no traceback here
+                    log.warning("Batch for %s failed: %s", key, e)
+                    for _, future in requests:
+                        future.set_exception(e)
+                    continue
+                for (_, future), result in zip(requests, results):
+                    if isinstance(result, BaseException):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+
+    def stats(self):
+        return {"batches": self.batches, "requests": self.requests, "queued": self._queue.qsize(),
+                "avg_batch": round(self.requests / self.batches, 2) if self.batches else 0.0}
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import sys
+import threading
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values.
+
+    ``sizeof`` returns the size in bytes of a value; entries are evicted from the
+    least recently used end until the total fits in ``max_bytes``. A value larger
+    than the whole budget is not cached.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or sys.getsizeof
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.current_bytes -= self._sizes.pop(key)
+                del self._data[key]
+            if size > self.max_bytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                old_key, _ = self._data.popitem(last=False)
+                self.current_bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            self.current_bytes -= self._sizes.pop(key)
+            return self._data.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -12,9 +12,65 @@ class Settings(BaseSettings):
     adapter_dir: str = "models/adapters"
     feedback_dir: str = "data/feedback"
     finetune_file: str = "data/finetune/train.jsonl"
+
+    # Training job manager
+    training_jobs_dir: str = "data/training_jobs"
+    training_max_concurrent: int = 1  # jobs allowed to run at once, the rest are queued
+    training_memory_limit_mb: int = 0  # address-space limit per job (POSIX), 0 = unlimited
+    training_nice: int = 10  # lower scheduling priority so serving stays responsive
+    training_num_threads: int = 0  # OMP/MKL threads per job, 0 = library default
     
+    # Startup
+    warmup_on_startup: bool = True  # load and warm up models in the background at startup
+    vlm_preload: bool = False  # include the VLM base model in the startup warm-up
+
+    # VLM
+    vlm_vision_cache_mb: int = 1024  # memory budget for cached image tensors and vision embeddings
+    vlm_prefix_cache: bool = True  # reuse key/value states of the shared system-prompt prefix
+    vlm_adapter_budget_mb: int = 1024  # memory for LoRA adapters resident next to the default one
+    vlm_batch_window_ms: int = 10  # wait this long to batch concurrent questions, 0 disables batching
+    vlm_max_batch: int = 8
+    vlm_cpu_quantization: str = "int8"  # CPU weights: "none", "int8" (torch dynamic) or "int4" (optimum-quanto)
+    vlm_quantize_skip: str = "q_proj,v_proj,lm_head"  # layers kept in float; LoRA adapters attach to q/v
+    vlm_cpu_model: str = ""  # smaller model for CPU-only nodes, e.g. Qwen/Qwen2-VL-2B-Instruct
+    vlm_num_threads: int = 0  # torch threads on CPU, 0 = all cores available to the process
+    vlm_warmup_tokens: int = 8  # tokens generated by the warm-up to measure speed
+    vlm_crop_max_pixels: int = 1024 * 1024  # pixel budget of the region mosaic sent instead of the whole sheet
+    vlm_crop_margin: int = 48  # context in pixels kept around each detection
+    instruction_routing: bool = True  # answer count/location questions from detections when possible
+
+    # Detection
+    dataset_yaml: str = "../data/config.yaml"  # class names when the YOLO model is not loaded
+    yolo_result_cache_size: int = 256  # detection results kept per image hash
+    cascade_enabled: bool = False  # verify detections in the uncertainty band with a second stage
+    cascade_low: float = 0.3  # detections below are dropped
+    cascade_high: float = 0.6  # detections at or above skip verification
+    cascade_verifier: str = "vlm"  # "vlm" (yes/no prompt) or "classifier"
+    cascade_classifier_weights: str = ""  # ultralytics classification weights for the classifier verifier
+    cascade_accept_prob: float = 0.5  # classifier confidence needed to accept a crop
+    cascade_crop_padding: float = 0.25  # context around each box, as a fraction of its size
+    cascade_crop_size: int = 112
+    cascade_batch_size: int = 16
+
+    # Inference graph (app.pipelines.inference_graph)
+    pipeline_workers: int = 4  # stages of one or more requests running at once
+    pipeline_vlm_workers: int = 2  # VLM answer stages, on their own threads so they cannot starve detection
+    pipeline_memo_mb: int = 256  # memory for memoized stage outputs
+    pipeline_detect_timeout_s: float = 120.0
+    pipeline_verify_timeout_s: float = 60.0  # on timeout the unverified detections are served
+    pipeline_vlm_timeout_s: float = 300.0  # on timeout the answer is left out
+
+    # Metrics (app.core.metrics, served at /metrics)
+    server_timing: bool = False  # per-stage durations in a Server-Timing header on every response
+                                 # (requests sending "X-Server-Timing: 1" get it either way)
+
+    # Model registry / hot-swap
+    warmup_image: str = ""  # sample tile used to warm up new weights, blank tile if unset
+    model_drain_timeout: float = 300.0  # seconds to wait for in-flight requests on a replaced model
+
     # SAHI Configuration - Optimized for full image detection
-    use_sahi_inference: bool = True
+    use_sahi_inference: bool = True  # slice large images (default of DetectionParams.sliced)
+    detection_params_file: str = ""  # JSON of DetectionParams overrides, e.g. from scripts/evaluate_detection.py
     sahi_slice_height: int = 512
     sahi_slice_width: int = 512
     sahi_overlap_height_ratio: float = 0.4  # Increased overlap for better detection
@@ -27,8 +83,9 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
+    def ensure_dirs(self):
+        """Create the data/model directories; called from the app lifespan, not at import."""
+        for path in [self.data_dir, self.adapter_dir, self.feedback_dir, self.model_dir]:
+            Path(path).mkdir(parents=True, exist_ok=True)
+
 settings = Settings()
-Path(settings.data_dir).mkdir(parents=True, exist_ok=True)
-Path(settings.adapter_dir).mkdir(parents=True, exist_ok=True)
-Path(settings.feedback_dir).mkdir(parents=True, exist_ok=True)
-Path(settings.model_dir).mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,206 @@
+from typing import Callable, Dict, Optional
+from app.core.config import settings
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+MODEL_SERVICES = ("yolo", "vlm")
+
+
+class ServiceContainer:
+    """Lazily constructed services shared by every router, owned by the app lifespan.
+
+    Nothing heavy happens at import time: a service (and its ML imports) is built the
+    first time it is requested, either by a request or by the background warm-up.
+    Readiness of the model services is tracked for the /ready probe, including models
+    that load on demand after startup.
+    """
+
+    def __init__(self):
+        self._services: Dict[str, object] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._warmup_thread: Optional[threading.Thread] = None
+        # Services whose readiness the warm-up is reporting; on-demand loads leave them alone
+        self._warming = set()
+        self.readiness: Dict[str, Dict] = {
+            name: {"state": "pending", "load_time_s": None, "warmup_time_s": None, "error": None}
+            for name in MODEL_SERVICES
+        }
+
+    def _get(self, name: str, factory: Callable[[], object]):
+        service = self._services.get(name)
+        if service is not None:
+            return service
+        with self._locks_guard:
+            lock = self._locks.setdefault(name, threading.Lock())
+        # Per-service lock: a request arriving during warm-up waits for the same instance
+        with lock:
+            if name not in self._services:
+                started = time.perf_counter()
+                try:
+                    self._services[name] = factory()
+                except Exception as e:
+                    if name in MODEL_SERVICES:
+                        self._record_load(name, "failed", error=str(e))
+                    raise
+                elapsed = time.perf_counter() - started
+                log.info("Initialized %s service in %.2fs", name, elapsed)
+                if name == "yolo":
+                    loaded = self._services[name].slot.model is not None
+                    self._record_load(name, "ready" if loaded else "failed", load_time_s=round(elapsed, 3),
+                                      error=None if loaded else "YOLO weights could not be loaded")
+            return self._services[name]
+
+    def _record_load(self, name: str, state: str, error: Optional[str] = None, load_time_s: Optional[float] = None):
+        """Readiness of a model service loaded on demand (the warm-up reports its own)."""
+        if name in self._warming:
+            return
+        status = self.readiness[name]
+        status.update(state=state, error=error)
+        if load_time_s is not None:
+            status["load_time_s"] = load_time_s
+        service = self._services.get(name)
+        if state == "ready" and getattr(service, "load_stats", None):
+            status["stats"] = service.load_stats
+
+    @property
+    def yolo(self):
+        def build():
+            from app.services.cascade import build_cascade
+            from app.services.yolo_service import YoloService
+            service = YoloService()
+            service.cascade = build_cascade(lambda: self.vlm)
+            return service
+        return self._get("yolo", build)
+
+    @property
+    def vlm(self):
+        def build():
+            from app.services.vlm_service import VLMService
+            service = VLMService()
+            service.load_listener = lambda state, error: self._record_load(
+                "vlm", state, error, load_time_s=service.load_stats.get("load_time_s") if state == "ready" else None)
+            return service
+        return self._get("vlm", build)
+
+    @property
+    def training(self):
+        def build():
+            from app.services.training_service import TrainingService
+            return TrainingService()
+        return self._get("training", build)
+
+    @property
+    def analysis(self):
+        def build():
+            from app.services.analysis_service import AnalysisService
+            return AnalysisService()
+        return self._get("analysis", build)
+
+    @property
+    def router(self):
+        def build():
+            from app.services.instruction_router import InstructionRouter
+            return InstructionRouter(self.yolo, self.vlm)
+        return self._get("router", build)
+
+    @property
+    def pipeline(self):
+        def build():
+            from app.pipelines.inference_graph import build_inference_graph
+            return build_inference_graph(self)
+        return self._get("pipeline", build)
+
+    @property
+    def registry(self):
+        def build():
+            from app.services.model_registry import get_registry
+            return get_registry()
+        return self._get("registry", build)
+
+    # -- startup -----------------------------------------------------------
+
+    def _warm(self, name: str, load: Callable[[], object], warm: Callable[[object], None]):
+        status = self.readiness[name]
+        status["state"] = "loading"
+        self._warming.add(name)
+        try:
+            started = time.perf_counter()
+            service = load()
+            status["load_time_s"] = round(time.perf_counter() - started, 3)
+            status["state"] = "warming"
+            started = time.perf_counter()
+            warm(service)
+            status["warmup_time_s"] = round(time.perf_counter() - started, 3)
+            if getattr(service, "load_stats", None):
+                status["stats"] = service.load_stats
+            status["state"] = "ready"
+        except Exception as e:
+            log.exception("Warm-up of %s failed: %s", name, e)
+            status.update(state="failed", error=str(e))
+        finally:
+            self._warming.discard(name)
+
+    def _warm_yolo(self, service):
+        bundle = service.slot.model
+        if bundle is None:
+            raise RuntimeError("YOLO weights could not be loaded")
+        service.warm_up(bundle)
+
+    def _warm_all(self):
+        self._warm("yolo", lambda: self.yolo, self._warm_yolo)
+        if settings.vlm_preload:
+            self._warm("vlm", lambda: self.vlm, lambda service: service.warm_up())
+        else:
+            self.readiness["vlm"]["state"] = "disabled"
+
+    def start_warmup(self):
+        """Load and warm up the models on a background thread so startup returns immediately."""
+        if self._warmup_thread is not None:
+            return
+        self._warmup_thread = threading.Thread(target=self._warm_all, name="model-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def is_ready(self) -> bool:
+        return all(s["state"] in ("ready", "disabled", "lazy") for s in self.readiness.values())
+
+    def shutdown(self):
+        pipeline = self._services.get("pipeline")
+        if pipeline is not None:
+            pipeline.shutdown()
+        self._services.clear()
+
+
+container = ServiceContainer()
+
+
+# FastAPI dependencies
+def get_yolo_service():
+    return container.yolo
+
+
+def get_vlm_service():
+    return container.vlm
+
+
+def get_training_service():
+    return container.training
+
+
+def get_analysis_service():
+    return container.analysis
+
+
+def get_model_registry():
+    return container.registry
+
+
+def get_instruction_router():
+    return container.router
+
+
+def get_inference_graph():
+    return container.pipeline
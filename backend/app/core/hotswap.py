@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+from typing import Any, Optional
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, model: Any, version: Optional[str]):
+        self.model = model
+        self.version = version
+        self.refs = 0
+        self.loaded_at = time.time()
+
+
+class ModelSlot:
+    """Holds the live model and counts in-flight users so a replacement can drain the old one.
+
+    Requests take the model with ``acquire()``; ``swap()`` publishes a new model immediately
+    (new requests see it right away) and then waits until every request still holding the
+    old model has finished before returning it. ``last_drain`` tells whether the last
+    swap's drain finished or timed out.
+    """
+
+    def __init__(self, model: Any = None, version: Optional[str] = None):
+        self._cond = threading.Condition()
+        self._current: Optional[_Entry] = _Entry(model, version) if model is not None else None
+        self.last_drain = {"drained": True, "in_flight": 0}
+
+    @property
+    def model(self) -> Any:
+        entry = self._current
+        return entry.model if entry else None
+
+    @property
+    def version(self) -> Optional[str]:
+        entry = self._current
+        return entry.version if entry else None
+
+    @property
+    def in_flight(self) -> int:
+        entry = self._current
+        return entry.refs if entry else 0
+
+    @contextmanager
+    def acquire(self):
+        with self._cond:
+            entry = self._current
+            if entry is not None:
+                entry.refs += 1
+        try:
+            yield entry.model if entry else None
+        finally:
+            if entry is not None:
+                with self._cond:
+                    entry.refs -= 1
+                    self._cond.notify_all()
+
+    def swap(self, model: Any, version: Optional[str] = None, drain_timeout: Optional[float] = None) -> Any:
+        """Install ``model`` and return the previous one once it has no in-flight users.
+
+        Returns None if there was no previous model or it was still in use after
+        ``drain_timeout``; ``last_drain`` tells the two apart.
+        """
+        with self._cond:
+            old = self._current
+            self._current = _Entry(model, version)
+            if old is None:
+                self.last_drain = {"drained": True, "in_flight": 0}
+                return None
+            drained = self._cond.wait_for(lambda: old.refs == 0, timeout=drain_timeout)
+            self.last_drain = {"drained": drained, "in_flight": old.refs}
+        if not drained:
+            # Still referenced by slow requests; they keep their own reference to it
+            log.warning("Model %s still has %d in-flight requests after %ss; it is released when they finish",
+                        old.version, old.refs, drain_timeout)
+            return None
+        return old.model
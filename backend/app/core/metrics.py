@@ -0,0 +1,282 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from fastapi.responses import JSONResponse
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds; from sub-millisecond merges to minutes of VLM generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _format_labels(pairs: Sequence[Tuple[str, Any]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """A named metric family with fixed label names, rendered in the Prometheus text format.
+
+    Values can also come from ``set_function(fn, **labels)``, which is called at scrape
+    time; that suits numbers already tracked elsewhere, such as cache statistics or queue
+    lengths, without touching the code that maintains them.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames) or set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {list(self.labelnames)}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        self._functions[self._key(labels)] = fn
+
+    def _samples(self) -> Iterator[Tuple[str, Sequence[Tuple[str, Any]], float]]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield "", list(zip(self.labelnames, key)), value
+        for key, fn in list(self._functions.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                log.debug("Metric %s%s not collected: %s", self.name, key, e)
+                continue
+            if value is not None:
+                yield "", list(zip(self.labelnames, key)), value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, pairs, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def set_function(self, fn, **labels):
+        raise TypeError("Histograms are observed, not read from a function")
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in values.items():
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield "_bucket", pairs + [("le", _format_value(bound))], cumulative
+            yield "_sum", pairs, total
+            yield "_count", pairs, count
+
+
+class MetricsRegistry:
+    """All metric families of the process; asking for an existing name returns that metric."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+def rss_bytes() -> Optional[float]:
+    """Resident memory of the process in bytes, None where it cannot be read (e.g. Windows).
+
+    Where /proc is unavailable this is the peak rather than the current size.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if os.name != "posix":
+        return None
+    import resource  # POSIX only
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux and the BSDs
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return float(maxrss if sys.platform == "darwin" else maxrss * 1024)
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "floorplan_stage_seconds",
+    "Time spent per processing stage: decode, tiling, inference, merge, serialization, "
+    "vlm_prefill, vlm_decode, store_read, store_write",
+    ["stage"],
+)
+PIPELINE_STAGE_SECONDS = metrics.histogram(
+    "floorplan_pipeline_stage_seconds", "Inference graph stages that ran, by outcome", ["stage", "status"])
+REQUEST_SECONDS = metrics.histogram(
+    "floorplan_http_request_duration_seconds", "HTTP request handling time", ["method", "route", "status"])
+TILES_PROCESSED = metrics.counter("floorplan_tiles_processed_total", "Image regions run through the detector")
+TILES_SKIPPED = metrics.counter(
+    "floorplan_tiles_skipped_total", "Image regions that were not run through the detector", ["reason"])
+CACHE_HITS = metrics.counter("floorplan_cache_hits_total", "Cache lookups that found an entry", ["cache"])
+CACHE_MISSES = metrics.counter("floorplan_cache_misses_total", "Cache lookups that found nothing", ["cache"])
+CACHE_BYTES = metrics.gauge("floorplan_cache_bytes", "Size of the entries held by a cache", ["cache"])
+VLM_TOKENS = metrics.counter("floorplan_vlm_generated_tokens_total", "Tokens generated by the VLM")
+QUEUE_DEPTH = metrics.gauge("floorplan_queue_depth", "Work items waiting to be processed", ["queue"])
+MODEL_MEMORY = metrics.gauge("floorplan_model_memory_bytes", "Memory held by loaded model weights", ["model"])
+PROCESS_MEMORY = metrics.gauge("process_resident_memory_bytes", "Resident memory of the server process")
+PROCESS_MEMORY.set_function(rss_bytes)
+
+
+def watch_cache(name: str, cache):
+    """Export the hit/miss counts and size an LRUCache already keeps."""
+    CACHE_HITS.set_function(lambda: cache.hits, cache=name)
+    CACHE_MISSES.set_function(lambda: cache.misses, cache=name)
+    CACHE_BYTES.set_function(lambda: cache.current_bytes, cache=name)
+
+
+# Stage durations of the request being handled, for the Server-Timing header.
+# Threads started for the request only see them if they run in a copy of its context.
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def collect_timings() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the stages observed in this context (and copies of it) into a list."""
+    timings: List[Tuple[str, float]] = []
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing(timings: Sequence[Tuple[str, float]], total_s: Optional[float] = None) -> str:
+    """Server-Timing header value, one entry per stage with its durations summed, in milliseconds."""
+    totals: Dict[str, float] = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    if total_s is not None:
+        totals["total"] = total_s
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse whose rendering is timed as the serialization stage.
+
+    Use it as a route's ``response_class``: FastAPI still validates the return value
+    against ``response_model`` and hands the encoded content to ``render``.
+    """
+
+    def render(self, content: Any) -> bytes:
+        with timed("serialization"):
+            return super().render(content)
@@ -1,8 +1,28 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.api import detection, vlm, feedback, training, analysis
+from app.api import detection, vlm, feedback, training, analysis, models
+from app.core.config import settings
+from app.core.container import container
+from app.core.metrics import CONTENT_TYPE, REQUEST_SECONDS, collect_timings, metrics, server_timing
+import time
 
-app = FastAPI(title="Floorplan HITL API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings.ensure_dirs()
+    if settings.warmup_on_startup:
+        # Models load in the background; /ready reports when they can serve
+        container.start_warmup()
+    else:
+        for status in container.readiness.values():
+            status["state"] = "lazy"
+    yield
+    container.shutdown()
+
+
+app = FastAPI(title="Floorplan HITL API", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -13,13 +33,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+def _route_label(request: Request) -> str:
+    """Request path with path parameters put back as {name}, so IDs do not create a series each."""
+    if request.scope.get("route") is None:
+        return "unmatched"
+    names = {str(value): name for name, value in request.path_params.items()}
+    return "/".join(f"{{{names[part]}}}" if part in names else part for part in request.url.path.split("/"))
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    REQUEST_SECONDS.observe(elapsed, method=request.method, route=_route_label(request), status=response.status_code)
+    if settings.server_timing or request.headers.get("x-server-timing"):
+        response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    return response
+
+
 app.include_router(detection.router, prefix="/detect", tags=["detect"])
 app.include_router(vlm.router, prefix="/vlm", tags=["vlm"])
 app.include_router(feedback.router, prefix="/feedback", tags=["feedback"])
 app.include_router(training.router, prefix="/training", tags=["training"])
 app.include_router(analysis.router, prefix="/analysis", tags=["analysis"])
+app.include_router(models.router, prefix="/models", tags=["models"])
 
 
 @app.get("/health")
 async def health():
+    """Liveness: the process is up. Use /ready to know whether models can serve."""
     return {"status": "ok"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus text exposition of the stage timings, counters and gauges in app.core.metrics."""
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/ready")
+async def ready():
+    ready = container.is_ready()
+    body = {"ready": ready, "models": container.readiness}
+    return JSONResponse(body, status_code=200 if ready else 503)
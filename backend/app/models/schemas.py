@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 class Box(BaseModel):
@@ -12,6 +12,8 @@ class DetectResponse(BaseModel):
     boxes: List[Box]
     classes: List[str]
     scores: List[float]
+    cascade: Optional[Dict[str, Any]] = None  # verification stage stats when enabled
+    timings: Optional[Dict[str, Any]] = None  # per-stage seconds when run through the inference graph
 
 class AnalysisResult(BaseModel):
     id: str
@@ -32,3 +34,9 @@ class FeedbackIn(BaseModel):
     classes: List[str]
     instruction: str = "Count all the light bulb symbols."
     output: str = ""  # textual ground-truth; optional
+
+class TrainingRequest(BaseModel):
+    mode: str = "yolo"  # "yolo" or "vlm"
+    epochs: Optional[int] = None
+    use_sahi: bool = True
+    incremental: bool = False  # warm-start YOLO on feedback added since the last run
@@ -1,5 +1,428 @@
-# Minimal placeholder for orchestration graph (LangGraph integration point)
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.metrics import PIPELINE_STAGE_SECONDS, QUEUE_DEPTH, timed, watch_cache
+from app.models.schemas import AnalysisResult, DetectResponse
+from app.services.tiling import merge_detections, plan_regions
+from PIL import Image
+import hashlib
+import io
+import math
+import sys
+import threading
+import time
+import uuid
+import logging
+import numpy as np
 
-def build_inference_graph():
-    # implement LangGraph flows here; return graph object or callable
-    return None
+log = logging.getLogger(__name__)
+
+ERROR_POLICIES = ("raise", "skip", "passthrough")
+# How often the scheduler checks whether queued stages have started (and their deadlines begun)
+_START_POLL_S = 0.05
+
+
+class Stage:
+    """One typed step of the graph.
+
+    ``fn(run, **inputs)`` receives the values named in ``inputs`` (graph inputs or other
+    stages) and must return an instance of ``output``. ``version()`` is mixed into the memo
+    key, so a stage whose behaviour depends on configuration or weights reports them there.
+    ``when(params)`` decides from the graph inputs whether the stage runs at all; a disabled
+    or failed ``passthrough`` stage forwards its first input unchanged. On error, ``raise``
+    aborts the run and ``skip`` drops the stage together with everything that depends on it.
+    ``timeout_s`` counts from when a worker starts the stage, not from when it was queued;
+    ``pool`` names the thread pool it runs on, so long stages can be kept off the default one.
+    """
+
+    def __init__(self, name: str, fn: Callable, inputs: Sequence[str], output: type,
+                 timeout_s: float = 60.0, on_error: str = "raise", memo: bool = True,
+                 when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 version: Optional[Callable[[], str]] = None, pool: str = "default"):
+        if on_error not in ERROR_POLICIES:
+            raise ValueError(f"Unknown error policy for stage {name}: {on_error}")
+        if on_error == "passthrough" and not inputs:
+            raise ValueError(f"Stage {name} has no input to pass through")
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.output = output
+        self.timeout_s = timeout_s
+        self.on_error = on_error
+        self.memo = memo
+        self.when = when
+        self.version = version
+        self.pool = pool
+
+
+class _Task:
+    """A submitted stage; ``started`` is set when a worker picks it up, which starts its deadline."""
+
+    def __init__(self, stage: Stage, on_start: Callable[[], None]):
+        self.stage = stage
+        self.started: Optional[float] = None
+        self._on_start = on_start
+
+    def __call__(self, context, run, args: Dict[str, Any]):
+        self.started = time.perf_counter()
+        self._on_start()
+        # In a copy of the caller's context, so stage timings reach its Server-Timing header
+        return context.run(self.stage.fn, run, **args)
+
+    @property
+    def deadline(self) -> float:
+        return math.inf if self.started is None else self.started + self.stage.timeout_s
+
+
+class StageResult:
+    def __init__(self, status: str, duration_s: float = 0.0, error: Optional[str] = None):
+        self.status = status  # ok, cached, disabled, failed, timeout or skipped
+        self.duration_s = duration_s
+        self.error = error
+
+    def to_dict(self) -> Dict:
+        return {"status": self.status, "duration_s": self.duration_s, "error": self.error}
+
+
+class GraphError(RuntimeError):
+    """A stage with the ``raise`` policy failed or timed out."""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage {stage} failed: {error}")
+        self.stage = stage
+        self.error = error
+
+    @property
+    def timed_out(self) -> bool:
+        return isinstance(self.error, TimeoutError)
+
+
+class GraphRun:
+    """Outputs and per-stage results of one execution."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.outputs: Dict[str, Any] = {}
+        self.stages: Dict[str, StageResult] = {}
+        self.duration_s: Optional[float] = None
+
+    @property
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self.started
+
+    def timings(self) -> Dict[str, float]:
+        timings = {name: r.duration_s for name, r in self.stages.items() if r.status in ("ok", "failed", "timeout")}
+        timings["total"] = self.duration_s if self.duration_s is not None else round(self.elapsed_s, 4)
+        return timings
+
+    def to_dict(self) -> Dict:
+        return {"stages": {name: r.to_dict() for name, r in self.stages.items()}, "duration_s": self.duration_s}
+
+
+_SKIPPED = object()
+
+
+def _content_key(value: Any) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        data = bytes(value)
+    else:
+        data = repr(value).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _artifact_size(value: Any) -> int:
+    if isinstance(value, Image.Image):
+        return value.width * value.height * len(value.getbands())
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "model_dump_json"):
+        return len(value.model_dump_json())
+    return sys.getsizeof(value)
+
+
+class InferenceGraph:
+    """Runs a DAG of stages with memoization, concurrency, timeouts and error policies.
+
+    Memo keys are derived from content hashes of the graph inputs and each stage's version,
+    not from the artifacts themselves, so the keys are known before anything runs: stages
+    whose result is memoized are not run, and neither is anything only they depended on.
+    Stages whose inputs are ready run concurrently on thread pools shared by all runs: the
+    default pool of ``workers`` threads, plus one per entry of ``pools`` (name -> workers)
+    for stages that ask for it. A timed-out stage is abandoned rather than interrupted; its
+    thread finishes in the background and holds a worker of its pool until then.
+    """
+
+    def __init__(self, stages: Iterable[Stage], memo: Optional[LRUCache] = None, workers: int = 4,
+                 options: Iterable[str] = (), pools: Optional[Dict[str, int]] = None):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage: {stage.name}")
+            self.stages[stage.name] = stage
+        self.inputs = {i for s in self.stages.values() for i in s.inputs if i not in self.stages}
+        # Graph inputs only read by ``when`` conditions
+        self.options = set(options)
+        self.order = self._topological_order()
+        self.memo = memo if memo is not None else LRUCache(settings.pipeline_memo_mb * 1024 ** 2, sizeof=_artifact_size)
+        sizes = {"default": workers, **(pools or {})}
+        for stage in self.stages.values():
+            if stage.pool not in sizes:
+                raise ValueError(f"Stage {stage.name} uses unknown pool {stage.pool}")
+        self._pools = {name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"pipeline-{name}")
+                       for name, size in sizes.items()}
+        watch_cache("pipeline_memo", self.memo)
+        # Stages submitted but not yet picked up by a worker, per pool
+        self._queued = {name: 0 for name in sizes}
+        self._queued_lock = threading.Lock()
+        for name in sizes:
+            QUEUE_DEPTH.set_function(lambda name=name: self._queued[name],
+                                     queue="pipeline" if name == "default" else f"pipeline_{name}")
+
+    def _count_queued(self, pool: str, delta: int):
+        with self._queued_lock:
+            self._queued[pool] += delta
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        visiting = set()
+
+        def visit(name: str):
+            if name in order or name not in self.stages:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle through stage {name}")
+            visiting.add(name)
+            for dep in self.stages[name].inputs:
+                visit(dep)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def _key(self, name: str, params: Dict[str, Any], keys: Dict[str, str]) -> str:
+        """Memo key of a graph input or stage, computed only for what the run touches."""
+        if name not in keys:
+            stage = self.stages.get(name)
+            if stage is None:
+                keys[name] = _content_key(params.get(name))
+            elif stage.when is not None and not stage.when(params) and stage.on_error == "passthrough":
+                # A disabled passthrough stage outputs its first input unchanged
+                keys[name] = self._key(stage.inputs[0], params, keys)
+            else:
+                version = stage.version() if stage.version else ""
+                parts = [name, version] + [self._key(i, params, keys) for i in stage.inputs]
+                keys[name] = hashlib.sha256("\0".join(parts).encode()).hexdigest()
+        return keys[name]
+
+    def _deps(self, name: str, run: GraphRun) -> Sequence[str]:
+        stage = self.stages[name]
+        result = run.stages.get(name)
+        return stage.inputs[:1] if result is not None and result.status == "disabled" else stage.inputs
+
+    def _plan(self, outputs: Sequence[str], params: Dict[str, Any], keys: Dict[str, str],
+              run: GraphRun, values: Dict[str, Any]) -> List[str]:
+        """Stages that must run for ``outputs``; memo hits and disabled stages are resolved here."""
+        needed: List[str] = []
+
+        def need(name: str):
+            if name in values or name in needed or name in run.stages:
+                return
+            stage = self.stages[name]
+            if stage.when is not None and not stage.when(params):
+                run.stages[name] = StageResult("disabled")
+                if stage.on_error == "passthrough":
+                    need(stage.inputs[0])
+                    needed.append(name)
+                else:
+                    values[name] = None
+                return
+            if stage.memo:
+                cached = self.memo.get((name, self._key(name, params, keys)))
+                if cached is not None:
+                    values[name] = cached
+                    run.stages[name] = StageResult("cached")
+                    return
+            for dep in stage.inputs:
+                need(dep)
+            needed.append(name)
+
+        for name in outputs:
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage: {name}")
+            need(name)
+        return needed
+
+    def _finish(self, stage: Stage, run: GraphRun, values: Dict[str, Any], key: str,
+                started: float, result: Any = None, error: Optional[BaseException] = None):
+        duration = round(time.perf_counter() - started, 4)
+        if error is None and stage.output is not None and result is not None and not isinstance(result, stage.output):
+            error = TypeError(f"expected {stage.output.__name__}, got {type(result).__name__}")
+        status = "ok" if error is None else "timeout" if isinstance(error, TimeoutError) else "failed"
+        PIPELINE_STAGE_SECONDS.observe(duration, stage=stage.name, status=status)
+        if error is None:
+            values[stage.name] = result
+            run.stages[stage.name] = StageResult("ok", duration)
+            if stage.memo and result is not None:
+                self.memo.put((stage.name, key), result)
+            return
+        run.stages[stage.name] = StageResult(status, duration, str(error) or type(error).__name__)
+        if stage.on_error == "raise":
+            raise GraphError(stage.name, error)
+        log.warning("Stage %s %s (%s), policy %s", stage.name, status, error, stage.on_error)
+        values[stage.name] = values[stage.inputs[0]] if stage.on_error == "passthrough" else _SKIPPED
+
+    def run(self, params: Dict[str, Any], outputs: Sequence[str]) -> GraphRun:
+        """Execute what is needed for ``outputs`` given the graph inputs in ``params`` (missing ones are None)."""
+        unknown = set(params) - self.inputs - self.options
+        if unknown:
+            raise ValueError(f"Unknown graph inputs: {', '.join(sorted(unknown))}")
+        run = GraphRun()
+        keys: Dict[str, str] = {}
+        values: Dict[str, Any] = {name: params.get(name) for name in self.inputs}
+        pending = self._plan(outputs, params, keys, run, values)
+        running: Dict[Future, _Task] = {}
+        try:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    deps = self._deps(name, run)
+                    if not all(dep in values for dep in deps):
+                        continue
+                    pending.remove(name)
+                    if deps is not stage.inputs:
+                        values[name] = values[deps[0]]
+                    elif any(values[dep] is _SKIPPED for dep in stage.inputs):
+                        run.stages[name] = StageResult("skipped")
+                        values[name] = _SKIPPED
+                    else:
+                        args = {dep: values[dep] for dep in stage.inputs}
+                        task = _Task(stage, lambda pool=stage.pool: self._count_queued(pool, -1))
+                        self._count_queued(stage.pool, 1)
+                        future = self._pools[stage.pool].submit(task, copy_context(), run, args)
+                        running[future] = task
+                if not running:
+                    if pending:
+                        raise RuntimeError(f"Stages cannot be scheduled: {', '.join(pending)}")
+                    break
+                now = time.perf_counter()
+                deadline = min(task.deadline for task in running.values())
+                if any(task.started is None for task in running.values()):
+                    # A queued stage's deadline only begins once a worker starts it
+                    deadline = min(deadline, now + _START_POLL_S)
+                done, _ = wait(list(running), timeout=max(0.0, deadline - now), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    error = future.exception()
+                    self._finish(task.stage, run, values, self._key(task.stage.name, params, keys), task.started,
+                                 None if error else future.result(), error)
+                now = time.perf_counter()
+                for future, task in list(running.items()):
+                    if now >= task.deadline:
+                        del running[future]
+                        self._finish(task.stage, run, values, self._key(task.stage.name, params, keys), task.started,
+                                     error=TimeoutError(f"no result after {task.stage.timeout_s}s"))
+        except GraphError:
+            for future, task in running.items():
+                if future.cancel():
+                    self._count_queued(task.stage.pool, -1)
+            raise
+        run.outputs = {name: (None if values.get(name) is _SKIPPED else values.get(name)) for name in outputs}
+        run.duration_s = round(run.elapsed_s, 4)
+        log.info("Graph run %s in %.3fs: %s", ",".join(outputs), run.duration_s,
+                 ", ".join(f"{n}={r.status}" for n, r in run.stages.items()))
+        return run
+
+    def stats(self) -> Dict:
+        return {"stages": self.order, "memo": self.memo.stats()}
+
+    def shutdown(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def build_inference_graph(container) -> InferenceGraph:
+    """decode -> tile -> detect -> merge -> verify -> persist, with the VLM answer alongside.
+
+    Graph inputs: ``image_bytes``; ``instruction``, ``adapter`` and ``max_new_tokens`` for
+    the optional VLM stage; ``persist`` and ``filename`` for saving an analysis. Services are
+    resolved from ``container`` when a stage runs, so the VLM only loads if it is asked.
+    """
+
+    def min_score():
+        # With a cascade, everything above its lower bound goes on to verification
+        cascade = container.yolo.cascade
+        return cascade.low if cascade is not None else None
+
+    def decode(run, image_bytes: bytes) -> Image.Image:
+        with timed("decode"):
+            return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+    def tile(run, decode: Image.Image) -> list:
+        return plan_regions(decode.size, container.yolo.params)
+
+    def detect(run, decode: Image.Image, tile: list) -> np.ndarray:
+        yolo = container.yolo
+        with yolo.slot.acquire() as bundle:
+            return yolo.predict_regions(decode, tile, bundle)
+
+    def merge(run, decode: Image.Image, detect: np.ndarray) -> DetectResponse:
+        return merge_detections(detect, decode.size, container.yolo.params, min_score())
+
+    def verify(run, decode: Image.Image, merge: DetectResponse) -> DetectResponse:
+        yolo = container.yolo
+        detect_s = run.stages["detect"].duration_s if "detect" in run.stages else None
+        return yolo.cascade.apply(decode, merge, yolo.class_names, detect_s=detect_s,
+                                  fallback_min_score=yolo.params.min_score(decode.size))
+
+    def vlm(run, image_bytes: bytes, instruction: str, adapter, max_new_tokens: int) -> str:
+        return container.vlm.answer_bytes(image_bytes, instruction, max_new_tokens=max_new_tokens, adapter=adapter)
+
+    def persist(run, image_bytes: bytes, filename, verify: DetectResponse) -> AnalysisResult:
+        return container.analysis.save_analysis(
+            analysis_id=str(uuid.uuid4()),
+            filename=filename or "upload",
+            detection_result=verify,
+            processing_time=int(run.elapsed_s * 1000),
+            image_data=image_bytes,
+        )
+
+    def detector_version() -> str:
+        return f"{container.yolo.slot.version}|{container.yolo.params.key()}"
+
+    def merge_version() -> str:
+        return f"{container.yolo.params.key()}|{min_score()}"
+
+    def cascade_version() -> str:
+        cascade = container.yolo.cascade
+        if cascade is None:
+            return ""
+        # Results served without the verifier must not be reused once it becomes available
+        available = getattr(cascade.verifier, "available", True)
+        return f"{cascade.verifier.name}|{cascade.low}|{cascade.high}|{available}"
+
+    def vlm_version() -> str:
+        service = container.vlm
+        return f"{service.model_id}|{service.adapter_name}"
+
+    stages = [
+        Stage("decode", decode, ["image_bytes"], Image.Image, timeout_s=10, memo=False),
+        Stage("tile", tile, ["decode"], list, timeout_s=5, version=lambda: container.yolo.params.key()),
+        Stage("detect", detect, ["decode", "tile"], np.ndarray, timeout_s=settings.pipeline_detect_timeout_s,
+              version=detector_version),
+        Stage("merge", merge, ["decode", "detect"], DetectResponse, timeout_s=5, version=merge_version),
+        # Verification is an improvement, not a requirement: on failure serve the merged detections
+        Stage("verify", verify, ["merge", "decode"], DetectResponse, timeout_s=settings.pipeline_verify_timeout_s,
+              on_error="passthrough", when=lambda p: container.yolo.cascade is not None, version=cascade_version),
+        Stage("vlm", vlm, ["image_bytes", "instruction", "adapter", "max_new_tokens"], str,
+              timeout_s=settings.pipeline_vlm_timeout_s, on_error="skip",
+              when=lambda p: bool(p.get("instruction")), version=vlm_version, pool="vlm"),
+        Stage("persist", persist, ["verify", "image_bytes", "filename"], AnalysisResult, timeout_s=30,
+              memo=False, when=lambda p: bool(p.get("persist"))),
+    ]
+    # Answers can take minutes; on their own pool they cannot hold up detection
+    return InferenceGraph(stages, workers=settings.pipeline_workers, options=["persist"],
+                          pools={"vlm": settings.pipeline_vlm_workers})
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+import threading
+import time
+
+
+class AdapterPool:
+    """Bookkeeping for the LoRA adapters resident on the shared VLM base model.
+
+    Adapters are kept in least-recently-used order together with their weight size.
+    ``evictable()`` names the adapters to unload to get back under ``max_bytes``; adapters
+    pinned by in-flight requests and the names in ``protect`` are never chosen. The model
+    surgery itself is done by VLMService.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._adapters: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._adapters
+
+    @property
+    def current_bytes(self) -> int:
+        return sum(a["bytes"] for a in self._adapters.values())
+
+    def add(self, name: str, path: str, nbytes: int, pinned: bool = False):
+        with self._lock:
+            self._adapters[name] = {"path": path, "bytes": nbytes, "pins": 1 if pinned else 0,
+                                    "loaded_at": time.time(), "last_used": time.time()}
+            self.loads += 1
+
+    def remove(self, name: str):
+        with self._lock:
+            if self._adapters.pop(name, None) is not None:
+                self.evictions += 1
+
+    def pin(self, name: str) -> bool:
+        """Mark ``name`` in use and most recently used; False if it is not resident."""
+        with self._lock:
+            adapter = self._adapters.get(name)
+            if adapter is None:
+                return False
+            adapter["pins"] += 1
+            adapter["last_used"] = time.time()
+            self._adapters.move_to_end(name)
+            return True
+
+    def unpin(self, name: str):
+        with self._lock:
+            adapter = self._adapters.get(name)
+            if adapter is not None and adapter["pins"] > 0:
+                adapter["pins"] -= 1
+
+    def evictable(self, protect: Iterable[Optional[str]] = ()) -> List[str]:
+        protect = set(protect)
+        with self._lock:
+            excess = sum(a["bytes"] for a in self._adapters.values()) - self.max_bytes
+            victims = []
+            for name, adapter in self._adapters.items():
+                if excess <= 0:
+                    break
+                if adapter["pins"] or name in protect:
+                    continue
+                victims.append(name)
+                excess -= adapter["bytes"]
+            return victims
+
+    def stats(self) -> Dict:
+        with self._lock:
+            adapters = [{"name": name, **adapter} for name, adapter in reversed(self._adapters.items())]
+        return {
+            "resident": adapters,
+            "bytes": sum(a["bytes"] for a in adapters),
+            "max_bytes": self.max_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -3,15 +3,16 @@ import os
 from datetime import datetime
 from typing import List, Optional, Dict, Any
 from pathlib import Path
+from app.core.metrics import timed
 from app.models.schemas import AnalysisResult, DetectResponse
 import base64
 
 class AnalysisService:
-    def __init__(self):
-        # Use absolute paths relative to the backend directory
-        backend_root = Path(__file__).parent.parent.parent
-        self.data_dir = backend_root / "data" / "analyses"
-        self.images_dir = backend_root / "data" / "images"
+    def __init__(self, data_root: Optional[Path] = None):
+        # Use absolute paths relative to the backend directory unless given a root
+        data_root = Path(data_root) if data_root else Path(__file__).parent.parent.parent / "data"
+        self.data_dir = data_root / "analyses"
+        self.images_dir = data_root / "images"
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.images_dir.mkdir(parents=True, exist_ok=True)
         self.analyses_file = self.data_dir / "analyses.json"
@@ -23,14 +24,14 @@ class AnalysisService:
     def _load_analyses_data(self) -> List[Dict[str, Any]]:
         """Load analyses data from JSON file"""
         try:
-            with open(self.analyses_file, 'r') as f:
+            with timed("store_read"), open(self.analyses_file, 'r') as f:
                 return json.load(f)
         except (FileNotFoundError, json.JSONDecodeError):
             return []
     
     def _save_analyses_data(self, analyses: List[Dict[str, Any]]):
         """Save analyses data to JSON file"""
-        with open(self.analyses_file, 'w') as f:
+        with timed("store_write"), open(self.analyses_file, 'w') as f:
             json.dump(analyses, f, indent=2, default=str)
     
     def save_analysis(
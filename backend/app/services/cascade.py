@@ -0,0 +1,145 @@
+from typing import Callable, Dict, List, Optional, Sequence
+from app.core.config import settings
+from app.models.schemas import DetectResponse
+from PIL import Image
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class ClassifierVerifier:
+    """Checks crops with an ultralytics classification model (e.g. a fine-tuned yolov8n-cls).
+
+    A crop is accepted when the classifier's top class is the detected class. Classifiers
+    trained with a "background" class reject false positives through it.
+    """
+
+    name = "classifier"
+
+    def __init__(self, weights: str):
+        from ultralytics import YOLO
+        self.model = YOLO(weights)
+        self.weights = weights
+
+    def verify(self, crops: Sequence[Image.Image], class_names: Sequence[str]) -> List[bool]:
+        results = self.model.predict(source=list(crops), imgsz=settings.cascade_crop_size, verbose=False)
+        accepted = []
+        for res, expected in zip(results, class_names):
+            top = res.names[int(res.probs.top1)]
+            accepted.append(top == expected and float(res.probs.top1conf) >= settings.cascade_accept_prob)
+        return accepted
+
+
+class VLMVerifier:
+    """Checks crops by asking the VLM a short yes/no question, all crops in one batch."""
+
+    name = "vlm"
+
+    def __init__(self, get_vlm: Callable[[], object]):
+        # Resolved per call so the verifier never forces the VLM to load
+        self.get_vlm = get_vlm
+
+    @property
+    def available(self) -> bool:
+        return getattr(self.get_vlm(), "is_loaded", False)
+
+    def verify(self, crops: Sequence[Image.Image], class_names: Sequence[str]) -> List[bool]:
+        questions = [f"Is this a {name.replace('_', ' ')} symbol? Answer yes or no." for name in class_names]
+        answers = self.get_vlm().answer_images(crops, questions, max_new_tokens=2)
+        return [answer.strip().lower().startswith("yes") for answer in answers]
+
+
+class CascadeStage:
+    """Second-stage verification of detections in the uncertainty band.
+
+    Detections scoring at least ``high`` are kept without verification, detections in
+    ``[low, high)`` are cropped and checked in batches by the verifier, and anything below
+    ``low`` is dropped. While the verifier is unavailable, the band is only kept down to
+    ``fallback_min_score``, the cutoff the detector serves without a cascade (``high`` if not
+    given). Per-stage timing and accept/reject counts are attached to the response.
+    """
+
+    def __init__(self, verifier, low: float, high: float, padding: float = 0.25,
+                 crop_size: int = 112, batch_size: int = 16):
+        self.verifier = verifier
+        self.low = low
+        self.high = high
+        self.padding = padding
+        self.crop_size = crop_size
+        self.batch_size = batch_size
+
+    def _crop(self, img: Image.Image, box) -> Image.Image:
+        pad_x, pad_y = int(box.w * self.padding), int(box.h * self.padding)
+        region = (max(0, box.x - pad_x), max(0, box.y - pad_y),
+                  min(img.width, box.x + box.w + pad_x), min(img.height, box.y + box.h + pad_y))
+        crop = img.crop(region)
+        # Square canvas keeps the symbol's aspect ratio at the classifier input size
+        crop.thumbnail((self.crop_size, self.crop_size), Image.LANCZOS)
+        canvas = Image.new("RGB", (self.crop_size, self.crop_size), "white")
+        canvas.paste(crop, ((self.crop_size - crop.width) // 2, (self.crop_size - crop.height) // 2))
+        return canvas
+
+    def apply(self, img: Image.Image, response: DetectResponse, class_names: Dict[int, str],
+              detect_s: Optional[float] = None, fallback_min_score: Optional[float] = None) -> DetectResponse:
+        started = time.perf_counter()
+        keep = []
+        uncertain = []
+        dropped = 0
+        for i, score in enumerate(response.scores):
+            if score >= self.high:
+                keep.append(i)
+            elif score >= self.low:
+                uncertain.append(i)
+            else:
+                dropped += 1
+
+        accepted = []
+        verifier_used = bool(uncertain) and getattr(self.verifier, "available", True)
+        unverified_min_score = None
+        if verifier_used:
+            for start in range(0, len(uncertain), self.batch_size):
+                batch = uncertain[start:start + self.batch_size]
+                crops = [self._crop(img, response.boxes[i]) for i in batch]
+                names = [class_names.get(int(c), c) if c.isdigit() else c
+                         for c in (response.classes[i] for i in batch)]
+                accepted += [i for i, ok in zip(batch, self.verifier.verify(crops, names)) if ok]
+        elif uncertain:
+            # No verifier to ask; serve what the detector alone would, not the whole band
+            unverified_min_score = self.high if fallback_min_score is None else fallback_min_score
+            accepted = [i for i in uncertain if response.scores[i] >= unverified_min_score]
+
+        kept = sorted(keep + accepted, key=lambda i: response.scores[i], reverse=True)
+        stats = {
+            "verifier": self.verifier.name if verifier_used else None,
+            "band": [self.low, self.high],
+            "confident": len(keep),
+            "verified": len(uncertain) if verifier_used else 0,
+            "unverified_min_score": unverified_min_score,
+            "accepted": len(accepted),
+            "rejected": len(uncertain) - len(accepted),
+            "below_band": dropped,
+            "timing_s": {"detect": detect_s, "verify": round(time.perf_counter() - started, 4)},
+        }
+        log.info("Cascade: %d confident, %d/%d uncertain accepted by %s",
+                 len(keep), len(accepted), len(uncertain), stats["verifier"])
+        return DetectResponse(
+            boxes=[response.boxes[i] for i in kept],
+            classes=[response.classes[i] for i in kept],
+            scores=[response.scores[i] for i in kept],
+            cascade=stats,
+        )
+
+
+def build_cascade(get_vlm: Callable[[], object]) -> Optional[CascadeStage]:
+    """Cascade stage configured by settings, or None when disabled."""
+    if not settings.cascade_enabled:
+        return None
+    if settings.cascade_verifier == "classifier":
+        verifier = ClassifierVerifier(settings.cascade_classifier_weights)
+    elif settings.cascade_verifier == "vlm":
+        verifier = VLMVerifier(get_vlm)
+    else:
+        raise ValueError(f"Unknown cascade verifier: {settings.cascade_verifier}")
+    return CascadeStage(verifier, settings.cascade_low, settings.cascade_high, settings.cascade_crop_padding,
+                        settings.cascade_crop_size, settings.cascade_batch_size)
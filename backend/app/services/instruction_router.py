@@ -0,0 +1,136 @@
+from typing import Dict, List, Optional
+from app.core.config import settings
+import re
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+COUNT_RE = re.compile(r"\b(how many|count|number of|total)\b")
+LOCATION_RE = re.compile(r"\b(where|locate|location|locations|position|positions|coordinates|find)\b")
+# Qualifiers the detector cannot evaluate; such questions go to the VLM
+COMPLEX_RE = re.compile(r"\b(not|except|excluding|without|than|between|near|next to|why|explain|describe|compare)\b")
+# Spatial qualifiers need the layout of the plan ("on the left", "in the kitchen", "relative to")
+SPATIAL_RE = re.compile(r"\b(left|right|top|bottom|upper|lower|above|below|under|over|corner|side|in|inside|within"
+                        r"|relative|room|rooms|wall|walls|floor|level)\b")
+# ... except phrases that only name the whole image, as in "how many boards are in this plan"
+WHOLE_IMAGE_RE = re.compile(r"\b(in|on|inside|within|across) (the |this |that )?(whole |entire )?"
+                            r"(image|picture|plan|floor ?plan|drawing|sheet|page|layout)s?\b")
+# "count all the symbols" refers to every detector class
+ALL_CLASSES_RE = re.compile(r"\b(all|every)\s+(the\s+)?(symbols|objects|detections|items)\b")
+SYMBOL_NOUN_RE = re.compile(r"\b(symbols?|objects?|detections?|items?)\b")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def _plural(name: str) -> str:
+    return name + ("es" if name.endswith(("s", "x", "ch", "sh")) else "s")
+
+
+class RouteDecision:
+    def __init__(self, intent: str, class_ids: Optional[List[int]] = None, reason: str = ""):
+        self.intent = intent  # "count", "location" or "open"
+        self.class_ids = class_ids or []
+        self.reason = reason
+
+    @property
+    def use_detector(self) -> bool:
+        return self.intent in ("count", "location") and bool(self.class_ids)
+
+    def to_dict(self) -> Dict:
+        return {"intent": self.intent, "class_ids": self.class_ids, "reason": self.reason}
+
+
+class InstructionRouter:
+    """Answers count and location questions from detections and sends everything else to the VLM.
+
+    Routing is rule based: the instruction must ask for a count or a location of classes the
+    detector knows, by name, without qualifiers (including spatial ones) the detector cannot
+    check. Answers use every detection above the score thresholds, not the top ``max_det``,
+    and come from the YoloService result cache, so follow-up questions about a plan are cheap.
+    """
+
+    def __init__(self, yolo_service, vlm_service):
+        self.yolo = yolo_service
+        self.vlm = vlm_service
+
+    def classify(self, instruction: str) -> RouteDecision:
+        text = _normalize(instruction)
+        if LOCATION_RE.search(text):
+            intent = "location"
+        elif COUNT_RE.search(text):
+            intent = "count"
+        else:
+            return RouteDecision("open", reason="not a count or location question")
+        if COMPLEX_RE.search(text):
+            return RouteDecision("open", reason="qualifier the detector cannot evaluate")
+
+        names = self.yolo.class_names
+        mentioned = []
+        remainder = f" {text} "
+        for class_id, name in names.items():
+            readable = _normalize(name.replace("_", " "))
+            for form in (_plural(readable), readable):
+                # "light switch symbols" names the class too, consume the noun with it
+                pattern = re.compile(rf" {re.escape(form)}( {SYMBOL_NOUN_RE.pattern})? ")
+                if pattern.search(remainder):
+                    mentioned.append(class_id)
+                    remainder = pattern.sub(" ", remainder)
+                    break
+        # Checked with the class names taken out, so a class name never reads as a qualifier
+        if SPATIAL_RE.search(WHOLE_IMAGE_RE.sub(" ", remainder)):
+            return RouteDecision("open", reason="spatial qualifier the detector cannot evaluate")
+        if mentioned:
+            # Any other symbol noun left over ("light bulb symbols") is something the detector does not know
+            if SYMBOL_NOUN_RE.search(remainder) and not ALL_CLASSES_RE.search(text):
+                return RouteDecision("open", reason="mentions symbols the detector does not know")
+            return RouteDecision(intent, sorted(mentioned), reason="known classes")
+        if ALL_CLASSES_RE.search(text) and names:
+            return RouteDecision(intent, sorted(names), reason="all classes")
+        return RouteDecision("open", reason="no detector class mentioned")
+
+    def _detector_answer(self, decision: RouteDecision, image_bytes: bytes) -> Dict:
+        # Served responses keep only the top max_det boxes; counts need every detection above threshold
+        result = self.yolo.detect_bytes(image_bytes, self.yolo.params.uncapped())
+        names = self.yolo.class_names
+        wanted = {str(c) for c in decision.class_ids} | {names[c] for c in decision.class_ids if c in names}
+        boxes = [b for b, c in zip(result.boxes, result.classes) if c in wanted]
+        counts = {}
+        for c in result.classes:
+            if c in wanted:
+                label = names.get(int(c), c) if c.isdigit() else c
+                counts[label] = counts.get(label, 0) + 1
+        parts = []
+        for class_id in decision.class_ids:
+            name = names.get(class_id, str(class_id))
+            n = counts.get(name, 0)
+            readable = name.replace("_", " ")
+            parts.append(f"{n} {readable if n == 1 else _plural(readable)}")
+        summary = ", ".join(parts)
+        if decision.intent == "count":
+            answer = f"Found {summary}."
+        elif boxes:
+            coords = ", ".join(f"[{b.x}, {b.y}, {b.w}, {b.h}]" for b in boxes)
+            answer = f"Found {summary} at {coords}."
+        else:
+            answer = f"Found {summary}."
+        return {"answer": answer, "count": len(boxes), "counts": counts, "boxes": boxes}
+
+    def answer(self, image_bytes: bytes, instruction: str, max_new_tokens: int = 128,
+               adapter: Optional[str] = None) -> Dict:
+        started = time.perf_counter()
+        decision = self.classify(instruction) if settings.instruction_routing else RouteDecision("open", reason="routing disabled")
+        if decision.use_detector and self.yolo.model is not None:
+            response = self._detector_answer(decision, image_bytes)
+            response["path"] = "detector"
+        else:
+            if decision.use_detector:
+                decision.reason = "detector not loaded"
+            answer = self.vlm.answer_bytes(image_bytes, instruction, max_new_tokens=max_new_tokens, adapter=adapter)
+            response = {"answer": answer, "path": "vlm", "adapter": adapter or self.vlm.adapter_name}
+        response["route"] = decision.to_dict()
+        response["duration_s"] = round(time.perf_counter() - started, 3)
+        log.info("Answered via %s (%s) in %.3fs", response["path"], decision.reason, response["duration_s"])
+        return response
@@ -0,0 +1,362 @@
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.metrics import QUEUE_DEPTH
+from app.core.utils import save_json, load_json
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+import uuid
+import logging
+
+log = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("queued", "running")
+FINAL_STATES = ("completed", "failed", "cancelled", "interrupted")
+
+# Ultralytics epoch progress: "      3/50      1.2G      1.234 ..."
+EPOCH_RE = re.compile(r"^\s*(\d+)/(\d+)\s+\S+G?\s")
+# Ultralytics validation summary: "all  <images>  <instances>  P  R  mAP50  mAP50-95"
+VAL_RE = re.compile(r"^\s*all\s+(\d+)\s+(\d+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)")
+# HF Trainer logs: "{'loss': 1.23, 'learning_rate': 5e-05, 'epoch': 0.5}"
+HF_LOSS_RE = re.compile(r"'loss':\s*([\d.eE+-]+)")
+HF_EPOCH_RE = re.compile(r"'epoch':\s*([\d.]+)")
+
+
+def parse_metrics_line(line: str, metrics: Dict) -> bool:
+    """Update metrics from one training log line. Returns True if anything changed."""
+    m = VAL_RE.match(line)
+    if m:
+        entry = {
+            "epoch": metrics.get("epoch"),
+            "precision": float(m.group(3)),
+            "recall": float(m.group(4)),
+            "mAP50": float(m.group(5)),
+            "mAP50_95": float(m.group(6)),
+        }
+        metrics.update({k: v for k, v in entry.items() if k != "epoch"})
+        history = metrics.setdefault("history", [])
+        # The final validation of best.pt repeats the last epoch; keep one entry per epoch
+        if history and history[-1]["epoch"] == entry["epoch"]:
+            history[-1] = entry
+        else:
+            history.append(entry)
+        return True
+    m = EPOCH_RE.match(line)
+    if m:
+        epoch, total = int(m.group(1)), int(m.group(2))
+        if epoch <= total and (metrics.get("epoch"), metrics.get("total_epochs")) != (epoch, total):
+            metrics["epoch"] = epoch
+            metrics["total_epochs"] = total
+            return True
+        return False
+    m = HF_LOSS_RE.search(line)
+    if m:
+        metrics["loss"] = float(m.group(1))
+        e = HF_EPOCH_RE.search(line)
+        if e:
+            metrics["epoch"] = float(e.group(1))
+        return True
+    return False
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except (OSError, ProcessLookupError):
+        return False
+    return True
+
+
+class JobManager:
+    """Runs training scripts as detached subprocesses with bounded concurrency.
+
+    Job state is persisted to ``jobs.json`` in the jobs directory and each job writes
+    its combined stdout/stderr to its own log file, which is tailed for metrics.
+    """
+
+    def __init__(self, jobs_dir: Optional[str] = None, max_concurrent: Optional[int] = None):
+        self.jobs_dir = Path(jobs_dir or settings.training_jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.state_file = self.jobs_dir / "jobs.json"
+        self.max_concurrent = max(1, max_concurrent or settings.training_max_concurrent)
+        self._lock = threading.RLock()
+        self._jobs: Dict[str, Dict] = {}
+        self._procs: Dict[str, subprocess.Popen] = {}
+        self._queue: deque = deque()
+        self._load_state()
+        QUEUE_DEPTH.set_function(lambda: len(self._queue), queue="training")
+
+    # -- persistence -------------------------------------------------------
+
+    def _load_state(self):
+        if not self.state_file.exists():
+            return
+        try:
+            jobs = load_json(str(self.state_file))
+        except Exception as e:
+            log.warning("Could not read job state %s: %s", self.state_file, e)
+            return
+        for job in jobs:
+            if job["status"] == "queued":
+                self._queue.append(job["job_id"])
+            elif job["status"] == "running":
+                if _pid_alive(job.get("pid")):
+                    # Survived a server restart; keep watching it by pid
+                    threading.Thread(target=self._watch_orphan, args=(job["job_id"],), daemon=True).start()
+                else:
+                    job["status"] = "interrupted"
+                    job["finished_at"] = job.get("finished_at") or datetime.now().isoformat()
+            self._jobs[job["job_id"]] = job
+        self._persist()
+        self._schedule()
+
+    def _persist(self):
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j["created_at"])
+            tmp = self.state_file.with_suffix(".json.tmp")
+            save_json(str(tmp), jobs)
+            tmp.replace(self.state_file)
+
+    # -- public API --------------------------------------------------------
+
+    def submit(self, mode: str, cmd: List[str], cwd: Optional[str] = None) -> Dict:
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "mode": mode,
+            "cmd": cmd,
+            "cwd": cwd,
+            "status": "queued",
+            "pid": None,
+            "return_code": None,
+            "created_at": datetime.now().isoformat(),
+            "started_at": None,
+            "finished_at": None,
+            "log_path": str(self.jobs_dir / f"{job_id}.log"),
+            "metrics": {},
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._queue.append(job_id)
+            self._persist()
+        log.info("Queued training job %s: %s", job_id, " ".join(cmd))
+        self._schedule()
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+            if job["status"] == "queued":
+                job["queue_position"] = list(self._queue).index(job_id) + 1 if job_id in self._queue else None
+            return job
+
+    def list(self, status: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            jobs = [self.get(j) for j in self._jobs]
+        if status:
+            jobs = [j for j in jobs if j["status"] == status]
+        return sorted(jobs, key=lambda j: j["created_at"], reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                self._queue.remove(job_id)
+                self._finish(job, "cancelled", None)
+                return self.get(job_id)
+            if job["status"] != "running":
+                return self.get(job_id)
+            job["cancel_requested"] = True
+            pid = job["pid"]
+        self._terminate(pid)
+        return self.get(job_id)
+
+    def read_log(self, job_id: str, offset: int = 0, max_bytes: int = 65536) -> Optional[Dict]:
+        """Return log content starting at ``offset`` so clients can poll incrementally."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        path = Path(job["log_path"])
+        if not path.exists():
+            return {"offset": offset, "next_offset": offset, "data": ""}
+        with path.open("rb") as f:
+            f.seek(offset)
+            data = f.read(max_bytes)
+        return {"offset": offset, "next_offset": offset + len(data), "data": data.decode("utf-8", errors="replace")}
+
+    # -- scheduling --------------------------------------------------------
+
+    def _running_count(self) -> int:
+        return sum(1 for j in self._jobs.values() if j["status"] == "running")
+
+    def _schedule(self):
+        with self._lock:
+            while self._queue and self._running_count() < self.max_concurrent:
+                self._start(self._queue.popleft())
+
+    def _apply_limits(self, pid: int):
+        """Nice level and address-space limit for a started child (POSIX only).
+
+        Applied from the parent rather than in a preexec_fn, which can deadlock the child of a
+        multi-threaded server. Processes the job starts afterwards (e.g. data loader workers)
+        inherit both.
+        """
+        nice = settings.training_nice
+        memory_mb = settings.training_memory_limit_mb
+        if nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, pid) + nice)
+            except OSError as e:
+                log.warning("Could not lower the priority of pid %s: %s", pid, e)
+        if memory_mb:
+            import resource  # POSIX only
+            if not hasattr(resource, "prlimit"):
+                log.warning("training_memory_limit_mb needs resource.prlimit (Linux); pid %s is not limited", pid)
+                return
+            limit = memory_mb * 1024 * 1024
+            try:
+                resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+            except (OSError, ValueError) as e:
+                log.warning("Could not limit the memory of pid %s: %s", pid, e)
+
+    def _start(self, job_id: str):
+        job = self._jobs[job_id]
+        env = os.environ.copy()
+        env["PYTHONUNBUFFERED"] = "1"
+        if settings.training_num_threads:
+            for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+                env[var] = str(settings.training_num_threads)
+        popen_kwargs = {}
+        if os.name == "posix":
+            # Own session so the whole process tree can be signalled and survives API reloads
+            popen_kwargs["start_new_session"] = True
+        else:
+            popen_kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        try:
+            log_file = open(job["log_path"], "ab")
+            proc = subprocess.Popen(
+                job["cmd"], cwd=job["cwd"], env=env, stdout=log_file, stderr=subprocess.STDOUT,
+                stdin=subprocess.DEVNULL, **popen_kwargs
+            )
+            log_file.close()
+            if os.name == "posix":
+                self._apply_limits(proc.pid)
+        except Exception as e:
+            log.exception("Failed to start training job %s: %s", job_id, e)
+            job["error"] = str(e)
+            self._finish(job, "failed", None)
+            return
+        job.update(status="running", pid=proc.pid, started_at=datetime.now().isoformat())
+        self._procs[job_id] = proc
+        self._persist()
+        log.info("Started training job %s (pid %s)", job_id, proc.pid)
+        threading.Thread(target=self._monitor, args=(job_id, proc), daemon=True).start()
+
+    def _finish(self, job: Dict, status: str, return_code: Optional[int]):
+        with self._lock:
+            job.update(status=status, return_code=return_code, finished_at=datetime.now().isoformat())
+            self._procs.pop(job["job_id"], None)
+            self._persist()
+        log.info("Training job %s %s (rc=%s)", job["job_id"], status, return_code)
+
+    def _terminate(self, pid: Optional[int], grace: float = 10.0):
+        if not _pid_alive(pid):
+            return
+        try:
+            if os.name == "posix":
+                os.killpg(os.getpgid(pid), signal.SIGTERM)
+            else:
+                os.kill(pid, signal.CTRL_BREAK_EVENT)
+        except (OSError, ProcessLookupError):
+            return
+
+        def escalate():
+            deadline = time.time() + grace
+            while time.time() < deadline:
+                if not _pid_alive(pid):
+                    return
+                time.sleep(0.5)
+            try:
+                if os.name == "posix":
+                    os.killpg(os.getpgid(pid), signal.SIGKILL)
+                else:
+                    os.kill(pid, signal.SIGTERM)
+            except (OSError, ProcessLookupError):
+                pass
+        threading.Thread(target=escalate, daemon=True).start()
+
+    # -- monitoring --------------------------------------------------------
+
+    def _tail_metrics(self, job: Dict, position: int, pending: str):
+        """Parse log lines appended since ``position``; returns the new position and partial line."""
+        try:
+            with open(job["log_path"], "rb") as f:
+                f.seek(position)
+                chunk = f.read()
+        except FileNotFoundError:
+            return position, pending
+        if not chunk:
+            return position, pending
+        text = pending + chunk.decode("utf-8", errors="replace")
+        # Progress bars redraw with carriage returns, treat them as line breaks
+        lines = re.split(r"[\r\n]", text)
+        pending = lines.pop()
+        changed = False
+        with self._lock:
+            for line in lines:
+                changed |= parse_metrics_line(line, job["metrics"])
+            if changed:
+                self._persist()
+        return position + len(chunk), pending
+
+    def _monitor(self, job_id: str, proc: subprocess.Popen):
+        job = self._jobs[job_id]
+        position, pending = 0, ""
+        while proc.poll() is None:
+            position, pending = self._tail_metrics(job, position, pending)
+            time.sleep(1.0)
+        self._tail_metrics(job, position, pending + "\n")
+        if job.get("cancel_requested"):
+            status = "cancelled"
+        else:
+            status = "completed" if proc.returncode == 0 else "failed"
+        self._finish(job, status, proc.returncode)
+        self._schedule()
+
+    def _watch_orphan(self, job_id: str):
+        job = self._jobs[job_id]
+        position, pending = 0, ""
+        while _pid_alive(job["pid"]):
+            position, pending = self._tail_metrics(job, position, pending)
+            time.sleep(2.0)
+        self._tail_metrics(job, position, pending + "\n")
+        # Exit code of a process we did not spawn is unknown
+        self._finish(job, "cancelled" if job.get("cancel_requested") else "interrupted", None)
+        self._schedule()
+
+
+_job_manager: Optional[JobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """Process-wide job manager shared by every TrainingService."""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager()
+        return _job_manager
@@ -0,0 +1,185 @@
+from typing import Callable, Dict, List, Optional
+from app.core.config import settings
+from app.core.utils import save_json, load_json
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import shutil
+import threading
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+MODEL_KINDS = ("yolo", "vlm_adapter")
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    files = [path] if path.is_file() else sorted(p for p in path.rglob("*") if p.is_file())
+    for f in files:
+        with f.open("rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class ModelRegistry:
+    """Versioned model store under ``settings.model_dir``/registry.
+
+    Layout::
+
+        registry/<kind>/<version>/meta.json
+        registry/<kind>/<version>/<weights file or adapter files>
+        registry/<kind>/state.json   # active version and promotion history
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = Path(root or Path(settings.model_dir) / "registry")
+        self._lock = threading.RLock()
+        self._deployments: Dict[str, Dict] = {}
+
+    def _kind_dir(self, kind: str) -> Path:
+        if kind not in MODEL_KINDS:
+            raise ValueError(f"Unknown model kind: {kind}")
+        return self.root / kind
+
+    def _state(self, kind: str) -> Dict:
+        path = self._kind_dir(kind) / "state.json"
+        if path.exists():
+            return load_json(str(path))
+        return {"active": None, "history": []}
+
+    def _save_state(self, kind: str, state: Dict):
+        path = self._kind_dir(kind) / "state.json"
+        tmp = path.with_suffix(".json.tmp")
+        save_json(str(tmp), state)
+        # Atomic replace so a crash never leaves a half-written active pointer
+        tmp.replace(path)
+
+    # -- versions ----------------------------------------------------------
+
+    def register(self, kind: str, source: str, metrics: Optional[Dict] = None, notes: str = "") -> Dict:
+        src = Path(source)
+        if not src.exists():
+            raise FileNotFoundError(f"Model not found: {source}")
+        if metrics is None:
+            # Incremental YOLO runs leave a report next to the weights directory
+            report = src.parent.parent / "incremental_report.json"
+            if src.is_file() and report.exists():
+                metrics = load_json(str(report)).get("after")
+        with self._lock:
+            kind_dir = self._kind_dir(kind)
+            kind_dir.mkdir(parents=True, exist_ok=True)
+            numbers = [int(p.name[1:]) for p in kind_dir.glob("v*") if p.name[1:].isdigit()]
+            version = f"v{max(numbers, default=0) + 1}"
+            version_dir = kind_dir / version
+            version_dir.mkdir()
+            if src.is_dir():
+                shutil.copytree(src, version_dir / "adapter")
+                artifact = version_dir / "adapter"
+            else:
+                artifact = version_dir / src.name
+                shutil.copy2(src, artifact)
+            meta = {
+                "version": version,
+                "kind": kind,
+                "source": str(src.resolve()),
+                "path": str(artifact.resolve()),
+                "sha256": _sha256(artifact),
+                "created_at": datetime.now().isoformat(),
+                "metrics": metrics or {},
+                "notes": notes,
+            }
+            save_json(str(version_dir / "meta.json"), meta)
+        log.info("Registered %s %s from %s", kind, version, source)
+        return meta
+
+    def get(self, kind: str, version: str) -> Optional[Dict]:
+        meta_path = self._kind_dir(kind) / version / "meta.json"
+        return load_json(str(meta_path)) if meta_path.exists() else None
+
+    def list(self, kind: str) -> List[Dict]:
+        kind_dir = self._kind_dir(kind)
+        if not kind_dir.exists():
+            return []
+        metas = [load_json(str(p)) for p in kind_dir.glob("v*/meta.json")]
+        return sorted(metas, key=lambda m: int(m["version"][1:]), reverse=True)
+
+    def active(self, kind: str) -> Optional[Dict]:
+        version = self._state(kind)["active"]
+        return self.get(kind, version) if version else None
+
+    def active_path(self, kind: str) -> Optional[str]:
+        meta = self.active(kind)
+        return meta["path"] if meta else None
+
+    # -- deployment --------------------------------------------------------
+
+    def deployment_status(self, kind: str) -> Dict:
+        with self._lock:
+            status = dict(self._deployments.get(kind) or {"state": "idle"})
+        status["active"] = self._state(kind)["active"]
+        return status
+
+    def promote(self, kind: str, version: str, swap: Callable[[str, str], None], rollback: bool = False) -> Dict:
+        """Load, warm up and swap in ``version`` on a background thread.
+
+        ``swap(path, version)`` is the serving side's loader; it must only return once the
+        new model is live. A dict it returns (e.g. the drain status of the old model) is added
+        to the deployment record. The active pointer is updated after the swap succeeds.
+        """
+        meta = self.get(kind, version)
+        if meta is None:
+            raise KeyError(f"{kind} version {version} not found")
+        with self._lock:
+            current = self._deployments.get(kind)
+            if current and current["state"] in ("loading", "swapping"):
+                raise RuntimeError(f"A {kind} deployment of {current['version']} is already in progress")
+            deployment = {"version": version, "state": "loading", "started_at": datetime.now().isoformat(),
+                          "rollback": rollback, "error": None}
+            self._deployments[kind] = deployment
+
+        def run():
+            started = time.time()
+            try:
+                report = swap(meta["path"], version)
+                with self._lock:
+                    state = self._state(kind)
+                    if rollback:
+                        if state["history"] and state["history"][-1] == version:
+                            state["history"].pop()
+                    elif state["active"] and state["active"] != version:
+                        state["history"].append(state["active"])
+                    state["active"] = version
+                    self._save_state(kind, state)
+                    deployment.update(state="done", duration_s=round(time.time() - started, 3))
+                    if isinstance(report, dict):
+                        deployment.update(report)
+                log.info("Promoted %s %s in %.1fs", kind, version, time.time() - started)
+            except Exception as e:
+                log.exception("Promotion of %s %s failed: %s", kind, version, e)
+                with self._lock:
+                    deployment.update(state="failed", error=str(e))
+
+        threading.Thread(target=run, daemon=True).start()
+        return dict(deployment)
+
+    def rollback(self, kind: str, swap: Callable[[str, str], None]) -> Dict:
+        history = self._state(kind)["history"]
+        if not history:
+            raise KeyError(f"No previous {kind} version to roll back to")
+        return self.promote(kind, history[-1], swap, rollback=True)
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """Process-wide model registry; warm-up and request threads may ask for it concurrently."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
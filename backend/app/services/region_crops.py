@@ -0,0 +1,148 @@
+from typing import List, Optional, Sequence, Tuple
+from app.models.schemas import Box
+from PIL import Image
+import math
+import re
+import logging
+
+log = logging.getLogger(__name__)
+
+# "[x, y, w, h]" as produced by the fine-tuning targets (TrainingService._generate_output_from_boxes)
+BOX_RE = re.compile(r"\[\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\]")
+
+Region = Tuple[int, int, int, int]  # x0, y0, x1, y1 in original pixels
+
+
+class Tile:
+    """One crop of the original image placed on the mosaic at ``scale``."""
+
+    def __init__(self, region: Region, dst_x: int, dst_y: int, scale: float):
+        self.region = region
+        self.dst_x = dst_x
+        self.dst_y = dst_y
+        self.scale = scale
+
+    @property
+    def dst_w(self) -> int:
+        return max(1, round((self.region[2] - self.region[0]) * self.scale))
+
+    @property
+    def dst_h(self) -> int:
+        return max(1, round((self.region[3] - self.region[1]) * self.scale))
+
+    def contains(self, x: float, y: float) -> bool:
+        return self.dst_x <= x < self.dst_x + self.dst_w and self.dst_y <= y < self.dst_y + self.dst_h
+
+    def to_original(self, x: float, y: float) -> Tuple[float, float]:
+        return self.region[0] + (x - self.dst_x) / self.scale, self.region[1] + (y - self.dst_y) / self.scale
+
+    def to_dict(self):
+        x0, y0, x1, y1 = self.region
+        return {"source": [x0, y0, x1 - x0, y1 - y0], "mosaic": [self.dst_x, self.dst_y, self.dst_w, self.dst_h],
+                "scale": round(self.scale, 4)}
+
+
+class Mosaic:
+    """Crops of a large sheet packed onto one small image, with the mapping back."""
+
+    def __init__(self, image: Image.Image, tiles: List[Tile], original_size: Tuple[int, int]):
+        self.image = image
+        self.tiles = tiles
+        self.original_size = original_size
+
+    def tile_at(self, x: float, y: float) -> Optional[Tile]:
+        for tile in self.tiles:
+            if tile.contains(x, y):
+                return tile
+        return None
+
+    def to_original_box(self, x: float, y: float, w: float, h: float) -> Optional[Box]:
+        """Map an [x, y, w, h] box on the mosaic to the original image, clipped to its tile."""
+        tile = self.tile_at(x + w / 2, y + h / 2)
+        if tile is None:
+            return None
+        x0 = min(max(x, tile.dst_x), tile.dst_x + tile.dst_w)
+        y0 = min(max(y, tile.dst_y), tile.dst_y + tile.dst_h)
+        x1 = min(max(x + w, tile.dst_x), tile.dst_x + tile.dst_w)
+        y1 = min(max(y + h, tile.dst_y), tile.dst_y + tile.dst_h)
+        ox0, oy0 = tile.to_original(x0, y0)
+        ox1, oy1 = tile.to_original(x1, y1)
+        return Box(x=int(round(ox0)), y=int(round(oy0)), w=max(1, int(round(ox1 - ox0))), h=max(1, int(round(oy1 - oy0))))
+
+    def remap_answer(self, answer: str) -> Tuple[str, List[Box]]:
+        """Rewrite "[x, y, w, h]" boxes in a VLM answer from mosaic to original coordinates."""
+        boxes: List[Box] = []
+
+        def replace(match):
+            box = self.to_original_box(*(float(v) for v in match.groups()))
+            if box is None:
+                return match.group(0)
+            boxes.append(box)
+            return f"[{box.x}, {box.y}, {box.w}, {box.h}]"
+
+        return BOX_RE.sub(replace, answer), boxes
+
+
+def select_regions(boxes: Sequence[Box], image_size: Tuple[int, int], margin: int) -> List[Region]:
+    """Context windows around detections, with overlapping windows merged."""
+    img_w, img_h = image_size
+    regions = [
+        [max(0, b.x - margin), max(0, b.y - margin), min(img_w, b.x + b.w + margin), min(img_h, b.y + b.h + margin)]
+        for b in boxes
+    ]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(len(regions) - 1, i, -1):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+    regions = [r for r in regions if r[2] > r[0] and r[3] > r[1]]
+    # Reading order keeps neighbouring symbols near each other on the mosaic
+    return [tuple(r) for r in sorted(regions, key=lambda r: (r[1], r[0]))]
+
+
+def _pack(regions: Sequence[Region], scale: float, gap: int) -> Tuple[List[Tile], int, int]:
+    """Shelf packing into a roughly square canvas."""
+    sizes = [(max(1, round((r[2] - r[0]) * scale)), max(1, round((r[3] - r[1]) * scale))) for r in regions]
+    area = sum((w + gap) * (h + gap) for w, h in sizes)
+    row_width = max(max(w for w, _ in sizes), int(math.sqrt(area)))
+    tiles: List[Tile] = []
+    x = y = row_height = width = 0
+    for region, (w, h) in zip(regions, sizes):
+        if x and x + w > row_width:
+            y += row_height + gap
+            x = row_height = 0
+        tiles.append(Tile(region, x, y, scale))
+        width = max(width, x + w)
+        row_height = max(row_height, h)
+        x += w + gap
+    return tiles, width, y + row_height
+
+
+def build_mosaic(img: Image.Image, regions: Sequence[Region], max_pixels: int, gap: int = 8) -> Mosaic:
+    """Pack ``regions`` of ``img`` onto one canvas of at most ``max_pixels``.
+
+    Crops keep their original resolution when they fit and are scaled down uniformly
+    otherwise. With no regions the whole image is used.
+    """
+    regions = list(regions) or [(0, 0, img.width, img.height)]
+    scale = 1.0
+    while True:
+        tiles, width, height = _pack(regions, scale, gap)
+        if width * height <= max_pixels or scale < 0.01:
+            break
+        # Shrink towards the budget; repack since shelf waste changes with scale
+        scale *= min(0.95, math.sqrt(max_pixels / (width * height)))
+    canvas = Image.new("RGB", (width, height), "white")
+    for tile in tiles:
+        crop = img.crop(tile.region)
+        if crop.size != (tile.dst_w, tile.dst_h):
+            crop = crop.resize((tile.dst_w, tile.dst_h), Image.LANCZOS)
+        canvas.paste(crop, (tile.dst_x, tile.dst_y))
+    log.info("Mosaic of %d regions: %dx%d (original %dx%d, scale %.3f)",
+             len(tiles), width, height, img.width, img.height, scale)
+    return Mosaic(canvas, tiles, img.size)
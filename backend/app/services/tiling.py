@@ -0,0 +1,147 @@
+from typing import List, Tuple
+from pydantic import BaseModel
+from app.core.metrics import timed
+from app.models.schemas import Box, DetectResponse
+import json
+import numpy as np
+import logging
+
+log = logging.getLogger(__name__)
+
+Region = Tuple[int, int, int, int]  # x0, y0, x1, y1 in image pixels
+
+# Rows of raw detections: x0, y0, x1, y1, score, class id (image coordinates)
+EMPTY_DETECTIONS = np.zeros((0, 6), dtype=np.float32)
+# max_det that never cuts a plan short, for counting
+UNCAPPED_MAX_DET = 1_000_000
+
+
+class DetectionParams(BaseModel):
+    """Knobs of tiled detection; the defaults are the values the service has always used."""
+    sliced: bool = True  # slice images larger than slice_size (plus a full-image pass)
+    slice_size: int = 512
+    overlap: float = 0.3
+    imgsz: int = 512  # model input size per region
+    model_conf: float = 0.01  # model-side cutoff, the real thresholds are applied after merging
+    nms_iou: float = 0.3
+    merge_threshold: float = 0.5  # IOS for greedy_nmm across slices
+    min_score_sliced: float = 0.3
+    min_score_full: float = 0.6
+    max_det_sliced: int = 20
+    max_det_full: int = 10
+    min_area_px: float = 25  # unsliced only: drop boxes no larger than this ...
+    min_area_fraction: float = 0.0001  # ... or this fraction of the image
+
+    def is_sliced(self, image_size: Tuple[int, int]) -> bool:
+        return self.sliced and max(image_size) > self.slice_size
+
+    def min_score(self, image_size: Tuple[int, int]) -> float:
+        """The served score cutoff for an image of this size."""
+        return self.min_score_sliced if self.is_sliced(image_size) else self.min_score_full
+
+    def key(self) -> str:
+        return json.dumps(self.model_dump(), sort_keys=True)
+
+    def uncapped(self) -> "DetectionParams":
+        """The same thresholds without the max_det cut, so every detection is kept."""
+        return self.model_copy(update={"max_det_sliced": UNCAPPED_MAX_DET, "max_det_full": UNCAPPED_MAX_DET})
+
+
+def slice_regions(width: int, height: int, size: int = 512, overlap: float = 0.3) -> List[Region]:
+    """Overlapping slices covering the image, laid out like SAHI's get_slice_bboxes.
+
+    Slices that would run past the border are shifted back inside it, so every slice
+    is ``size`` pixels wide and high unless the image itself is smaller.
+    """
+    step = size - int(size * overlap)
+    regions: List[Region] = []
+    y0 = 0
+    while y0 < height:
+        y1 = y0 + size
+        x0 = 0
+        while x0 < width:
+            x1 = x0 + size
+            if x1 > width or y1 > height:
+                xe, ye = min(width, x1), min(height, y1)
+                regions.append((max(0, xe - size), max(0, ye - size), xe, ye))
+            else:
+                regions.append((x0, y0, x1, y1))
+            x0 += step
+        y0 += step
+    return list(dict.fromkeys(regions))
+
+
+def greedy_nmm(dets: np.ndarray, match_threshold: float = 0.5) -> np.ndarray:
+    """Class-agnostic greedy non-maximum merging on intersection over smaller area.
+
+    Boxes matching a higher scoring box are merged into it (union of the boxes, score
+    and class of the higher one), which joins symbols cut in two by slice borders.
+    """
+    if len(dets) == 0:
+        return dets
+    dets = dets[np.argsort(-dets[:, 4], kind="stable")]
+    areas = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    remaining = np.ones(len(dets), dtype=bool)
+    merged = []
+    for i in range(len(dets)):
+        if not remaining[i]:
+            continue
+        remaining[i] = False
+        others = np.flatnonzero(remaining)
+        box = dets[i].copy()
+        if len(others):
+            iw = np.minimum(dets[i, 2], dets[others, 2]) - np.maximum(dets[i, 0], dets[others, 0])
+            ih = np.minimum(dets[i, 3], dets[others, 3]) - np.maximum(dets[i, 1], dets[others, 1])
+            inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+            ios = inter / np.maximum(np.minimum(areas[i], areas[others]), 1e-9)
+            matches = others[ios >= match_threshold]
+            if len(matches):
+                group = dets[np.append(matches, i)]
+                box[:4] = [group[:, 0].min(), group[:, 1].min(), group[:, 2].max(), group[:, 3].max()]
+                remaining[matches] = False
+        merged.append(box)
+    return np.stack(merged)
+
+
+def plan_regions(image_size: Tuple[int, int], params: DetectionParams) -> List[Region]:
+    """Regions to run the detector on: the full image, followed by the slices when sliced."""
+    width, height = image_size
+    if not params.is_sliced(image_size):
+        return [(0, 0, width, height)]
+    # Full-image pass first, like SAHI's standard prediction next to the slices
+    return [(0, 0, width, height)] + slice_regions(width, height, size=params.slice_size, overlap=params.overlap)
+
+
+def merge_detections(dets: np.ndarray, image_size: Tuple[int, int], params: DetectionParams,
+                     min_score: float = None) -> DetectResponse:
+    """Raw region detections to the served response; ``min_score`` overrides the params' cutoff."""
+    width, height = image_size
+    score = params.min_score(image_size) if min_score is None else min_score
+    with timed("merge"):
+        if params.is_sliced(image_size):
+            return to_response(greedy_nmm(dets, params.merge_threshold), image_size, score,
+                               max_det=params.max_det_sliced)
+        return to_response(dets, image_size, score, max_det=params.max_det_full,
+                           min_area=max(params.min_area_px, width * height * params.min_area_fraction))
+
+
+def to_response(dets: np.ndarray, image_size: Tuple[int, int], min_score: float, max_det: int,
+                min_area: float = 0.0) -> DetectResponse:
+    """Threshold, clamp to the image and keep the ``max_det`` highest scoring detections."""
+    img_w, img_h = image_size
+    dets = dets[dets[:, 4] >= min_score]
+    dets = dets[np.argsort(-dets[:, 4], kind="stable")]
+    boxes, classes, scores = [], [], []
+    for x0, y0, x1, y1, score, cls in dets:
+        xmin = max(0, min(int(x0), img_w - 1))
+        ymin = max(0, min(int(y0), img_h - 1))
+        xmax = max(xmin + 1, min(int(x1), img_w))
+        ymax = max(ymin + 1, min(int(y1), img_h))
+        if (xmax - xmin) * (ymax - ymin) <= min_area:
+            continue
+        boxes.append(Box(x=xmin, y=ymin, w=xmax - xmin, h=ymax - ymin))
+        classes.append(str(int(cls)))
+        scores.append(float(score))
+        if len(boxes) >= max_det:
+            break
+    return DetectResponse(boxes=boxes, classes=classes, scores=scores)
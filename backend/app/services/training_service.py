@@ -1,27 +1,67 @@
+from typing import Dict, List, Optional
 from app.core.config import settings
 from app.core.utils import save_json, append_jsonl
 from app.models.schemas import FeedbackIn
-import subprocess
-import uuid
-import time
-import logging
+from app.services.job_manager import JobManager, get_job_manager
 from pathlib import Path
+import sys
+import logging
 
 log = logging.getLogger(__name__)
 
-from app.core.config import settings
-import subprocess
+BACKEND_ROOT = Path(__file__).resolve().parent.parent.parent
+SCRIPTS_DIR = BACKEND_ROOT / "scripts"
+# Training scripts resolve data/ and runs/ relative to the project root
+PROJECT_ROOT = BACKEND_ROOT.parent
+
+TRAINING_SCRIPTS = {
+    "yolo": "fine_tune_yolo.py",
+    "vlm": "fine_tune_vlm_lora.py",
+}
+
 
 class TrainingService:
-    def trigger_training(self, mode="yolo"):
+    def __init__(self, job_manager: Optional[JobManager] = None):
+        self._job_manager = job_manager
+
+    @property
+    def jobs(self) -> JobManager:
+        if self._job_manager is None:
+            self._job_manager = get_job_manager()
+        return self._job_manager
+
+    def build_command(self, mode: str, epochs: Optional[int] = None, use_sahi: bool = True,
+                      incremental: bool = False) -> List[str]:
+        if mode not in TRAINING_SCRIPTS:
+            raise ValueError(f"Unknown training mode: {mode}")
+        cmd = [sys.executable, str(SCRIPTS_DIR / TRAINING_SCRIPTS[mode])]
         if mode == "yolo":
-            subprocess.run(["python", "backend/scripts/fine_tune_yolo.py"])
-            return {"job": "YOLO retraining complete"}
-        elif mode == "vlm":
-            subprocess.run(["python", "backend/scripts/fine_tune_vlm_lora.py"])
-            return {"job": "VLM LoRA fine-tuning complete"}
-        else:
-            return {"error": "Unknown training mode"}
+            if incremental:
+                # Warm start from the deployed weights on new feedback only
+                cmd.append("--incremental")
+            elif use_sahi:
+                cmd.append("--use-sahi")
+            if epochs:
+                cmd += ["--epochs", str(epochs)]
+        return cmd
+
+    def trigger_training(self, mode: str = "yolo", epochs: Optional[int] = None, use_sahi: bool = True,
+                         incremental: bool = False) -> Dict:
+        """Queue a training run; returns immediately with the job record."""
+        cmd = self.build_command(mode, epochs=epochs, use_sahi=use_sahi, incremental=incremental)
+        return self.jobs.submit(mode, cmd, cwd=str(PROJECT_ROOT))
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        return self.jobs.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[Dict]:
+        return self.jobs.list(status)
+
+    def cancel_job(self, job_id: str) -> Optional[Dict]:
+        return self.jobs.cancel(job_id)
+
+    def read_job_log(self, job_id: str, offset: int = 0) -> Optional[Dict]:
+        return self.jobs.read_log(job_id, offset)
 
     def save_feedback(self, payload: FeedbackIn):
         # persist feedback as JSON and append training triplet line
@@ -40,16 +80,3 @@ class TrainingService:
     def _generate_output_from_boxes(self, payload: FeedbackIn):
         boxes = [[b.x, b.y, b.w, b.h] for b in payload.boxes]
         return str(boxes)
-
-    def trigger_training(self):
-        job_id = str(uuid.uuid4())
-        # launch training subprocess that runs train_vlm.py
-        cmd = ["python", "backend/scripts/train_vlm.py", "--data", settings.finetune_file, "--out", settings.adapter_dir]
-        log.info("Trigger training job %s: %s", job_id, " ".join(cmd))
-        try:
-            p = subprocess.Popen(cmd)
-            self.queue.append({"job_id": job_id, "pid": p.pid, "started_at": time.time()})
-            return {"job_id": job_id, "pid": p.pid}
-        except Exception as e:
-            log.exception("Failed to start training job: %s", e)
-            return {"error": str(e)}
@@ -1,33 +1,146 @@
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
 from app.core.config import settings
+from app.core.batching import MicroBatcher
+from app.core.cache import LRUCache
+from app.core.metrics import MODEL_MEMORY, QUEUE_DEPTH, VLM_TOKENS, observe_stage, rss_bytes, watch_cache
+from app.models.schemas import Box
+from app.services.adapter_pool import AdapterPool
+from app.services.region_crops import build_mosaic, select_regions
+from contextlib import contextmanager
+import copy
+import hashlib
+import importlib.util
+import inspect
 import io
+import os
 from PIL import Image
+from pathlib import Path
+import threading
+import time
 import logging
 
 log = logging.getLogger(__name__)
 
-# Optional dependencies
-try:
-    import torch
-    from transformers import Qwen2VLForConditionalGeneration, Qwen2VLProcessor, BitsAndBytesConfig
-    from peft import PeftModel, get_peft_model, LoraConfig
-    HF_AVAILABLE = True
-except Exception:
-    HF_AVAILABLE = False
+# Optional dependencies. torch/transformers take seconds to import, so only check they
+# are installed here and import them when the model is first needed (see _import_hf).
+HF_AVAILABLE = all(importlib.util.find_spec(m) is not None for m in ("torch", "transformers", "peft"))
+# Weight-only int4 on CPU needs optimum-quanto; int8 uses torch's dynamic quantization
+QUANTO_AVAILABLE = importlib.util.find_spec("optimum") is not None and importlib.util.find_spec("optimum.quanto") is not None
+
+torch = None
+Qwen2VLForConditionalGeneration = Qwen2VLProcessor = BitsAndBytesConfig = DynamicCache = None
+PeftModel = PeftConfig = get_peft_model = LoraConfig = None
+load_peft_weights = set_peft_model_state_dict = None
+
+
+def _rss_mb() -> Optional[float]:
+    """Resident memory of this process in MB, None if unknown (see app.core.metrics.rss_bytes)."""
+    rss = rss_bytes()
+    return round(rss / 1024 ** 2, 1) if rss is not None else None
+
+
+def _cpu_threads() -> int:
+    if settings.vlm_num_threads:
+        return settings.vlm_num_threads
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _import_hf():
+    """Import the HuggingFace stack into module globals on first use."""
+    global torch, Qwen2VLForConditionalGeneration, Qwen2VLProcessor, BitsAndBytesConfig, DynamicCache
+    global PeftModel, PeftConfig, get_peft_model, LoraConfig, load_peft_weights, set_peft_model_state_dict
+    if torch is not None:
+        return
+    from transformers import Qwen2VLForConditionalGeneration, Qwen2VLProcessor, BitsAndBytesConfig, DynamicCache
+    from peft import PeftModel, PeftConfig, get_peft_model, LoraConfig
+    from peft.utils import load_peft_weights, set_peft_model_state_dict
+    import torch as _torch
+    torch = _torch
+
+SYSTEM_MESSAGE = ("You are a floorplan assistant specialized in detecting electrical symbols "
+                  "and returning coordinates and counts as JSON where requested.")
+IMAGE_PAD = "<|image_pad|>"
+# Everything before the image in the chat template is the same for every request
+VISION_START = "<|vision_start|>"
+
 
 class VLMService:
     def __init__(self, model_id: Optional[str] = None, device: Optional[str] = None):
         self.model_id = model_id or settings.qwen_model
-        self.device = device or ("cuda" if HF_AVAILABLE and torch.cuda.is_available() else "cpu")
+        # Resolved when the model loads so constructing the service does not import torch
+        self.device = device
         self.processor = None
         self.model = None
         self.adapter_loaded = False
-        # Temporarily disable VLM model loading for YOLO testing
-        # if HF_AVAILABLE:
-        #     self._load_base_model()
+        # Default adapter (reload_adapter / registry promotion), used when a request names none
+        self.adapter_name = None
+        # Adapter active on the model right now; caches below are keyed by it
+        self._current_adapter = None
+        # Further adapters from settings.adapter_dir requested by name, LRU within a memory budget
+        self.adapters = AdapterPool(settings.vlm_adapter_budget_mb * 1024 * 1024)
+        self._adapter_load_lock = threading.Lock()
+        # Generation runs against whichever adapter is active, so switching adapters
+        # waits for the in-flight generation to finish
+        self._generate_lock = threading.Lock()
+        # Preprocessed pixels and vision-encoder outputs keyed by image hash, so follow-up
+        # questions about the same plan skip decoding and the vision tower
+        self.vision_cache = LRUCache(settings.vlm_vision_cache_mb * 1024 * 1024, sizeof=self._tensor_bytes)
+        self._active_image_keys = None
+        self._visual_output_cls = None
+        # Key/value states of the system-prompt prefix per adapter: {adapter_name: (prefix_ids, cache)}
+        self._prefix_cache = {}
+        # Load time, memory and speed of the loaded model, for startup reporting
+        self.load_stats: Dict = {}
+        # Concurrent answer_bytes calls are grouped by adapter into one generation
+        self.batcher = MicroBatcher(self._answer_batch, settings.vlm_batch_window_ms / 1000, settings.vlm_max_batch)
+        watch_cache("vlm_vision", self.vision_cache)
+        QUEUE_DEPTH.set_function(lambda: self.batcher.stats()["queued"], queue="vlm_batch")
+        MODEL_MEMORY.set_function(self.model_memory_bytes, model="vlm")
+        # The base model is loaded by the startup warm-up when settings.vlm_preload is set,
+        # otherwise on the first adapter load. load_listener(state, error) is told when a
+        # load starts ("loading"), finishes ("ready") or fails ("failed"); set by the container.
+        self.load_listener: Optional[Callable[[str, Optional[str]], None]] = None
+
+    def _notify_load(self, state: str, error: Optional[str] = None):
+        if self.load_listener is not None:
+            try:
+                self.load_listener(state, error)
+            except Exception as e:
+                log.warning("VLM load listener failed: %s", e)
+
+    def _quantize_cpu(self, mode: str) -> str:
+        """Weight-only quantization of the linear layers for CPU inference; returns the mode applied.
+
+        Layers named in settings.vlm_quantize_skip (LoRA targets by default) stay in float so
+        adapters can still be attached to them. int8 scales activations per batch, so batched
+        answers can differ slightly from single ones.
+        """
+        skip = {name.strip() for name in settings.vlm_quantize_skip.split(",") if name.strip()}
+        if mode == "int4":
+            if QUANTO_AVAILABLE:
+                from optimum.quanto import freeze, qint4, quantize
+                quantize(self.model, weights=qint4, exclude=[f"*{name}" for name in skip])
+                freeze(self.model)
+                return "int4"
+            log.warning("optimum-quanto not installed, using int8 dynamic quantization instead of int4")
+        if mode in ("int4", "int8"):
+            from torch.ao.quantization import quantize_dynamic
+            targets = {name for name, module in self.model.named_modules()
+                       if isinstance(module, torch.nn.Linear) and name.split(".")[-1] not in skip}
+            quantize_dynamic(self.model, qconfig_spec=targets, dtype=torch.qint8, inplace=True)
+            return "int8"
+        return "none"
 
     def _load_base_model(self):
+        self._notify_load("loading")
         try:
+            _import_hf()
+            self.device = self.device or ("cuda" if torch.cuda.is_available() else "cpu")
+            started = time.perf_counter()
+            quantization = "nf4"
             if torch.cuda.is_available():
                 bnb = BitsAndBytesConfig(
                     load_in_4bit=True,
@@ -36,54 +149,593 @@ class VLMService:
                     bnb_4bit_compute_dtype=torch.bfloat16 if torch.cuda.is_available() else torch.float16,
                 )
                 self.model = Qwen2VLForConditionalGeneration.from_pretrained(
-                    self.model_id, device_map="auto", quantization_config=bnb, use_cache=False
+                    self.model_id, device_map="auto", quantization_config=bnb
                 )
             else:
-                self.model = Qwen2VLForConditionalGeneration.from_pretrained(self.model_id, use_cache=False)
+                torch.set_num_threads(_cpu_threads())
+                # A smaller model is usually the better trade-off on CPU-only nodes
+                self.model_id = settings.vlm_cpu_model or self.model_id
+                import transformers
+                # Dynamic quantization works on float32 weights; "dtype" replaced "torch_dtype" in 4.56
+                major, minor = (int(v) for v in transformers.__version__.split(".")[:2])
+                dtype_arg = "dtype" if (major, minor) >= (4, 56) else "torch_dtype"
+                self.model = Qwen2VLForConditionalGeneration.from_pretrained(
+                    self.model_id, low_cpu_mem_usage=True, **{dtype_arg: torch.float32}
+                )
+                quantization = self._quantize_cpu(settings.vlm_cpu_quantization)
+            # Generation reuses key/value states, both within an answer and for the shared prefix
+            self.model.config.use_cache = True
             self.processor = Qwen2VLProcessor.from_pretrained(self.model_id)
-            self.processor.tokenizer.padding_side = "right"
+            # Left padding so batched prompts end right where generation starts
+            self.processor.tokenizer.padding_side = "left"
+            self.load_stats = {
+                "model_id": self.model_id,
+                "device": self.device,
+                "quantization": quantization,
+                "threads": torch.get_num_threads(),
+                "load_time_s": round(time.perf_counter() - started, 2),
+                "rss_mb": _rss_mb(),
+            }
+            log.info("Loaded VLM %s on %s (%s, %d threads) in %.1fs, RSS %s MB", self.model_id, self.device,
+                     quantization, self.load_stats["threads"], self.load_stats["load_time_s"], self.load_stats["rss_mb"])
         except Exception as e:
             log.exception("Failed to load VLM model: %s", e)
             self.model = None
             self.processor = None
+            self._notify_load("failed", str(e))
+            return
+        self._notify_load("ready")
+
+    @property
+    def is_loaded(self) -> bool:
+        return self.model is not None and self.processor is not None
+
+    def model_memory_bytes(self) -> int:
+        return self.model.get_memory_footprint() if self.model is not None else 0
+
+    def warm_up(self):
+        """Load the base model and time a short generation on a blank tile."""
+        if not self.is_loaded:
+            self._load_base_model()
+        if not self.is_loaded:
+            raise RuntimeError("VLM base model failed to load")
+        buf = io.BytesIO()
+        Image.new("RGB", (448, 448), "white").save(buf, format="PNG")
+        *_, stats = self.stream_answer(buf.getvalue(), "Describe the image.",
+                                       max_new_tokens=max(1, settings.vlm_warmup_tokens))
+        self.load_stats.update(ttft_s=stats["ttft_s"], tokens_per_s=stats["tokens_per_s"], rss_mb=_rss_mb())
+        log.info("VLM warm-up: first token %.2fs, %.2f tokens/s, RSS %s MB",
+                 stats["ttft_s"], stats["tokens_per_s"], self.load_stats["rss_mb"])
 
     def _pil_from_bytes(self, image_bytes: bytes):
         return Image.open(io.BytesIO(image_bytes)).convert("RGB")
 
-    def answer_bytes(self, image_bytes: bytes, instruction: str, max_new_tokens: int = 128) -> str:
-        if not HF_AVAILABLE or self.model is None or self.processor is None:
-            # fallback heuristic: return instruction echo
-            return f"[VLM stub] instruction: {instruction}"
+    def _tensor_bytes(self, entry) -> int:
+        tensors = [entry["pixel_values"], entry["image_grid_thw"]] + list(entry["image_embeds"].values())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def _install_vision_cache(self):
+        """Route the vision encoder through the embedding cache.
+
+        Qwen2-VL calls ``visual(pixel_values, grid_thw=...)`` inside its forward; wrapping that
+        call keeps the standard generate path (including M-RoPE position handling) intact
+        while skipping the encoder for images that were already encoded.
+        """
+        visual = None
+        for name, module in self.model.named_modules():
+            if name.split(".")[-1] == "visual":
+                visual = module
+                break
+        if visual is None or getattr(visual, "_cache_wrapped", False):
+            return
+        original_forward = visual.forward
+        merge_size = getattr(visual, "spatial_merge_size", 2)
+
+        def cached_forward(hidden_states, grid_thw=None, **kwargs):
+            keys = self._active_image_keys
+            if not keys or grid_thw is None or len(keys) != grid_thw.shape[0]:
+                return original_forward(hidden_states, grid_thw=grid_thw, **kwargs)
+            # One image per row; rows repeating an image or already encoded skip the encoder
+            patches = [int(g.prod()) for g in grid_thw]
+            offsets = [0]
+            for count in patches:
+                offsets.append(offsets[-1] + count)
+            adapter = self._current_adapter
+            entries = [self.vision_cache.get(key) if key else None for key in keys]
+            embeds = [entry["image_embeds"].get(adapter) if entry else None for entry in entries]
+            first_row = {}
+            to_encode = []
+            for i, key in enumerate(keys):
+                if embeds[i] is not None:
+                    continue
+                if key is None or key not in first_row:
+                    to_encode.append(i)
+                    if key:
+                        first_row[key] = i
+            output = None
+            if to_encode:
+                output = original_forward(torch.cat([hidden_states[offsets[i]:offsets[i + 1]] for i in to_encode]),
+                                          grid_thw=grid_thw[to_encode], **kwargs)
+                # Older transformers return the merged embeddings, newer ones wrap them in pooler_output
+                merged = (output if torch.is_tensor(output) else output.pooler_output).detach()
+                if not torch.is_tensor(output):
+                    self._visual_output_cls = type(output)
+                pieces = torch.split(merged, [patches[i] // merge_size ** 2 for i in to_encode])
+                for i, piece in zip(to_encode, pieces):
+                    embeds[i] = piece
+                    if entries[i] is not None:
+                        entries[i]["image_embeds"][adapter] = piece
+                        # Re-insert so the cache accounts for the embedding size
+                        self.vision_cache.put(keys[i], entries[i])
+            for i, key in enumerate(keys):
+                if embeds[i] is None:
+                    embeds[i] = embeds[first_row[key]]
+            result = torch.cat(embeds) if len(embeds) > 1 else embeds[0]
+            if self._visual_output_cls is None:
+                return result
+            if output is None:
+                output = self._visual_output_cls()
+            output.pooler_output = result
+            return output
+
+        visual.forward = cached_forward
+        visual._cache_wrapped = True
 
-        image = self._pil_from_bytes(image_bytes)
-        system_message = ("You are a floorplan assistant specialized in detecting electrical symbols "
-                          "and returning coordinates and counts as JSON where requested.")
+    def _image_entry(self, image_bytes: bytes):
+        """Preprocessed image tensors for these bytes, decoded at most once per cache lifetime."""
+        key = hashlib.sha256(image_bytes).hexdigest()
+        entry = self.vision_cache.get(key)
+        if entry is None:
+            image = self._pil_from_bytes(image_bytes)
+            processed = self.processor.image_processor(images=[image], return_tensors="pt")
+            entry = {
+                "pixel_values": processed["pixel_values"],
+                "image_grid_thw": processed["image_grid_thw"],
+                "image_embeds": {},  # per adapter, filled by the wrapped vision encoder
+            }
+            self.vision_cache.put(key, entry)
+        return key, entry
+
+    def _chat_text(self, instruction: str, image_tokens: int) -> str:
         prompt = [
-            {"role": "system", "content": [{"type": "text", "text": system_message}]},
-            {"role": "user", "content": [{"type": "image", "image": image}, {"type": "text", "text": instruction}]}
+            {"role": "system", "content": [{"type": "text", "text": SYSTEM_MESSAGE}]},
+            {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": instruction}]}
         ]
         text = self.processor.apply_chat_template(prompt, tokenize=False, add_generation_prompt=True)
-        inputs = self.processor(text=[text], images=image, return_tensors="pt", padding=True)
-        inputs = inputs.to(self.device)
+        # What the processor does when given the image: one pad token per merged patch
+        return text.replace(IMAGE_PAD, IMAGE_PAD * image_tokens, 1)
+
+    def _base_model(self):
+        model = self.model.get_base_model() if isinstance(self.model, PeftModel) else self.model
+        # get_rope_index moved from the generation head to the inner model in newer transformers
+        return model if hasattr(model, "get_rope_index") else model.model
+
+    def _rope_index(self, input_ids, attention_mask, image_grid_thw):
+        """3D (M-RoPE) position ids for a padded batch of full prompts."""
+        get_rope_index = self._base_model().get_rope_index
+        kwargs = {"image_grid_thw": image_grid_thw, "attention_mask": attention_mask}
+        if "mm_token_type_ids" in inspect.signature(get_rope_index).parameters:
+            image_token_id = self.processor.tokenizer.convert_tokens_to_ids(IMAGE_PAD)
+            kwargs["mm_token_type_ids"] = (input_ids == image_token_id).int()
+        position_ids, _ = get_rope_index(input_ids, **kwargs)
+        return position_ids
+
+    def _get_prefix(self, prefix_text: str):
+        """Token ids and key/value cache of the shared prompt prefix for the active adapter.
+
+        The prefix is plain text starting at position 0, so its states do not depend on the
+        image or the instruction and can be reused by every request. Must be called with the
+        generation lock held.
+        """
+        cached = self._prefix_cache.get(self._current_adapter)
+        if cached is not None and cached[0] == prefix_text:
+            return cached[1], cached[2]
+        prefix_ids = self.processor.tokenizer(prefix_text, add_special_tokens=False,
+                                              return_tensors="pt")["input_ids"].to(self.device)
+        cache = DynamicCache()
+        if prefix_ids.shape[1]:
+            length = prefix_ids.shape[1]
+            position_ids = torch.arange(length, device=self.device).view(1, 1, -1).expand(3, 1, -1)
+            self.model(input_ids=prefix_ids, position_ids=position_ids, past_key_values=cache,
+                       cache_position=torch.arange(length, device=self.device), use_cache=True)
+        self._prefix_cache[self._current_adapter] = (prefix_text, prefix_ids, cache)
+        return prefix_ids, cache
+
+    def _generate_steps(self, texts: List[str], pixel_values, image_grid_thw, max_new_tokens: int) -> Iterator:
+        """Greedy decoding that starts from the cached prefix states, yielding one token per row per step.
+
+        Qwen2-VL's ``generate`` recomputes M-RoPE positions from the whole prompt on the first
+        step, which does not work with a pre-filled cache, so prefill and decode are done here
+        with explicit position ids. Instructions of different lengths are padded between the
+        prefix and the rest of the prompt so the prefix states line up for every row.
+        Must be called with the generation lock held.
+        """
+        n = len(texts)
+        split = texts[0].find(VISION_START) if settings.vlm_prefix_cache else -1
+        prefix_text = texts[0][:split] if split > 0 else ""
+        prefix_ids, prefix_cache = self._get_prefix(prefix_text)
+        suffixes = self.processor.tokenizer([t[len(prefix_text):] for t in texts], add_special_tokens=False,
+                                            return_tensors="pt", padding=True)
+        suffix_ids = suffixes["input_ids"].to(self.device)
+        prefix_len = prefix_ids.shape[1]
+        input_ids = torch.cat([prefix_ids.expand(n, -1), suffix_ids], dim=1)
+        attention_mask = torch.cat([torch.ones(n, prefix_len, dtype=suffixes["attention_mask"].dtype),
+                                    suffixes["attention_mask"]], dim=1).to(self.device)
+        image_grid_thw = image_grid_thw.to(self.device)
+        position_ids = self._rope_index(input_ids, attention_mask, image_grid_thw)
+
+        cache = copy.deepcopy(prefix_cache)
+        if n > 1 and prefix_len:
+            cache.batch_repeat_interleave(n)
+        started = time.perf_counter()
+        logits = self.model(
+            input_ids=suffix_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids[:, :, prefix_len:],
+            past_key_values=cache,
+            cache_position=torch.arange(prefix_len, input_ids.shape[1], device=self.device),
+            pixel_values=pixel_values.to(self.device),
+            image_grid_thw=image_grid_thw,
+            use_cache=True,
+        ).logits[:, -1]
+        observe_stage("vlm_prefill", time.perf_counter() - started)
+
+        eos = self.model.generation_config.eos_token_id
+        if eos is None:
+            eos = self.processor.tokenizer.eos_token_id
+        eos_ids = torch.tensor(eos if isinstance(eos, list) else [eos], device=self.device)
+        pad_id = self.processor.tokenizer.pad_token_id
+        next_position = position_ids.amax(dim=(0, 2)) + 1
+        seq_len = input_ids.shape[1]
+        finished = torch.zeros(n, dtype=torch.bool, device=self.device)
+        decode_s = 0.0
+        tokens = 0
+        try:
+            for step in range(max_new_tokens):
+                next_tokens = logits.argmax(dim=-1)
+                if pad_id is not None:
+                    next_tokens = next_tokens.masked_fill(finished, pad_id)
+                tokens += n - int(finished.sum())
+                yield next_tokens
+                finished |= torch.isin(next_tokens, eos_ids)
+                if finished.all() or step + 1 == max_new_tokens:
+                    break
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones(n, 1)], dim=1)
+                started = time.perf_counter()
+                logits = self.model(
+                    input_ids=next_tokens[:, None],
+                    attention_mask=attention_mask,
+                    position_ids=next_position.view(1, n, 1).expand(3, n, 1),
+                    past_key_values=cache,
+                    cache_position=torch.tensor([seq_len], device=self.device),
+                    use_cache=True,
+                ).logits[:, -1]
+                decode_s += time.perf_counter() - started
+                next_position = next_position + 1
+                seq_len += 1
+        finally:
+            # Also when the consumer stops early (cancelled streams)
+            observe_stage("vlm_decode", decode_s)
+            VLM_TOKENS.inc(tokens)
+
+    # -- adapters ----------------------------------------------------------
+
+    def _adapter_path(self, name: str) -> Path:
+        if not name or Path(name).name != name or name in (".", ".."):
+            raise ValueError(f"Invalid adapter name: {name!r}")
+        path = Path(settings.adapter_dir) / name
+        if not path.is_dir():
+            raise FileNotFoundError(f"Adapter {name} not found in {settings.adapter_dir}")
+        return path
+
+    def _inject_adapter(self, name: str, config, weights):
+        """Add adapter weights to the model. Must be called with the generation lock held."""
+        if isinstance(self.model, PeftModel):
+            self.model.add_adapter(name, config)
+        else:
+            self.model = get_peft_model(self.model, config, adapter_name=name)
+        if self.load_stats.get("quantization") in ("int8", "int4"):
+            self._copy_adapter_weights(name, weights)
+        else:
+            set_peft_model_state_dict(self.model, weights, adapter_name=name)
+        self.model.eval()
+        # Injecting may change the active adapter; keep serving the one that was active
+        self._activate(self._current_adapter or name)
+
+    def _copy_adapter_weights(self, name: str, weights):
+        """Copy LoRA tensors into the injected adapter without load_state_dict.
+
+        Quantized linear layers reject partial state dicts, so the saved keys
+        (``...q_proj.lora_A.weight``) are matched to the parameters (``...q_proj.lora_A.<name>.weight``) directly.
+        """
+        params = dict(self.model.named_parameters())
         with torch.no_grad():
-            generated_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
-        output = self.processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        return output
+            for key, value in weights.items():
+                module, _, leaf = key.rpartition(".")
+                target = params.get(f"{module}.{name}.{leaf}")
+                if target is None:
+                    raise KeyError(f"Adapter weight {key} does not match the model")
+                target.copy_(value)
+
+    def _remove_adapter(self, name: str):
+        """Delete an adapter and the caches computed with it. Must be called with the generation lock held."""
+        self.model.delete_adapter(name)
+        self._prefix_cache.pop(name, None)
+        self._current_adapter = self.model.active_adapter
+        self.adapters.remove(name)
+
+    def _evict_adapters(self):
+        for name in self.adapters.evictable(protect=[self.adapter_name]):
+            log.info("Evicting VLM adapter %s", name)
+            self._remove_adapter(name)
+
+    def acquire_adapter(self, name: Optional[str]) -> Optional[str]:
+        """Resident adapter to generate with, loading ``settings.adapter_dir``/<name> if needed.
+
+        None (or the default adapter's name) selects the default adapter. A named adapter is
+        pinned so it cannot be evicted until ``release_adapter``.
+        """
+        if name is None or name == self.adapter_name:
+            return self.adapter_name
+        if self.adapters.pin(name):
+            return name
+        with self._adapter_load_lock:
+            if self.adapters.pin(name):
+                return name
+            path = self._adapter_path(name)
+            # Disk reads happen outside the generation lock
+            config = PeftConfig.from_pretrained(str(path))
+            weights = load_peft_weights(str(path), device=self.device)
+            nbytes = sum(t.numel() * t.element_size() for t in weights.values())
+            with self._generate_lock:
+                self._inject_adapter(name, config, weights)
+                self.adapters.add(name, str(path), nbytes, pinned=True)
+                self._evict_adapters()
+            log.info("Loaded VLM adapter %s (%.1f MB)", name, nbytes / 1024 ** 2)
+        return name
+
+    def release_adapter(self, name: Optional[str]):
+        if name is not None:
+            self.adapters.unpin(name)
+
+    def _activate(self, name: Optional[str]):
+        if name is not None and name != self._current_adapter:
+            self.model.set_adapter(name)
+            self._current_adapter = name
+
+    @contextmanager
+    def _using_adapter(self, name: Optional[str]):
+        """Run with adapter ``name``; None means the plain base model. Generation lock must be held."""
+        if name is None and isinstance(self.model, PeftModel):
+            previous = self._current_adapter
+            with self.model.disable_adapter():
+                self._current_adapter = None
+                try:
+                    yield
+                finally:
+                    self._current_adapter = previous
+        else:
+            self._activate(name)
+            yield
+
+    @contextmanager
+    def _generation(self, adapter: Optional[str] = None, image_keys: Optional[List[Optional[str]]] = None):
+        """Pin the adapter, take the generation lock and route the vision encoder through the cache."""
+        name = self.acquire_adapter(adapter)
+        try:
+            with self._generate_lock, torch.no_grad():
+                self._install_vision_cache()
+                with self._using_adapter(name):
+                    self._active_image_keys = image_keys
+                    try:
+                        yield
+                    finally:
+                        self._active_image_keys = None
+        finally:
+            self.release_adapter(name)
 
-    def load_adapter(self, adapter_path: str):
+    # -- generation --------------------------------------------------------
+
+    def _image_tokens(self, grid_thw) -> int:
+        merge_size = getattr(self.processor.image_processor, "merge_size", 2)
+        return int(grid_thw.prod()) // (merge_size ** 2)
+
+    def _prompt_texts(self, entry, instructions: List[str]) -> List[str]:
+        image_tokens = self._image_tokens(entry["image_grid_thw"][0])
+        return [self._chat_text(instruction, image_tokens) for instruction in instructions]
+
+    def _decode(self, tokens: List, n: int, limits: Optional[List[int]] = None) -> List[str]:
+        if not tokens:
+            return ["" for _ in range(n)]
+        answers = torch.stack(tokens, dim=1)
+        rows = [answers[i, :limits[i]] for i in range(n)] if limits else answers
+        return [a.strip() for a in self.processor.batch_decode(rows, skip_special_tokens=True)]
+
+    def _checked_entry(self, image_bytes: bytes):
+        try:
+            return self._image_entry(image_bytes)
+        except OSError as e:
+            raise ValueError(f"Cannot decode image: {e}") from e
+
+    def _answer_batch(self, adapter: Optional[str], requests: List) -> List:
+        """MicroBatcher handler: (image_bytes, instruction, max_new_tokens) requests for one adapter.
+
+        A request whose image cannot be decoded gets its exception back instead of an answer;
+        the rest of the batch is generated without it.
+        """
+        results: List = [None] * len(requests)
+        entries, valid = [], []
+        for i, (image_bytes, _, _) in enumerate(requests):
+            try:
+                entries.append(self._checked_entry(image_bytes))
+                valid.append(i)
+            except ValueError as e:
+                results[i] = e
+        if not valid:
+            return results
+        texts = [self._prompt_texts(entry, [requests[i][1]])[0] for (_, entry), i in zip(entries, valid)]
+        limits = [requests[i][2] for i in valid]
+        pixel_values = torch.cat([entry["pixel_values"] for _, entry in entries])
+        grids = torch.cat([entry["image_grid_thw"] for _, entry in entries])
+        with self._generation(adapter, [key for key, _ in entries]):
+            tokens = list(self._generate_steps(texts, pixel_values, grids, max(limits)))
+        for i, answer in zip(valid, self._decode(tokens, len(valid), limits)):
+            results[i] = answer
+        return results
+
+    def answer_bytes(self, image_bytes: bytes, instruction: str, max_new_tokens: int = 128,
+                     adapter: Optional[str] = None) -> str:
+        if not HF_AVAILABLE or self.model is None or self.processor is None:
+            # fallback heuristic: return instruction echo
+            return f"[VLM stub] instruction: {instruction}"
+        # Decoded before joining a batch, so a bad upload fails its own request with a 400
+        self._checked_entry(image_bytes)
+        if settings.vlm_batch_window_ms > 0:
+            return self.batcher.submit(adapter, (image_bytes, instruction, max_new_tokens))
+        result = self._answer_batch(adapter, [(image_bytes, instruction, max_new_tokens)])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def answer_many(self, image_bytes: bytes, instructions: List[str], max_new_tokens: int = 128,
+                    adapter: Optional[str] = None) -> List[str]:
+        """Answer several instructions about one image in a single batched generation."""
+        if not HF_AVAILABLE or self.model is None or self.processor is None:
+            return [f"[VLM stub] instruction: {instruction}" for instruction in instructions]
+
+        key, entry = self._checked_entry(image_bytes)
+        texts = self._prompt_texts(entry, instructions)
+        n = len(texts)
+        with self._generation(adapter, [key] * n):
+            tokens = list(self._generate_steps(texts, entry["pixel_values"].repeat(n, 1),
+                                               entry["image_grid_thw"].repeat(n, 1), max_new_tokens))
+        return self._decode(tokens, n)
+
+    def answer_images(self, images: Sequence[Image.Image], instructions: Sequence[str],
+                      max_new_tokens: int = 16, adapter: Optional[str] = None) -> List[str]:
+        """One instruction per image, generated as a single batch (e.g. yes/no checks on crops).
+
+        The images are small and not reused, so they bypass the vision cache.
+        """
+        if not HF_AVAILABLE or self.model is None or self.processor is None:
+            return [f"[VLM stub] instruction: {instruction}" for instruction in instructions]
+        processed = self.processor.image_processor(images=[img.convert("RGB") for img in images], return_tensors="pt")
+        grids = processed["image_grid_thw"]
+        texts = [self._chat_text(instruction, self._image_tokens(grid)) for instruction, grid in zip(instructions, grids)]
+        with self._generation(adapter):
+            tokens = list(self._generate_steps(texts, processed["pixel_values"], grids, max_new_tokens))
+        return self._decode(tokens, len(texts))
+
+    def answer_regions(self, image_bytes: bytes, instruction: str, boxes: Sequence[Box] = (),
+                       region: Optional[Box] = None, max_new_tokens: int = 128, adapter: Optional[str] = None) -> Dict:
+        """Answer about the detected (or user-selected) regions only.
+
+        Crops around ``boxes`` (or the single ``region``) are packed into a mosaic of at most
+        ``settings.vlm_crop_max_pixels`` so the vision tower sees a fraction of a large sheet.
+        "[x, y, w, h]" boxes in the answer are mapped back to original image coordinates.
+        """
+        img = self._pil_from_bytes(image_bytes)
+        if region is not None:
+            x0, y0 = max(0, region.x), max(0, region.y)
+            x1, y1 = min(img.width, region.x + region.w), min(img.height, region.y + region.h)
+            if x1 <= x0 or y1 <= y0:
+                raise ValueError(f"region {region.x},{region.y},{region.w},{region.h} does not overlap "
+                                 f"the {img.width}x{img.height} image")
+            regions = [(x0, y0, x1, y1)]
+        else:
+            regions = select_regions(boxes, img.size, settings.vlm_crop_margin)
+        mosaic = build_mosaic(img, regions, settings.vlm_crop_max_pixels)
+        buf = io.BytesIO()
+        mosaic.image.save(buf, format="PNG")
+        raw_answer = self.answer_bytes(buf.getvalue(), instruction, max_new_tokens=max_new_tokens, adapter=adapter)
+        answer, mapped_boxes = mosaic.remap_answer(raw_answer)
+        return {
+            "answer": answer,
+            "raw_answer": raw_answer,
+            "boxes": mapped_boxes,
+            "regions": [tile.to_dict() for tile in mosaic.tiles],
+            "original_size": list(img.size),
+            "mosaic_size": list(mosaic.image.size),
+        }
+
+    def stream_answer(self, image_bytes: bytes, instruction: str, max_new_tokens: int = 128,
+                      cancel: Optional[threading.Event] = None, adapter: Optional[str] = None) -> Iterator[Dict]:
+        """Yield ``{"text": delta}`` as tokens are generated, then a final stats dict with ``done``.
+
+        Generation stops before the next decoding step once ``cancel`` is set. The generation
+        lock is held while iterating, so consume the iterator promptly (e.g. on a worker thread).
+        """
+        started = time.perf_counter()
+        if not HF_AVAILABLE or self.model is None or self.processor is None:
+            yield {"text": f"[VLM stub] instruction: {instruction}"}
+            yield {"done": True, "tokens": 0, "cancelled": False, "ttft_s": 0.0,
+                   "duration_s": 0.0, "tokens_per_s": 0.0}
+            return
+
+        key, entry = self._checked_entry(image_bytes)
+        texts = self._prompt_texts(entry, [instruction])
+        token_ids: List[int] = []
+        text = ""
+        first_token_at = None
+        cancelled = False
+        with self._generation(adapter, [key]):
+            for next_tokens in self._generate_steps(texts, entry["pixel_values"], entry["image_grid_thw"],
+                                                    max_new_tokens):
+                first_token_at = first_token_at or time.perf_counter()
+                token_ids.append(int(next_tokens[0]))
+                # Decode the whole answer so far; multi-byte characters can span tokens
+                decoded = self.processor.tokenizer.decode(token_ids, skip_special_tokens=True).lstrip()
+                if len(decoded) > len(text) and not decoded.endswith("\ufffd"):
+                    yield {"text": decoded[len(text):]}
+                    text = decoded
+                if cancel is not None and cancel.is_set():
+                    cancelled = True
+                    break
+        duration = time.perf_counter() - started
+        if cancelled:
+            log.info("VLM stream cancelled after %d tokens", len(token_ids))
+        yield {
+            "done": True,
+            "tokens": len(token_ids),
+            "cancelled": cancelled,
+            "ttft_s": round((first_token_at or time.perf_counter()) - started, 3),
+            "duration_s": round(duration, 3),
+            "tokens_per_s": round(len(token_ids) / duration, 2) if duration > 0 else 0.0,
+        }
+
+    def load_adapter(self, adapter_path: str, adapter_name: Optional[str] = None):
+        """Load a LoRA adapter and make it the default without disturbing in-flight requests.
+
+        Adapter weights are read from disk outside the generation lock; only injecting them
+        and switching the active adapter happens between two generations. The previous
+        default stays resident like any named adapter until the memory budget evicts it.
+        """
         if not HF_AVAILABLE:
             raise RuntimeError("HuggingFace stack not available")
         try:
-            # attempt to load adapter into model
             if self.model is None:
                 self._load_base_model()
-            # method depends on PEFT version; support load_adapter or PeftModel.from_pretrained
-            try:
-                self.model = PeftModel.from_pretrained(self.model, adapter_path)
-            except Exception:
-                # fallback: if using get_peft_model previously, use load_adapter API
-                self.model.load_adapter(adapter_path)
+            if self.model is None:
+                raise RuntimeError("VLM base model failed to load")
+            adapter_name = adapter_name or Path(adapter_path).name
+            if isinstance(self.model, PeftModel) and adapter_name in self.model.peft_config:
+                # Reloading under a live name; keep both until the switch
+                adapter_name = f"{adapter_name}@{int(time.time())}"
+            config = PeftConfig.from_pretrained(adapter_path)
+            weights = load_peft_weights(adapter_path, device=self.device)
+            nbytes = sum(t.numel() * t.element_size() for t in weights.values())
+            with self._generate_lock:
+                self._inject_adapter(adapter_name, config, weights)
+                self._activate(adapter_name)
+                previous, self.adapter_name = self.adapter_name, adapter_name
+                self.adapters.add(adapter_name, adapter_path, nbytes)
+                self._evict_adapters()
             self.adapter_loaded = True
+            log.info("Active VLM adapter: %s (%s)", adapter_name, adapter_path)
         except Exception as e:
             log.exception("Failed to load adapter: %s", e)
             raise
+
+    def swap_adapter(self, adapter_path: str, version: str):
+        """Registry promotion hook."""
+        self.load_adapter(adapter_path, adapter_name=version)
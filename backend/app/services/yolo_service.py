@@ -1,198 +1,234 @@
 from typing import List, Dict
 from pydantic import BaseModel
+from app.core.cache import LRUCache
 from app.core.config import settings
-from app.models.schemas import Box, DetectResponse
+from app.models.schemas import DetectResponse
+from app.core.hotswap import ModelSlot
+from app.core.metrics import MODEL_MEMORY, TILES_PROCESSED, TILES_SKIPPED, observe_stage, timed, watch_cache
+from app.services.model_registry import get_registry
+from app.services.tiling import EMPTY_DETECTIONS, DetectionParams, Region, merge_detections, plan_regions
+from pathlib import Path
+import hashlib
+import importlib.util
 import io
+import json
+import time
 from PIL import Image
 import logging
 import numpy as np
 
 log = logging.getLogger(__name__)
 
-try:
+# Optional dependency. ultralytics pulls in torch, so only check it is installed
+# here and import it when the first model is loaded (see _import_detectors).
+ULTRALYTICS_AVAILABLE = importlib.util.find_spec("ultralytics") is not None
+
+YOLO = None
+
+
+def _import_detectors():
+    """Import ultralytics into module globals on first use."""
+    global YOLO
+    if YOLO is not None:
+        return
     from ultralytics import YOLO
-    ULTRALYTICS_AVAILABLE = True
-except Exception:
-    ULTRALYTICS_AVAILABLE = False
-
-try:
-    from sahi import AutoDetectionModel
-    from sahi.predict import get_sliced_prediction
-    SAHI_AVAILABLE = True
-except Exception:
-    SAHI_AVAILABLE = False
-    log.warning("SAHI not available. Install with: pip install sahi")
+
+
+def decode_image(image_bytes: bytes) -> Image.Image:
+    """Encoded image to RGB, timed as the decode stage."""
+    with timed("decode"):
+        return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+
+class YoloBundle:
+    """A loaded set of weights."""
+
+    def __init__(self, weights: str, model=None):
+        self.weights = weights
+        self.model = model
+
 
 class YoloService:
     def __init__(self, weights: str = None):
-        self.weights = weights or settings.yolo_weights
-        self.model = None
-        self.sahi_model = None
+        # A promoted registry version takes precedence over the configured weights
+        self.weights = weights or get_registry().active_path("yolo") or settings.yolo_weights
+        self.slot = ModelSlot()
+        # Detections per (image hash, weights version, parameters, cascade); counted in entries
+        self.result_cache = LRUCache(settings.yolo_result_cache_size, sizeof=lambda _: 1)
+        # Optional second stage for uncertain detections (see app.services.cascade), set by the container
+        self.cascade = None
+        self.params = self.load_params()
+        watch_cache("yolo_results", self.result_cache)
+        MODEL_MEMORY.set_function(self.model_memory_bytes, model="yolo")
         
         if ULTRALYTICS_AVAILABLE:
             try:
-                self.model = YOLO(self.weights)
-                
-                # Initialize SAHI model if available and enabled
-                if SAHI_AVAILABLE and settings.use_sahi_inference:
-                    self.sahi_model = AutoDetectionModel.from_pretrained(
-                        model_type='yolov8',
-                        model_path=self.weights,
-                        confidence_threshold=0.01,  # Match training confidence
-                        device="cpu",  # or "cuda:0" if you have GPU
-                        image_size=512  # Match training image size
-                    )
-                    log.info("SAHI model initialized for sliced inference")
-                else:
-                    log.info("Using standard YOLO inference (SAHI disabled)")
-                    
+                self.slot.swap(self.load_bundle(self.weights), version=self.weights)
             except Exception as e:
                 log.warning("Could not load YOLO model: %s", e)
-                self.model = None
 
-    def _pil_from_bytes(self, image_bytes: bytes):
-        return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    @staticmethod
+    def load_params() -> DetectionParams:
+        """Detection parameters: the defaults, overridden by settings.detection_params_file if set."""
+        params = DetectionParams(sliced=settings.use_sahi_inference)
+        if settings.detection_params_file:
+            try:
+                with open(settings.detection_params_file, "r") as f:
+                    params = params.model_copy(update=json.load(f))
+                log.info("Detection parameters from %s", settings.detection_params_file)
+            except Exception as e:
+                log.warning("Could not read detection parameters from %s: %s", settings.detection_params_file, e)
+        # Round-trip through validation so a bad file cannot smuggle in wrong types
+        return DetectionParams(**params.model_dump())
 
-    def _standard_inference(self, img: Image.Image) -> DetectResponse:
-        """Standard YOLO inference without slicing."""
-        img_w, img_h = img.size
-        log.info(f"Input image size: {img_w}x{img_h}")
-        
-        if self.model is None:
-            return DetectResponse(boxes=[], classes=[], scores=[])
-
-        # Use same image size as training (512) for consistency
-        # Keep low conf for model prediction but filter later
-        results = self.model.predict(source=img, imgsz=512, conf=0.01, iou=0.3, verbose=False)
-        res = results[0]
-        boxes = []
-        classes = []
-        scores = []
-        
-        if hasattr(res, "boxes") and res.boxes is not None:
-            all_detections = []
-            for box in res.boxes:
-                xyxy = box.xyxy[0].cpu().numpy()
-                conf = float(box.conf[0].cpu().numpy()) if hasattr(box, "conf") else 0.0
-                cls = int(box.cls[0].cpu().numpy()) if hasattr(box, "cls") else -1
-                
-                # Filter out low confidence detections (below 60%)
-                if conf < 0.6:
-                    continue
-                
-                # Ensure coordinates are within image bounds
-                xmin = max(0, min(int(xyxy[0]), img_w - 1))
-                ymin = max(0, min(int(xyxy[1]), img_h - 1))
-                xmax = max(xmin + 1, min(int(xyxy[2]), img_w))
-                ymax = max(ymin + 1, min(int(xyxy[3]), img_h))
-                
-                # Log coordinate info for debugging
-                log.info(f"Detection: conf={conf:.3f}, coords=({xmin},{ymin},{xmax},{ymax}), size={xmax-xmin}x{ymax-ymin}")
-                
-                box_area = (xmax - xmin) * (ymax - ymin)
-                
-                all_detections.append({
-                    'box': Box(x=xmin, y=ymin, w=xmax - xmin, h=ymax - ymin),
-                    'class': str(cls),
-                    'score': conf,
-                    'area': box_area
-                })
-            
-            if all_detections:
-                all_detections.sort(key=lambda x: x['score'], reverse=True)
-                min_area = max(25, (img_w * img_h) * 0.0001)
-                filtered_detections = [d for d in all_detections if d['area'] > min_area]
-                top_detections = filtered_detections[:10]
-                
-                for detection in top_detections:
-                    boxes.append(detection['box'])
-                    classes.append(detection['class'])
-                    scores.append(detection['score'])
-                    
-        log.info(f"Final detections (60%+ confidence): {len(boxes)}")
-        return DetectResponse(boxes=boxes, classes=classes, scores=scores)
-
-    def _sahi_inference(self, img: Image.Image) -> DetectResponse:
-        """SAHI sliced inference for large images with small objects."""
-        if self.sahi_model is None:
-            log.warning("SAHI model not available, falling back to standard inference")
-            return self._standard_inference(img)
-        
+    @property
+    def model(self):
+        bundle = self.slot.model
+        return bundle.model if bundle else None
+
+    def model_memory_bytes(self) -> int:
+        """Parameter and buffer bytes of the served detector (0 when none is loaded)."""
+        module = getattr(self.model, "model", None)
+        if module is None or not hasattr(module, "parameters"):
+            return 0
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    @property
+    def class_names(self) -> Dict[int, str]:
+        """Class id to name, from the loaded weights or the dataset YAML."""
+        model = self.model
+        if model is not None and getattr(model, "names", None):
+            return {int(k): str(v) for k, v in dict(model.names).items()}
         try:
-            # Convert PIL image to numpy array for SAHI
-            img_array = np.array(img)
-            
-            # Use EXACT same parameters as training
-            result = get_sliced_prediction(
-                image=img_array,
-                detection_model=self.sahi_model,
-                slice_height=512,  # Exact match to training
-                slice_width=512,   # Exact match to training
-                overlap_height_ratio=0.3,  # Match training overlap
-                overlap_width_ratio=0.3,   # Match training overlap
-                postprocess_type="GREEDYNMM",
-                postprocess_match_metric="IOS",
-                postprocess_match_threshold=0.5,  # Standard threshold
-                postprocess_class_agnostic=True,
-                verbose=1  # See what's happening
-            )
-            
-            # Convert SAHI results to our format with confidence filtering
-            boxes = []
-            classes = []
-            scores = []
-            
-            log.info(f"Raw SAHI detections: {len(result.object_prediction_list)}")
-            
-            for detection in result.object_prediction_list:
-                bbox = detection.bbox
-                score = float(detection.score.value)
-                
-                # Apply 60% confidence threshold
-                if score >= 0.3:
-                    x_min, y_min, x_max, y_max = bbox.to_xyxy()
-                    
-                    boxes.append(Box(
-                        x=int(x_min), 
-                        y=int(y_min), 
-                        w=int(x_max - x_min), 
-                        h=int(y_max - y_min)
-                    ))
-                    classes.append(str(detection.category.id))
-                    scores.append(score)
-            
-            # Sort by confidence and take reasonable number
-            if boxes:
-                # Create detection list
-                all_detections = list(zip(boxes, classes, scores))
-                # Sort by score (descending)
-                all_detections.sort(key=lambda x: x[2], reverse=True)
-                
-                # Take top detections
-                top_detections = all_detections[:20]
-                
-                boxes = [d[0] for d in top_detections]
-                classes = [d[1] for d in top_detections]
-                scores = [d[2] for d in top_detections]
-                
-                log.info(f"Final detections (60%+ confidence): {len(boxes)}")
-                for i, (box, score) in enumerate(zip(boxes[:3], scores[:3])):
-                    log.info(f"Detection {i+1}: score={score:.3f}, area={box.w*box.h}")
-            
-            return DetectResponse(boxes=boxes, classes=classes, scores=scores)
-            
+            import yaml
+            with open(settings.dataset_yaml, "r") as f:
+                names = (yaml.safe_load(f) or {}).get("names", {})
         except Exception as e:
-            log.error(f"SAHI inference failed: {str(e)}, falling back to standard inference")
-            return self._standard_inference(img)
+            log.warning("Could not read class names from %s: %s", settings.dataset_yaml, e)
+            return {}
+        if isinstance(names, list):
+            names = dict(enumerate(names))
+        return {int(k): str(v) for k, v in names.items()}
 
-    def infer_bytes(self, image_bytes: bytes) -> DetectResponse:
-        """Main inference method that chooses between standard and SAHI inference."""
-        img = self._pil_from_bytes(image_bytes)
-        
-        # Choose inference method based on configuration
-        if settings.use_sahi_inference and SAHI_AVAILABLE and self.sahi_model is not None:
-            log.info("Using SAHI sliced inference")
-            return self._sahi_inference(img)
+    def load_bundle(self, weights: str) -> YoloBundle:
+        """Load weights into a new bundle without touching the one being served."""
+        _import_detectors()
+        return YoloBundle(weights, YOLO(weights))
+
+    def warm_up(self, bundle: YoloBundle):
+        """Run one inference on a sample tile so the first real request is not slow."""
+        if settings.warmup_image and Path(settings.warmup_image).exists():
+            img = Image.open(settings.warmup_image).convert("RGB")
         else:
-            log.info("Using standard YOLO inference")
-            return self._standard_inference(img)
+            img = Image.new("RGB", (512, 512), "white")
+        started = time.perf_counter()
+        self._run_inference(img, bundle)
+        log.info("Warmed up %s in %.2fs", bundle.weights, time.perf_counter() - started)
+
+    def swap_weights(self, weights: str, version: str = None) -> Dict:
+        """Load, warm up and atomically swap in new weights, then drain the old model.
+
+        Returns the drain status ({"drained": bool, "in_flight": int}) for the deployment record.
+        """
+        if not ULTRALYTICS_AVAILABLE:
+            raise RuntimeError("ultralytics not available")
+        bundle = self.load_bundle(weights)
+        self.warm_up(bundle)
+        self.slot.swap(bundle, version=version or weights, drain_timeout=settings.model_drain_timeout)
+        self.weights = weights
+        drain = dict(self.slot.last_drain)
+        if drain["drained"]:
+            log.info("Serving YOLO weights %s (%s)", weights, version)
+        else:
+            log.warning("Serving YOLO weights %s (%s); the previous weights did not drain, %d requests still use them",
+                        weights, version, drain["in_flight"])
+        return drain
+
+    def predict_regions(self, img: Image.Image, regions: List[Region], bundle: YoloBundle = None,
+                        batch_size: int = 16, params: DetectionParams = None) -> np.ndarray:
+        """Raw detections (x0, y0, x1, y1, score, class) for crops of ``img``, in image coordinates.
+
+        Crops are predicted in batches; no score threshold beyond the model's own
+        ``params.model_conf`` is applied.
+        """
+        params = params or self.params
+        bundle = bundle or self.slot.model
+        if bundle is None or bundle.model is None or not regions:
+            TILES_SKIPPED.inc(len(regions), reason="no_model")
+            return EMPTY_DETECTIONS
+        rows = []
+        crop_s = predict_s = 0.0
+        for start in range(0, len(regions), batch_size):
+            batch = regions[start:start + batch_size]
+            started = time.perf_counter()
+            crops = [img.crop(region) for region in batch]
+            cropped = time.perf_counter()
+            results = bundle.model.predict(source=crops, imgsz=params.imgsz, conf=params.model_conf,
+                                           iou=params.nms_iou, verbose=False)
+            crop_s += cropped - started
+            predict_s += time.perf_counter() - cropped
+            for (x0, y0, _, _), res in zip(batch, results):
+                if getattr(res, "boxes", None) is None or len(res.boxes) == 0:
+                    continue
+                xyxy = res.boxes.xyxy.cpu().numpy() + np.array([x0, y0, x0, y0], dtype=np.float32)
+                conf = res.boxes.conf.cpu().numpy()[:, None]
+                cls = res.boxes.cls.cpu().numpy()[:, None]
+                rows.append(np.hstack([xyxy, conf, cls]).astype(np.float32))
+        observe_stage("tiling", crop_s)
+        observe_stage("inference", predict_s)
+        TILES_PROCESSED.inc(len(regions))
+        return np.vstack(rows) if rows else EMPTY_DETECTIONS
+
+    def detect(self, img: Image.Image, params: DetectionParams = None, bundle: YoloBundle = None,
+               min_score: float = None) -> DetectResponse:
+        """Tiled detection with the given parameters (the service's own by default), without the cascade.
+
+        ``min_score`` overrides the parameters' score cutoff, as in merge_detections.
+        """
+        params = params or self.params
+        raw = self.predict_regions(img, plan_regions(img.size, params), bundle, params=params)
+        return merge_detections(raw, img.size, params, min_score)
+
+    def detect_bytes(self, image_bytes: bytes, params: DetectionParams = None) -> DetectResponse:
+        """detect() on an encoded image, cached per image hash, weights and parameters."""
+        params = params or self.params
+        with self.slot.acquire() as bundle:
+            key = ("detect", hashlib.sha256(image_bytes).hexdigest(), bundle.weights if bundle else None, params.key())
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached.model_copy(deep=True)
+            result = self.detect(decode_image(image_bytes), params, bundle)
+            if bundle is not None:
+                self.result_cache.put(key, result.model_copy(deep=True))
+            return result
+
+    def _run_inference(self, img: Image.Image, bundle: YoloBundle) -> DetectResponse:
+        """detect() followed by the cascade when one is configured, as the /detect graph runs them."""
+        cascade = self.cascade
+        if cascade is None:
+            return self.detect(img, bundle=bundle)
+        started = time.perf_counter()
+        # Everything above the cascade's lower bound goes on to verification
+        result = self.detect(img, bundle=bundle, min_score=cascade.low)
+        detect_s = round(time.perf_counter() - started, 4)
+        return cascade.apply(img, result, self.class_names, detect_s=detect_s,
+                             fallback_min_score=self.params.min_score(img.size))
+
+    def infer_bytes(self, image_bytes: bytes) -> DetectResponse:
+        """Served detections for an encoded image, with the same tiling, merging and cascade as /detect."""
+        cascade = self.cascade
+        cascade_key = None if cascade is None else (
+            cascade.verifier.name, cascade.low, cascade.high, getattr(cascade.verifier, "available", True))
+        # Hold the bundle for the whole request so a concurrent swap drains it first
+        with self.slot.acquire() as bundle:
+            key = (hashlib.sha256(image_bytes).hexdigest(), bundle.weights if bundle else None,
+                   self.params.key(), cascade_key)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached.model_copy(deep=True)
+            img = decode_image(image_bytes)
+            result = self._run_inference(img, bundle)
+            if bundle is not None:
+                self.result_cache.put(key, result.model_copy(deep=True))
+            return result
@@ -2,242 +2,393 @@
 """
 Data Augmentation Script for Original YOLO Dataset
 This script augments the original 3 images and creates proper train/val split.
+The same augmentations can also be applied lazily at load time (write_lazy_dataset),
+without writing the augmented copies to disk.
 """
 
 import os
+import json
+import argparse
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-import shutil
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
 import random
 import math
+import yaml
+from yolo_labels import read_labels, write_labels
 
-class YOLODataAugmenter:
-    def __init__(self, source_images_dir, source_labels_dir, output_base_dir):
-        self.source_images_dir = Path(source_images_dir)
-        self.source_labels_dir = Path(source_labels_dir)
-        self.output_base_dir = Path(output_base_dir)
+# name -> (method, keyword arguments); the names end up in the output file names
+AUGMENTATIONS = {
+    "hflip": ("horizontal_flip", {}),
+    "vflip": ("vertical_flip", {}),
+    "rot90": ("rotate_90", {}),
+    "rot270": ("rotate_270", {}),
+    "bright": ("brightness_adjustment", {"factor": 1.3}),
+    "dark": ("brightness_adjustment", {"factor": 0.7}),
+    "contrast": ("contrast_adjustment", {"factor": 1.4}),
+    "blur": ("gaussian_blur", {}),
+    "noise": ("add_noise", {}),
+}
+
+# Jobs handed to a worker at a time; jobs are ordered by source image, so a chunk
+# mostly reuses the worker's cached decode of the same image
+JOB_CHUNKSIZE = 8
+
+# Marker file of a lazily augmented split (see write_lazy_dataset)
+LAZY_MARKER = "lazy.json"
+
+
+@lru_cache(maxsize=4)
+def _load_source(img_path):
+    return cv2.imread(img_path)
+
+
+def as_label_array(boxes):
+    """Copy of YOLO boxes as an N x 5 float64 array (class_id, x_center, y_center, width, height)."""
+    return np.array(boxes, dtype=np.float64).reshape(-1, 5)
+
+
+def flip_boxes_horizontal(boxes):
+    labels = as_label_array(boxes)
+    labels[:, 1] = 1.0 - labels[:, 1]
+    return labels
+
+
+def flip_boxes_vertical(boxes):
+    labels = as_label_array(boxes)
+    labels[:, 2] = 1.0 - labels[:, 2]
+    return labels
+
+
+def rotate_boxes_90(boxes):
+    """Boxes of an image rotated 90 degrees clockwise: (x, y) -> (1 - y, x), width and height swap."""
+    labels = as_label_array(boxes)
+    rotated = labels.copy()
+    rotated[:, 1] = 1.0 - labels[:, 2]
+    rotated[:, 2] = labels[:, 1]
+    rotated[:, 3:5] = labels[:, [4, 3]]
+    return rotated
+
+
+def rotate_boxes_270(boxes):
+    """Boxes of an image rotated 90 degrees counter-clockwise: (x, y) -> (y, 1 - x), width and height swap."""
+    labels = as_label_array(boxes)
+    rotated = labels.copy()
+    rotated[:, 1] = labels[:, 2]
+    rotated[:, 2] = 1.0 - labels[:, 1]
+    rotated[:, 3:5] = labels[:, [4, 3]]
+    return rotated
+
+
+# Box transforms of the geometric augmentations; the others leave the boxes alone
+BOX_TRANSFORMS = {
+    "horizontal_flip": flip_boxes_horizontal,
+    "vertical_flip": flip_boxes_vertical,
+    "rotate_90": rotate_boxes_90,
+    "rotate_270": rotate_boxes_270,
+}
+SWAPS_SHAPE = {"rotate_90", "rotate_270"}
+
+
+class AugmentationSpec:
+    """
+    Which augmentations to draw from and how often, e.g. AugmentationSpec.parse("hflip:2,rot90,blur").
+    The default draws uniformly from every entry of AUGMENTATIONS.
+    """
+    
+    def __init__(self, weights=None):
+        self.weights = dict(weights) if weights else {name: 1.0 for name in AUGMENTATIONS}
+        unknown = sorted(set(self.weights) - set(AUGMENTATIONS))
+        if unknown:
+            raise ValueError(f"Unknown augmentations {unknown}; choose from {sorted(AUGMENTATIONS)}")
+    
+    @classmethod
+    def parse(cls, text):
+        if not text:
+            return cls()
+        weights = {}
+        for item in text.split(","):
+            name, _, weight = item.strip().partition(":")
+            weights[name] = float(weight) if weight else 1.0
+        return cls(weights)
+    
+    def choose(self, rng):
+        names = list(self.weights)
+        if len(set(self.weights.values())) == 1:
+            return rng.choice(names)
+        return rng.choices(names, weights=[self.weights[name] for name in names])[0]
+    
+    def to_dict(self):
+        return dict(self.weights)
+
+
+def plan_jobs(source_images_dir, source_labels_dir, multiplier=10, seed=0, val_ratio=0.2, spec=None):
+    """
+    Decide every output up front: the source image, augmentation, name, split and
+    seed of each job. The split is fixed here (80/20 over all outputs, as before)
+    so outputs can go straight to their final place, on disk or at load time.
+    """
+    spec = spec or AugmentationSpec()
+    rng = random.Random(seed)
+    jobs = []
+    for img_path in sorted(Path(source_images_dir).glob("*.jpg")):
+        # Convert filename to match label file naming convention
+        label_filename = img_path.stem.replace(" ", "_") + ".txt"
+        label_path = Path(source_labels_dir) / label_filename
         
-        # Create output directories
-        self.train_images_dir = self.output_base_dir / "images" / "train"
-        self.train_labels_dir = self.output_base_dir / "labels" / "train"
-        self.val_images_dir = self.output_base_dir / "images" / "val"
-        self.val_labels_dir = self.output_base_dir / "labels" / "val"
+        if not label_path.exists():
+            print(f"⚠️  Warning: No label file found for {img_path.name} (expected: {label_filename})")
+            continue
         
-        for dir_path in [self.train_images_dir, self.train_labels_dir, self.val_images_dir, self.val_labels_dir]:
-            dir_path.mkdir(parents=True, exist_ok=True)
+        jobs.append({'image': str(img_path), 'label': str(label_path), 'aug': None,
+                     'name': f"{img_path.stem}_original"})
+        for i in range(multiplier):
+            aug_name = spec.choose(rng)
+            jobs.append({'image': str(img_path), 'label': str(label_path), 'aug': aug_name,
+                         'name': f"{img_path.stem}_aug_{i:02d}_{aug_name}"})
+    
+    order = list(range(len(jobs)))
+    rng.shuffle(order)
+    train_count = int((1.0 - val_ratio) * len(jobs))
+    for rank, index in enumerate(order):
+        jobs[index]['split'] = 'train' if rank < train_count else 'val'
+    for index, job in enumerate(jobs):
+        job['seed'] = (seed, index)
+    return jobs
+
+
+class YOLOTransforms:
+    """Image and box transforms shared by the on-disk augmenter and the lazy dataset."""
     
     def parse_yolo_label(self, label_path):
-        """Parse YOLO format label file."""
-        boxes = []
-        if label_path.exists():
-            with open(label_path, 'r') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) == 5:
-                        class_id = int(parts[0])
-                        x_center = float(parts[1])
-                        y_center = float(parts[2])
-                        width = float(parts[3])
-                        height = float(parts[4])
-                        boxes.append([class_id, x_center, y_center, width, height])
-        return boxes
+        """Parse YOLO format label file into an N x 5 array."""
+        return read_labels(label_path)
     
     def save_yolo_label(self, boxes, label_path):
         """Save boxes in YOLO format."""
-        with open(label_path, 'w') as f:
-            for box in boxes:
-                f.write(f"{box[0]} {box[1]:.6f} {box[2]:.6f} {box[3]:.6f} {box[4]:.6f}\n")
+        write_labels(label_path, boxes)
     
     def horizontal_flip(self, image, boxes):
         """Horizontal flip with coordinate transformation."""
-        flipped_image = cv2.flip(image, 1)
-        flipped_boxes = []
-        
-        for box in boxes:
-            class_id, x_center, y_center, width, height = box
-            # Transform x_center for horizontal flip
-            new_x_center = 1.0 - x_center
-            flipped_boxes.append([class_id, new_x_center, y_center, width, height])
-        
-        return flipped_image, flipped_boxes
+        return cv2.flip(image, 1), flip_boxes_horizontal(boxes)
     
     def vertical_flip(self, image, boxes):
         """Vertical flip with coordinate transformation."""
-        flipped_image = cv2.flip(image, 0)
-        flipped_boxes = []
-        
-        for box in boxes:
-            class_id, x_center, y_center, width, height = box
-            # Transform y_center for vertical flip
-            new_y_center = 1.0 - y_center
-            flipped_boxes.append([class_id, x_center, new_y_center, width, height])
-        
-        return flipped_image, flipped_boxes
+        return cv2.flip(image, 0), flip_boxes_vertical(boxes)
     
     def rotate_90(self, image, boxes):
         """Rotate 90 degrees clockwise with coordinate transformation."""
-        rotated_image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-        rotated_boxes = []
-        
-        for box in boxes:
-            class_id, x_center, y_center, width, height = box
-            # Transform coordinates for 90-degree rotation
-            new_x_center = y_center
-            new_y_center = 1.0 - x_center
-            new_width = height
-            new_height = width
-            rotated_boxes.append([class_id, new_x_center, new_y_center, new_width, new_height])
-        
-        return rotated_image, rotated_boxes
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE), rotate_boxes_90(boxes)
     
     def rotate_270(self, image, boxes):
         """Rotate 270 degrees clockwise with coordinate transformation."""
-        rotated_image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        rotated_boxes = []
-        
-        for box in boxes:
-            class_id, x_center, y_center, width, height = box
-            # Transform coordinates for 270-degree rotation
-            new_x_center = 1.0 - y_center
-            new_y_center = x_center
-            new_width = height
-            new_height = width
-            rotated_boxes.append([class_id, new_x_center, new_y_center, new_width, new_height])
-        
-        return rotated_image, rotated_boxes
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE), rotate_boxes_270(boxes)
     
     def brightness_adjustment(self, image, boxes, factor=1.2):
         """Adjust brightness (no coordinate change needed)."""
-        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        enhancer = ImageEnhance.Brightness(pil_image)
-        enhanced = enhancer.enhance(factor)
-        enhanced_image = cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
-        return enhanced_image, boxes
+        # Same as PIL's ImageEnhance.Brightness: scale every channel value
+        lut = np.clip(np.arange(256) * factor + 0.5, 0, 255).astype(np.uint8)
+        return cv2.LUT(image, lut), boxes
     
     def contrast_adjustment(self, image, boxes, factor=1.3):
         """Adjust contrast (no coordinate change needed)."""
-        pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-        enhancer = ImageEnhance.Contrast(pil_image)
-        enhanced = enhancer.enhance(factor)
-        enhanced_image = cv2.cvtColor(np.array(enhanced), cv2.COLOR_RGB2BGR)
-        return enhanced_image, boxes
+        # Same as PIL's ImageEnhance.Contrast: stretch around the mean grey level
+        mean = int(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).mean() + 0.5)
+        lut = np.clip(mean + (np.arange(256) - mean) * factor + 0.5, 0, 255).astype(np.uint8)
+        return cv2.LUT(image, lut), boxes
     
     def gaussian_blur(self, image, boxes, kernel_size=3):
         """Apply Gaussian blur (no coordinate change needed)."""
         blurred_image = cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
         return blurred_image, boxes
     
-    def add_noise(self, image, boxes, noise_factor=25):
+    def add_noise(self, image, boxes, noise_factor=25, rng=None):
         """Add random noise (no coordinate change needed)."""
-        noise = np.random.randint(-noise_factor, noise_factor, image.shape, dtype=np.int16)
+        rng = rng if rng is not None else np.random.default_rng()
+        noise = rng.integers(-noise_factor, noise_factor, image.shape, dtype=np.int16)
         noisy_image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
         return noisy_image, boxes
     
-    def augment_dataset(self, multiplier=10):
-        """Augment the dataset and create train/val split."""
+    def apply(self, aug_name, image, boxes, seed=None):
+        """Run one AUGMENTATIONS entry; seed makes the random ones reproducible."""
+        method, kwargs = AUGMENTATIONS[aug_name]
+        if method == "add_noise":
+            kwargs = dict(kwargs, rng=np.random.default_rng(seed))
+        return getattr(self, method)(image, boxes, **kwargs)
+
+
+class YOLODataAugmenter(YOLOTransforms):
+    def __init__(self, source_images_dir, source_labels_dir, output_base_dir):
+        self.source_images_dir = Path(source_images_dir)
+        self.source_labels_dir = Path(source_labels_dir)
+        self.output_base_dir = Path(output_base_dir)
+        
+        # Create output directories
+        self.train_images_dir = self.output_base_dir / "images" / "train"
+        self.train_labels_dir = self.output_base_dir / "labels" / "train"
+        self.val_images_dir = self.output_base_dir / "images" / "val"
+        self.val_labels_dir = self.output_base_dir / "labels" / "val"
+        
+        for dir_path in [self.train_images_dir, self.train_labels_dir, self.val_images_dir, self.val_labels_dir]:
+            dir_path.mkdir(parents=True, exist_ok=True)
+    
+    def plan_jobs(self, multiplier=10, seed=0, val_ratio=0.2, spec=None):
+        return plan_jobs(self.source_images_dir, self.source_labels_dir, multiplier, seed, val_ratio, spec)
+    
+    def run_job(self, job):
+        """Generate and write one output; returns (split, name, box count, error)."""
+        try:
+            image = _load_source(job['image'])
+            if image is None:
+                raise ValueError(f"cannot read {job['image']}")
+            boxes = self.parse_yolo_label(job['label'])
+            if job['aug']:
+                image, boxes = self.apply(job['aug'], image, boxes, job['seed'])
+            
+            images_dir, labels_dir = (
+                (self.train_images_dir, self.train_labels_dir) if job['split'] == 'train'
+                else (self.val_images_dir, self.val_labels_dir)
+            )
+            cv2.imwrite(str(images_dir / f"{job['name']}.jpg"), image)
+            self.save_yolo_label(boxes, labels_dir / f"{job['name']}.txt")
+            return job['split'], job['name'], len(boxes), None
+        except Exception as e:
+            return job['split'], job['name'], 0, str(e)
+    
+    def augment_dataset(self, multiplier=10, workers=None, seed=0, spec=None):
+        """Augment the dataset and create train/val split, streaming results to disk."""
         print(f"Starting data augmentation with multiplier={multiplier}")
         print(f"Source images: {self.source_images_dir}")
         print(f"Source labels: {self.source_labels_dir}")
         print(f"Output directory: {self.output_base_dir}")
         
-        # Get all image files
-        image_files = list(self.source_images_dir.glob("*.jpg"))
-        print(f"Found {len(image_files)} original images")
-        
-        # Define augmentation functions
-        augmentation_functions = [
-            ("hflip", self.horizontal_flip),
-            ("vflip", self.vertical_flip),
-            ("rot90", self.rotate_90),
-            ("rot270", self.rotate_270),
-            ("bright", lambda img, boxes: self.brightness_adjustment(img, boxes, 1.3)),
-            ("dark", lambda img, boxes: self.brightness_adjustment(img, boxes, 0.7)),
-            ("contrast", lambda img, boxes: self.contrast_adjustment(img, boxes, 1.4)),
-            ("blur", self.gaussian_blur),
-            ("noise", self.add_noise),
-        ]
-        
-        all_augmented_data = []
-        
-        # Process each original image
-        for img_path in image_files:
-            # Convert filename to match label file naming convention
-            label_filename = img_path.stem.replace(" ", "_") + ".txt"
-            label_path = self.source_labels_dir / label_filename
-            
-            if not label_path.exists():
-                print(f"⚠️  Warning: No label file found for {img_path.name} (expected: {label_filename})")
-                continue
-            
-            # Load image and labels
-            image = cv2.imread(str(img_path))
-            boxes = self.parse_yolo_label(label_path)
-            
-            print(f"Processing {img_path.name} with {len(boxes)} annotations")
-            
-            # Add original image to dataset
-            all_augmented_data.append({
-                'image': image.copy(),
-                'boxes': boxes.copy(),
-                'name': f"{img_path.stem}_original"
-            })
-            
-            # Generate augmented versions
-            for i in range(multiplier):
-                # Randomly select augmentation
-                aug_name, aug_func = random.choice(augmentation_functions)
-                
-                try:
-                    aug_image, aug_boxes = aug_func(image, boxes.copy())
-                    
-                    all_augmented_data.append({
-                        'image': aug_image,
-                        'boxes': aug_boxes,
-                        'name': f"{img_path.stem}_aug_{i:02d}_{aug_name}"
-                    })
-                    
-                except Exception as e:
-                    print(f"  Error with {aug_name}: {e}")
-        
-        # Shuffle and split data (80% train, 20% val)
-        random.shuffle(all_augmented_data)
-        total_samples = len(all_augmented_data)
-        train_split = int(0.8 * total_samples)
-        
-        train_data = all_augmented_data[:train_split]
-        val_data = all_augmented_data[train_split:]
-        
-        print(f"\nSplitting {total_samples} samples:")
-        print(f"  Training: {len(train_data)} samples")
-        print(f"  Validation: {len(val_data)} samples")
+        jobs = self.plan_jobs(multiplier=multiplier, seed=seed, spec=spec)
+        sources = sorted(set(job['image'] for job in jobs))
+        print(f"Found {len(sources)} original images with labels, {len(jobs)} outputs planned")
         
-        # Save training data
-        for data in train_data:
-            img_name = f"{data['name']}.jpg"
-            label_name = f"{data['name']}.txt"
-            
-            cv2.imwrite(str(self.train_images_dir / img_name), data['image'])
-            self.save_yolo_label(data['boxes'], self.train_labels_dir / label_name)
-        
-        # Save validation data
-        for data in val_data:
-            img_name = f"{data['name']}.jpg"
-            label_name = f"{data['name']}.txt"
-            
-            cv2.imwrite(str(self.val_images_dir / img_name), data['image'])
-            self.save_yolo_label(data['boxes'], self.val_labels_dir / label_name)
+        counts = {'train': 0, 'val': 0}
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, max(1, len(jobs)))) as executor:
+            for split, name, box_count, error in executor.map(self.run_job, jobs, chunksize=JOB_CHUNKSIZE):
+                if error:
+                    print(f"  Error with {name}: {error}")
+                    continue
+                counts[split] += 1
         
         print(f"\n✅ Augmentation complete!")
         print(f"📊 Final dataset:")
-        print(f"   Training: {len(train_data)} images and labels")
-        print(f"   Validation: {len(val_data)} images and labels")
+        print(f"   Training: {counts['train']} images and labels")
+        print(f"   Validation: {counts['val']} images and labels")
         
-        return len(train_data), len(val_data)
+        return counts['train'], counts['val']
+
+
+class LazyAugmentedDataset(YOLOTransforms):
+    """
+    The planned jobs of one split, generated when a sample is read instead of being
+    written to disk. Labels and shapes of every sample are computed up front with
+    the vectorized box transforms; pixels are produced by load_bgr.
+    """
+    
+    def __init__(self, source_images_dir, source_labels_dir, split="train", multiplier=10, seed=0,
+                 val_ratio=0.2, spec=None):
+        self.jobs = [job for job in plan_jobs(source_images_dir, source_labels_dir, multiplier, seed, val_ratio, spec)
+                     if job['split'] == split]
+        self.names = [f"{job['name']}.jpg" for job in self.jobs]
+        
+        source_labels, source_shapes = {}, {}
+        for job in self.jobs:
+            if job['image'] not in source_shapes:
+                # Header read only, the pixels are decoded on first access
+                with Image.open(job['image']) as image:
+                    source_shapes[job['image']] = (image.height, image.width)
+                source_labels[job['image']] = self.parse_yolo_label(job['label'])
+        
+        self._labels, self._shapes = [], []
+        for job in self.jobs:
+            labels, shape = source_labels[job['image']], source_shapes[job['image']]
+            method = AUGMENTATIONS[job['aug']][0] if job['aug'] else None
+            if method in BOX_TRANSFORMS:
+                labels = BOX_TRANSFORMS[method](labels)
+            if method in SWAPS_SHAPE:
+                shape = shape[::-1]
+            self._labels.append(labels)
+            self._shapes.append(shape)
+    
+    def __len__(self):
+        return len(self.jobs)
+    
+    def shape(self, i):
+        return self._shapes[i]
+    
+    def labels_for(self, i):
+        return self._labels[i]
+    
+    def load_bgr(self, i):
+        job = self.jobs[i]
+        image = _load_source(job['image'])
+        if image is None:
+            raise ValueError(f"cannot read {job['image']}")
+        if job['aug']:
+            image, _ = self.apply(job['aug'], image, self._labels[i], job['seed'])
+        return image
+    
+    def __getitem__(self, i):
+        return self.load_bgr(i), self._labels[i]
+
+
+def write_lazy_dataset(output_dir, source_images_dir, source_labels_dir, names, multiplier=15, seed=0,
+                       val_ratio=0.2, spec=None):
+    """
+    Write a data.yaml whose train/val entries are marker directories describing a
+    LazyAugmentedDataset split; trainers open them with open_lazy_split.
+    """
+    output_dir = Path(output_dir)
+    spec = spec or AugmentationSpec()
+    for split in ("train", "val"):
+        split_dir = output_dir / split
+        split_dir.mkdir(parents=True, exist_ok=True)
+        with open(split_dir / LAZY_MARKER, "w") as f:
+            json.dump({
+                "source_images_dir": str(Path(source_images_dir).absolute()),
+                "source_labels_dir": str(Path(source_labels_dir).absolute()),
+                "split": split,
+                "multiplier": multiplier,
+                "seed": seed,
+                "val_ratio": val_ratio,
+                "spec": spec.to_dict(),
+            }, f, indent=2)
+    data_yaml = output_dir / "data.yaml"
+    with open(data_yaml, "w") as f:
+        yaml.dump({"path": str(output_dir.absolute()), "train": "train", "val": "val",
+                   "nc": len(names), "names": names}, f, default_flow_style=False)
+    return data_yaml
+
+
+def open_lazy_split(path):
+    """LazyAugmentedDataset described by a marker directory, or None for a regular image directory."""
+    marker = Path(path) / LAZY_MARKER
+    if not marker.exists():
+        return None
+    with open(marker, "r") as f:
+        config = json.load(f)
+    return LazyAugmentedDataset(
+        config["source_images_dir"], config["source_labels_dir"], split=config["split"],
+        multiplier=config["multiplier"], seed=config["seed"], val_ratio=config["val_ratio"],
+        spec=AugmentationSpec(config["spec"]),
+    )
 
 def main():
     """Main function to run data augmentation."""
+    parser = argparse.ArgumentParser(description="Augment the original YOLO dataset into train/val splits")
+    parser.add_argument("--multiplier", type=int, default=15, help="Augmented copies per original image")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for augmentation choice, split and noise")
+    parser.add_argument("--spec", type=str, default=None, help="Augmentations to draw from, e.g. 'hflip:2,rot90,blur' (default: all, uniformly)")
+    args = parser.parse_args()
     
     # Paths
     source_images = "../../data/images/original"
@@ -251,7 +402,8 @@ def main():
     augmenter = YOLODataAugmenter(source_images, source_labels, output_base)
     
     # Augment dataset (multiply by 15 to get ~48 images from 3 originals)
-    train_count, val_count = augmenter.augment_dataset(multiplier=15)
+    train_count, val_count = augmenter.augment_dataset(multiplier=args.multiplier, workers=args.workers, seed=args.seed,
+                                                       spec=AugmentationSpec.parse(args.spec))
     
     print(f"\n🎯 Dataset expanded from 3 to {train_count + val_count} images!")
     print(f"📁 Data saved to:")
@@ -263,4 +415,4 @@ def main():
     print(f"2. The model should perform much better with more balanced training data")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks of the detection pipeline, one stage at a time.
+
+Images are synthetic floor plans (walls, doors, windows, distractor symbols and
+distribution boards, with YOLO labels for the boards) of configurable size and
+symbol density, so no dataset is needed. Stages: image decode, slicing, model
+forward (when weights can be loaded), merging, response serialization and the
+AnalysisService store (save/list/get against N existing records).
+
+Results are written as JSON; with --baseline every stage median is compared to a
+previous run and slowdowns beyond --tolerance are reported as regressions.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from yolo_labels import to_absolute, to_normalized, write_labels
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+PROJECT_ROOT = BACKEND_ROOT.parent
+DEFAULT_OUTPUT_DIR = BACKEND_ROOT / "data" / "benchmarks"
+RESULTS_VERSION = 1
+
+BOARD_CLASS = 0  # distribution_board, the only class of data/config.yaml
+
+
+def parse_size(text):
+    width, height = (int(v) for v in text.lower().split("x"))
+    return width, height
+
+
+def _draw_board(canvas, x, y, size, rng):
+    """Distribution board: a filled-corner rectangle with a diagonal, as drawn on electrical plans."""
+    w, h = size, int(size * rng.uniform(0.5, 0.8))
+    cv2.rectangle(canvas, (x, y), (x + w, y + h), 0, 2)
+    cv2.line(canvas, (x, y + h), (x + w, y), 0, 1)
+    cv2.fillPoly(canvas, [np.array([(x, y), (x + w // 3, y), (x, y + h // 2)], dtype=np.int32)], 0)
+    return x, y, x + w, y + h
+
+
+def _draw_distractor(canvas, x, y, size, rng):
+    """An unlabeled symbol of similar size: socket, light fitting or switch."""
+    kind = rng.integers(3)
+    r = size // 2
+    if kind == 0:
+        cv2.circle(canvas, (x + r, y + r), r, 0, 1)
+        cv2.line(canvas, (x, y + r), (x + size, y + r), 0, 1)
+    elif kind == 1:
+        cv2.circle(canvas, (x + r, y + r), r, 0, 1)
+        cv2.line(canvas, (x + r // 3, y + r // 3), (x + size - r // 3, y + size - r // 3), 0, 1)
+        cv2.line(canvas, (x + size - r // 3, y + r // 3), (x + r // 3, y + size - r // 3), 0, 1)
+    else:
+        cv2.line(canvas, (x, y + size), (x + r, y + r), 0, 1)
+        cv2.circle(canvas, (x + r, y + r), max(2, r // 4), 0, -1)
+
+
+def generate_floor_plan(width=2480, height=1754, density=20.0, distractors=2.0, seed=0):
+    """
+    Synthetic floor plan as an RGB array plus YOLO labels of its distribution boards.
+    ``density`` is boards per megapixel; ``distractors`` is other symbols per board.
+    """
+    rng = np.random.default_rng(seed)
+    canvas = np.full((height, width), 255, dtype=np.uint8)
+    scale = min(width, height)
+    wall = max(3, scale // 150)
+    margin = scale // 20
+
+    # Outer walls, then rooms by recursive splits with door gaps
+    cv2.rectangle(canvas, (margin, margin), (width - margin, height - margin), 0, wall)
+    rooms = [(margin, margin, width - margin, height - margin)]
+    min_room = max(scale // 6, 40)
+    for _ in range(int(rng.integers(4, 10))):
+        index = int(rng.integers(len(rooms)))
+        x0, y0, x1, y1 = rooms[index]
+        vertical = (x1 - x0) > (y1 - y0)
+        lo, hi = (x0, x1) if vertical else (y0, y1)
+        if hi - lo < 2 * min_room:
+            continue
+        cut = int(rng.integers(lo + min_room, hi - min_room))
+        span = (y0, y1) if vertical else (x0, x1)
+        door = int(rng.integers(span[0] + wall * 2, max(span[0] + wall * 3, span[1] - min_room // 2)))
+        door_width = min_room // 3
+        for a, b in ((span[0], door), (door + door_width, span[1])):
+            if b > a:
+                start, end = ((cut, a), (cut, b)) if vertical else ((a, cut), (b, cut))
+                cv2.line(canvas, start, end, 0, max(2, wall // 2))
+        # Door swing
+        centre = (cut, door) if vertical else (door, cut)
+        cv2.ellipse(canvas, centre, (door_width, door_width), 0, 0, 90, 0, 1)
+        rooms[index:index + 1] = ([(x0, y0, cut, y1), (cut, y0, x1, y1)] if vertical
+                                  else [(x0, y0, x1, cut), (x0, cut, x1, y1)])
+
+    # Windows along the outer walls
+    for _ in range(int(rng.integers(4, 12))):
+        length = int(rng.integers(scale // 20, scale // 8))
+        if rng.random() < 0.5:
+            x = int(rng.integers(margin, width - margin - length))
+            y = margin if rng.random() < 0.5 else height - margin
+            cv2.rectangle(canvas, (x, y - wall), (x + length, y + wall), 255, -1)
+            cv2.rectangle(canvas, (x, y - wall), (x + length, y + wall), 0, 1)
+            cv2.line(canvas, (x, y), (x + length, y), 0, 1)
+        else:
+            y = int(rng.integers(margin, height - margin - length))
+            x = margin if rng.random() < 0.5 else width - margin - 1
+            cv2.rectangle(canvas, (x - wall, y), (x + wall, y + length), 255, -1)
+            cv2.rectangle(canvas, (x - wall, y), (x + wall, y + length), 0, 1)
+            cv2.line(canvas, (x, y), (x, y + length), 0, 1)
+
+    # Symbols, boards labeled and distractors not, kept from overlapping each other
+    n_boards = max(1, int(round(density * width * height / 1e6)))
+    n_symbols = n_boards + int(round(n_boards * distractors))
+    is_board = np.zeros(n_symbols, dtype=bool)
+    is_board[rng.permutation(n_symbols)[:n_boards]] = True
+    occupied = np.zeros((0, 4), dtype=np.int64)
+    boxes = []
+    for board in is_board:
+        size = int(rng.integers(max(12, scale // 80), max(16, scale // 35)))
+        for _ in range(20):
+            x = int(rng.integers(margin + wall, width - margin - wall - size))
+            y = int(rng.integers(margin + wall, height - margin - wall - size))
+            candidate = np.array([x - 2, y - 2, x + size + 2, y + size + 2])
+            if not len(occupied) or not np.any((occupied[:, 0] < candidate[2]) & (candidate[0] < occupied[:, 2])
+                                               & (occupied[:, 1] < candidate[3]) & (candidate[1] < occupied[:, 3])):
+                break
+        else:
+            continue
+        occupied = np.vstack([occupied, candidate])
+        if board:
+            boxes.append(_draw_board(canvas, x, y, size, rng))
+        else:
+            _draw_distractor(canvas, x, y, size, rng)
+
+    # Scanner-like noise
+    noise = rng.normal(0, 4, canvas.shape)
+    image = np.clip(canvas.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+    labels = to_normalized(np.array(boxes, dtype=np.float64).reshape(-1, 4), np.full(len(boxes), BOARD_CLASS),
+                           width, height)
+    return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB), labels
+
+
+def encode_image(image, fmt="jpeg", quality=90):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format=fmt.upper(), **({"quality": quality} if fmt == "jpeg" else {}))
+    return buffer.getvalue()
+
+
+def simulate_region_detections(labels, regions, image_size, false_positives=0.5, seed=0):
+    """
+    Raw detections shaped like YoloService.predict_regions output: every labeled box
+    as seen (clipped) by each region it touches, with jitter and scores, plus low
+    scoring false positives per region.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = image_size
+    gt = to_absolute(labels, width, height)
+    rows = []
+    for x0, y0, x1, y1 in regions:
+        clipped = np.stack([np.maximum(gt[:, 0], x0), np.maximum(gt[:, 1], y0),
+                            np.minimum(gt[:, 2], x1), np.minimum(gt[:, 3], y1)], axis=1)
+        visible = clipped[(clipped[:, 2] - clipped[:, 0] > 1) & (clipped[:, 3] - clipped[:, 1] > 1)]
+        visible = visible + rng.normal(0, 1.0, visible.shape)
+        scores = rng.uniform(0.4, 0.95, (len(visible), 1))
+        rows.append(np.hstack([visible, scores, np.zeros((len(visible), 1))]))
+        n_false = rng.poisson(false_positives)
+        if n_false:
+            xy = rng.uniform([x0, y0], [max(x0 + 1, x1 - 20), max(y0 + 1, y1 - 20)], (n_false, 2))
+            wh = rng.uniform(8, 20, (n_false, 2))
+            rows.append(np.hstack([xy, xy + wh, rng.uniform(0.01, 0.35, (n_false, 1)), np.zeros((n_false, 1))]))
+    return np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 6), dtype=np.float32)
+
+
+def measure(fn, repeat=5, warmup=1, setup=None):
+    """Time fn() repeat times (after warmup untimed calls); setup() runs untimed before every call."""
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    times = np.array(times) * 1000
+    return {
+        "median_ms": round(float(np.median(times)), 4),
+        "p95_ms": round(float(np.percentile(times, 95)), 4),
+        "min_ms": round(float(times.min()), 4),
+        "runs": len(times),
+    }
+
+
+def benchmark_image_stages(size, density, repeat, seed, service=None):
+    """Decode, slicing, forward, merge and serialization timings for one synthetic image size."""
+    from app.services.tiling import DetectionParams, merge_detections, plan_regions
+    from app.services.yolo_service import decode_image
+
+    params = service.params if service else DetectionParams()
+    image, labels = generate_floor_plan(*size, density=density, seed=seed)
+    data = encode_image(image)
+    tag = f"{size[0]}x{size[1]}"
+    results = {}
+
+    decode = lambda: decode_image(data)
+    results[f"decode[{tag}]"] = dict(measure(decode, repeat), bytes=len(data))
+    img = decode()
+
+    regions = plan_regions(img.size, params)
+    results[f"slice[{tag}]"] = dict(measure(lambda: [img.crop(region).load() for region in plan_regions(img.size, params)],
+                                            repeat), regions=len(regions))
+
+    if service is not None and service.slot.model is not None:
+        results[f"forward[{tag}]"] = dict(measure(lambda: service.predict_regions(img, regions, params=params),
+                                                  max(1, repeat // 2)), regions=len(regions))
+
+    raw = simulate_region_detections(labels, regions, img.size, seed=seed)
+    results[f"merge[{tag}]"] = dict(measure(lambda: merge_detections(raw, img.size, params), repeat),
+                                    raw_detections=len(raw))
+
+    # The served response, as returned to the client and stored with an analysis
+    response = merge_detections(raw, img.size, params)
+    results[f"serialize[{tag}]"] = dict(measure(response.model_dump_json, repeat * 10), boxes=len(response.boxes))
+    return results, response
+
+
+def synthetic_records(count, response, seed=0):
+    """Analysis records in AnalysisService's stored form."""
+    rng = np.random.default_rng(seed)
+    detection = response.model_dump()
+    start = datetime(2024, 1, 1)
+    offsets = rng.integers(0, 365 * 24 * 3600, count)
+    return [{
+        "id": str(uuid.UUID(int=int(rng.integers(1 << 62)) << 64 | i)),
+        "filename": f"plan_{i:06d}.jpg",
+        "upload_date": (start + timedelta(seconds=int(offsets[i]))).isoformat(),
+        "processing_time": int(rng.integers(200, 5000)),
+        "detection_result": detection,
+        "image_url": f"/analysis/{i}/image",
+        "status": "completed",
+    } for i in range(count)]
+
+
+def benchmark_store(record_counts, response, repeat, seed, workdir):
+    """AnalysisService save/list/get with N records already stored."""
+    from app.services.analysis_service import AnalysisService
+
+    results = {}
+    image_data = encode_image(np.full((64, 64, 3), 255, dtype=np.uint8))
+    for count in record_counts:
+        root = Path(workdir) / f"store_{count}"
+        shutil.rmtree(root, ignore_errors=True)
+        service = AnalysisService(data_root=root)
+        records = synthetic_records(count, response, seed=seed)
+        lookup_id = records[len(records) // 2]["id"] if records else "missing"
+        reset = lambda: service._save_analyses_data(records)
+        reset()
+        store_mb = service.analyses_file.stat().st_size / 1024 ** 2
+
+        save = lambda: service.save_analysis(str(uuid.uuid4()), "bench.jpg", response, 1000, image_data)
+        results[f"store_save[{count}]"] = dict(measure(save, repeat, warmup=0, setup=reset), file_mb=round(store_mb, 2))
+        reset()
+        results[f"store_list[{count}]"] = measure(lambda: service.get_all_analyses(sort_by="date"), repeat, warmup=0)
+        results[f"store_get[{count}]"] = measure(lambda: service.get_analysis_by_id(lookup_id), repeat, warmup=0)
+        shutil.rmtree(root, ignore_errors=True)
+        print(f"  store with {count} records done ({store_mb:.1f} MB)")
+    return results
+
+
+def environment():
+    import pydantic
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pydantic": pydantic.VERSION,
+    }
+
+
+def compare(results, baseline, tolerance=0.2, min_delta_ms=0.05):
+    """
+    Stage-by-stage comparison of median times against a baseline run. A stage
+    regresses when it is more than ``tolerance`` slower and by at least
+    ``min_delta_ms`` (so sub-microsecond noise does not count).
+    """
+    rows = []
+    for stage, current in results["results"].items():
+        previous = baseline.get("results", {}).get(stage)
+        if previous is None:
+            continue
+        before, after = previous["median_ms"], current["median_ms"]
+        ratio = after / before if before > 0 else float("inf")
+        status = "ok"
+        if ratio > 1 + tolerance and after - before >= min_delta_ms:
+            status = "regression"
+        elif ratio < 1 / (1 + tolerance) and before - after >= min_delta_ms:
+            status = "improvement"
+        rows.append({"stage": stage, "baseline_ms": before, "current_ms": after,
+                     "ratio": round(ratio, 3), "status": status})
+    return rows
+
+
+def print_results(results):
+    print(f"\n{'stage':32} {'median ms':>12} {'p95 ms':>12}")
+    for stage, row in results.items():
+        print(f"{stage:32} {row['median_ms']:12.3f} {row['p95_ms']:12.3f}")
+
+
+def print_comparison(rows):
+    print(f"\n{'stage':32} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for row in rows:
+        flag = {"regression": "  <-- REGRESSION", "improvement": "  (faster)"}.get(row["status"], "")
+        print(f"{row['stage']:32} {row['baseline_ms']:12.3f} {row['current_ms']:12.3f} {row['ratio']:7.2f}{flag}")
+
+
+def dump_dataset(output_dir, count, size, density, seed):
+    """Write count synthetic floor plans with labels in the YOLO images/labels layout."""
+    images_dir, labels_dir = Path(output_dir) / "images", Path(output_dir) / "labels"
+    images_dir.mkdir(parents=True, exist_ok=True)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        image, labels = generate_floor_plan(*size, density=density, seed=seed + i)
+        Image.fromarray(image).save(images_dir / f"synthetic_{i:04d}.jpg", quality=90)
+        write_labels(labels_dir / f"synthetic_{i:04d}.txt", labels)
+    print(f"Wrote {count} synthetic floor plans to {output_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection pipeline stage by stage on synthetic floor plans")
+    parser.add_argument("--sizes", nargs="+", default=["1024x768", "2480x1754", "4960x3508"],
+                        help="Synthetic image sizes as WIDTHxHEIGHT")
+    parser.add_argument("--density", type=float, default=20.0, help="Distribution boards per megapixel")
+    parser.add_argument("--records", nargs="*", type=int, default=[10000, 100000],
+                        help="Stored analysis counts for the store benchmark (none to skip)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage")
+    parser.add_argument("--store-repeat", type=int, default=3, help="Timed runs per store operation")
+    parser.add_argument("--weights", type=str, default=None,
+                        help="Weights for the forward pass (default: the deployed weights; skipped if they cannot load)")
+    parser.add_argument("--no-model", action="store_true", help="Skip the model forward pass")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic images and records")
+    parser.add_argument("--output", type=str, default=None, help="Results JSON (default: data/benchmarks/<timestamp>.json)")
+    parser.add_argument("--baseline", type=str, default=None, help="Previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a stage counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true", help="Also write these results to the --baseline path")
+    parser.add_argument("--dump", type=str, default=None, metavar="DIR",
+                        help="Only write synthetic images and labels to DIR (e.g. for evaluate_detection.py)")
+    parser.add_argument("--dump-count", type=int, default=20, help="Images to write with --dump")
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes]
+    if args.dump:
+        dump_dataset(args.dump, args.dump_count, sizes[0], args.density, args.seed)
+        return
+
+    sys.path.insert(0, str(BACKEND_ROOT))
+    service = None
+    if not args.no_model:
+        from app.services.yolo_service import YoloService
+        service = YoloService(args.weights)
+        if service.slot.model is None:
+            print("Model not available, skipping the forward pass")
+
+    results = {}
+    response = None
+    for size in sizes:
+        print(f"Benchmarking {size[0]}x{size[1]} ...")
+        stage_results, response = benchmark_image_stages(size, args.density, args.repeat, args.seed, service)
+        results.update(stage_results)
+
+    if args.records:
+        print("Benchmarking the analysis store ...")
+        workdir = tempfile.mkdtemp(prefix="benchmark_store_")
+        try:
+            results.update(benchmark_store(args.records, response, args.store_repeat, args.seed, workdir))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "environment": environment(),
+        "args": {"sizes": args.sizes, "density": args.density, "records": args.records, "repeat": args.repeat,
+                 "store_repeat": args.store_repeat, "seed": args.seed,
+                 "weights": service.weights if service and service.slot.model is not None else None},
+        "results": results,
+    }
+    print_results(results)
+
+    regressions = []
+    if args.baseline and Path(args.baseline).exists() and not args.update_baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("environment") != report["environment"]:
+            print("\nWarning: baseline was recorded in a different environment")
+        rows = compare(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": str(args.baseline), "tolerance": args.tolerance, "stages": rows}
+        print_comparison(rows)
+        regressions = [row["stage"] for row in rows if row["status"] == "regression"]
+
+    output = Path(args.output) if args.output else DEFAULT_OUTPUT_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.update_baseline and args.baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(output, args.baseline)
+        print(f"Baseline updated: {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
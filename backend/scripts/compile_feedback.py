@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Feedback-to-dataset compiler.
+Turns reviewed FeedbackIn records into YOLO labels and SAHI slices, incrementally.
+
+Only feedback that is new (or changed) since the last run is processed; a manifest
+keeps track of what has been compiled. A merged dataset YAML pointing at the base
+sliced dataset plus the compiled feedback slices is written for training.
+"""
+
+import hashlib
+import json
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import yaml
+from PIL import Image
+
+from sahi_preprocess import load_manifest, save_manifest, slice_image_with_labels
+from yolo_labels import write_labels
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+PROJECT_ROOT = BACKEND_ROOT.parent
+
+DEFAULT_FEEDBACK_DIR = BACKEND_ROOT / "data" / "feedback"
+DEFAULT_OUTPUT_DIR = PROJECT_ROOT / "data" / "feedback_dataset"
+DEFAULT_BASE_YAML = PROJECT_ROOT / "data" / "sliced_dataset" / "data.yaml"
+DEFAULT_CLASSES_YAML = PROJECT_ROOT / "data" / "config.yaml"
+
+
+def load_class_names(yaml_path):
+    """Return {name: class_id} from a dataset YAML."""
+    with open(yaml_path, 'r') as f:
+        config = yaml.safe_load(f) or {}
+    names = config.get('names', {})
+    if isinstance(names, list):
+        names = dict(enumerate(names))
+    return {str(name): int(idx) for idx, name in names.items()}
+
+
+def feedback_hash(payload):
+    """Stable content hash of a feedback record."""
+    encoded = json.dumps(payload, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def resolve_image_path(image_path, feedback_dir):
+    """Resolve FeedbackIn.image_path, which may be absolute or relative to the backend."""
+    candidates = [Path(image_path), BACKEND_ROOT / image_path, Path(feedback_dir) / image_path]
+    # Analysis image URLs (/analysis/<id>/image) map onto the stored analysis images
+    parts = Path(image_path).parts
+    if len(parts) >= 3 and parts[-1] == 'image' and parts[-3] == 'analysis':
+        candidates.append(BACKEND_ROOT / "data" / "images" / f"{parts[-2]}.jpg")
+    for candidate in candidates:
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+def class_id_for(name, class_map):
+    """Feedback classes are either numeric ids (as produced by /detect) or class names."""
+    if name.isdigit():
+        return int(name)
+    return class_map.get(name)
+
+
+def feedback_to_yolo_labels(payload, img_width, img_height, class_map):
+    """Convert pixel Box(x, y, w, h) entries into normalized YOLO label tuples."""
+    labels = []
+    skipped = 0
+    for box, cls in zip(payload['boxes'], payload['classes']):
+        class_id = class_id_for(str(cls), class_map)
+        if class_id is None:
+            skipped += 1
+            continue
+        # Clip to the image before normalizing
+        x_min = max(0, min(box['x'], img_width))
+        y_min = max(0, min(box['y'], img_height))
+        x_max = max(0, min(box['x'] + box['w'], img_width))
+        y_max = max(0, min(box['y'] + box['h'], img_height))
+        if x_max <= x_min or y_max <= y_min:
+            skipped += 1
+            continue
+        labels.append((
+            class_id,
+            (x_min + x_max) / 2 / img_width,
+            (y_min + y_max) / 2 / img_height,
+            (x_max - x_min) / img_width,
+            (y_max - y_min) / img_height,
+        ))
+    return labels, skipped
+
+
+def remove_entry_outputs(entry, output_dir):
+    """Delete files previously produced for a manifest entry."""
+    for rel in [entry.get('image'), entry.get('label')]:
+        if rel:
+            (output_dir / rel).unlink(missing_ok=True)
+    for slice_name in entry.get('slices', []):
+        (output_dir / 'sliced' / 'train' / 'images' / slice_name).unlink(missing_ok=True)
+        (output_dir / 'sliced' / 'train' / 'labels' / slice_name.replace('.jpg', '.txt')).unlink(missing_ok=True)
+
+
+def write_merged_yaml(output_dir, base_yaml_path, classes_yaml_path):
+    """Write a dataset YAML combining the base sliced dataset with the compiled feedback slices."""
+    feedback_images = (output_dir / 'sliced' / 'train' / 'images').absolute()
+    train_dirs = []
+    val_dirs = []
+    names = None
+
+    if base_yaml_path and Path(base_yaml_path).exists():
+        with open(base_yaml_path, 'r') as f:
+            base_config = yaml.safe_load(f) or {}
+        base_root = Path(base_config.get('path', Path(base_yaml_path).parent))
+        for key, target in [('train', train_dirs), ('val', val_dirs)]:
+            entries = base_config.get(key) or []
+            if isinstance(entries, str):
+                entries = [entries]
+            target.extend(str((base_root / entry).absolute()) for entry in entries)
+        names = base_config.get('names')
+    else:
+        print(f"Warning: base dataset YAML {base_yaml_path} not found, merged YAML only contains feedback")
+
+    if names is None:
+        names = {idx: name for name, idx in load_class_names(classes_yaml_path).items()}
+
+    merged_config = {
+        'train': train_dirs + [str(feedback_images)],
+        # Validation stays fixed on the base split so metrics remain comparable
+        'val': val_dirs or [str(feedback_images)],
+        'nc': len(names),
+        'names': names,
+    }
+    merged_yaml_path = output_dir / 'data.yaml'
+    with open(merged_yaml_path, 'w') as f:
+        yaml.dump(merged_config, f, default_flow_style=False)
+    return merged_yaml_path
+
+
+def compile_feedback(feedback_dir=DEFAULT_FEEDBACK_DIR, output_dir=DEFAULT_OUTPUT_DIR,
+                     base_yaml=DEFAULT_BASE_YAML, classes_yaml=DEFAULT_CLASSES_YAML,
+                     slice_height=512, slice_width=512, overlap_height_ratio=0.3, overlap_width_ratio=0.3):
+    """
+    Compile new feedback into YOLO labels and slices.
+    Returns a summary dict including the merged dataset YAML path.
+    """
+    feedback_dir = Path(feedback_dir)
+    output_dir = Path(output_dir)
+    images_dir = output_dir / 'images' / 'train'
+    labels_dir = output_dir / 'labels' / 'train'
+    sliced_images_dir = output_dir / 'sliced' / 'train' / 'images'
+    sliced_labels_dir = output_dir / 'sliced' / 'train' / 'labels'
+    for dir_path in [images_dir, labels_dir, sliced_images_dir, sliced_labels_dir]:
+        dir_path.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = output_dir / 'manifest.json'
+    manifest = load_manifest(manifest_path)
+    entries = manifest['entries']
+
+    slice_params = {
+        'slice_height': slice_height,
+        'slice_width': slice_width,
+        'overlap_height_ratio': overlap_height_ratio,
+        'overlap_width_ratio': overlap_width_ratio,
+    }
+    if manifest.get('slice_params') not in (None, slice_params):
+        # Slicing changed, every compiled entry has to be re-sliced
+        print("Slice parameters changed, recompiling all feedback")
+        for entry in entries.values():
+            remove_entry_outputs(entry, output_dir)
+        entries.clear()
+    manifest['slice_params'] = slice_params
+
+    class_map = load_class_names(classes_yaml)
+    summary = {'new': 0, 'updated': 0, 'unchanged': 0, 'missing_image': 0, 'skipped_boxes': 0, 'slices': 0}
+
+    for feedback_file in sorted(feedback_dir.glob('*.json')):
+        with open(feedback_file, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        feedback_id = str(payload.get('id', feedback_file.stem))
+        content_hash = feedback_hash(payload)
+
+        previous = entries.get(feedback_id)
+        if previous and previous['hash'] == content_hash:
+            summary['unchanged'] += 1
+            continue
+
+        image_path = resolve_image_path(payload['image_path'], feedback_dir)
+        if image_path is None:
+            # Not recorded in the manifest, so it is retried on the next run
+            print(f"  Warning: image {payload['image_path']} for feedback {feedback_id} not found")
+            summary['missing_image'] += 1
+            continue
+
+        if previous:
+            remove_entry_outputs(previous, output_dir)
+
+        with Image.open(image_path) as img:
+            img_width, img_height = img.size
+        labels, skipped = feedback_to_yolo_labels(payload, img_width, img_height, class_map)
+        summary['skipped_boxes'] += skipped
+
+        stem = f"feedback_{feedback_id}"
+        image_copy = images_dir / f"{stem}{image_path.suffix.lower()}"
+        label_file = labels_dir / f"{stem}.txt"
+        shutil.copy2(image_path, image_copy)
+        write_labels(label_file, labels)
+
+        print(f"  Compiling feedback {feedback_id}: {len(labels)} labels")
+        slice_names, _ = slice_image_with_labels(
+            image_copy, labels, sliced_images_dir, sliced_labels_dir, **slice_params
+        )
+
+        entries[feedback_id] = {
+            'hash': content_hash,
+            'source': str(feedback_file.name),
+            'image': str(image_copy.relative_to(output_dir)),
+            'label': str(label_file.relative_to(output_dir)),
+            'slices': slice_names,
+            'num_labels': len(labels),
+            'compiled_at': datetime.now().isoformat(),
+        }
+        summary['updated' if previous else 'new'] += 1
+        summary['slices'] += len(slice_names)
+        # Save after every entry so an interrupted run does not redo finished work
+        save_manifest(manifest_path, manifest)
+
+    save_manifest(manifest_path, manifest)
+    merged_yaml = write_merged_yaml(output_dir, base_yaml, classes_yaml)
+    summary['merged_yaml'] = str(merged_yaml)
+    summary['total_entries'] = len(entries)
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compile HITL feedback into a training-ready sliced dataset')
+    parser.add_argument('--feedback_dir', type=str, default=str(DEFAULT_FEEDBACK_DIR), help='Directory with FeedbackIn JSON files')
+    parser.add_argument('--output_dir', type=str, default=str(DEFAULT_OUTPUT_DIR), help='Output directory for the compiled feedback dataset')
+    parser.add_argument('--base_yaml', type=str, default=str(DEFAULT_BASE_YAML), help='Base sliced dataset YAML to merge with')
+    parser.add_argument('--classes_yaml', type=str, default=str(DEFAULT_CLASSES_YAML), help='Dataset YAML with class names')
+    parser.add_argument('--slice_height', type=int, default=512, help='Slice height (default: 512)')
+    parser.add_argument('--slice_width', type=int, default=512, help='Slice width (default: 512)')
+    parser.add_argument('--overlap_height_ratio', type=float, default=0.3, help='Height overlap ratio (default: 0.3)')
+    parser.add_argument('--overlap_width_ratio', type=float, default=0.3, help='Width overlap ratio (default: 0.3)')
+
+    args = parser.parse_args()
+
+    print("Compiling feedback dataset...")
+    summary = compile_feedback(
+        feedback_dir=args.feedback_dir,
+        output_dir=args.output_dir,
+        base_yaml=args.base_yaml,
+        classes_yaml=args.classes_yaml,
+        slice_height=args.slice_height,
+        slice_width=args.slice_width,
+        overlap_height_ratio=args.overlap_height_ratio,
+        overlap_width_ratio=args.overlap_width_ratio,
+    )
+    print(f"New: {summary['new']}, updated: {summary['updated']}, unchanged: {summary['unchanged']}, "
+          f"missing images: {summary['missing_image']}, skipped boxes: {summary['skipped_boxes']}")
+    print(f"Slices written: {summary['slices']}")
+    print(f"Merged dataset config: {summary['merged_yaml']}")
@@ -1,78 +1,246 @@
 import os
+import re
+import json
 import shutil
 import random
+import hashlib
+import argparse
+from datetime import datetime
 from pathlib import Path
+from yolo_labels import read_labels
 
-def create_validation_split():
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+PROJECT_ROOT = BACKEND_ROOT.parent
+DEFAULT_DATA_DIR = PROJECT_ROOT / "data"
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "split_manifest.json"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Suffixes added to a source image name by augment_original_data and sahi_preprocess,
+# stripped repeatedly to find the source an image was derived from
+DERIVED_SUFFIX = re.compile(r"(_original|_aug_\d+_[A-Za-z0-9]+|_slice_\d+_\d+)$")
+
+
+def source_key(stem, pattern=DERIVED_SUFFIX):
+    """Name of the source image a sample was generated from, e.g. 'plan_aug_03_rot90' -> 'plan'."""
+    while True:
+        stripped = pattern.sub("", stem)
+        if stripped == stem or not stripped:
+            return stem
+        stem = stripped
+
+
+def stratum(count):
+    """Label count bucket: 0, 1, 2-3, 4-7, 8-15, ..."""
+    return int(count).bit_length()
+
+
+def scan_sources(images_dir, labels_dir):
+    """(image, label file, size/mtime state) of every image, plus a fingerprint of all of them."""
+    digest = hashlib.sha256()
+    samples = []
+    with os.scandir(images_dir) as entries:
+        for entry in sorted(entries, key=lambda e: e.name):
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            label_file = Path(labels_dir) / (Path(entry.name).stem + ".txt")
+            label_stat = label_file.stat() if label_file.exists() else None
+            state = [stat.st_size, stat.st_mtime_ns] + ([label_stat.st_size, label_stat.st_mtime_ns] if label_stat else [])
+            digest.update(f"{entry.name}:{state}\n".encode())
+            samples.append((Path(entry.path), label_file, state))
+    return samples, digest.hexdigest()
+
+
+def assign_splits(samples, val_ratio=0.2, min_val=6, seed=42, pattern=DERIVED_SUFFIX):
     """
-    Create a proper train/validation split from the augmented dataset
+    Split samples into train/val by source group, so every sample generated from one
+    source image lands in the same split. Groups are stratified by their mean label
+    count, and each stratum gives about val_ratio of its samples to val.
+    Returns {image name: 'train' | 'val'}.
     """
-    # Paths
-    base_dir = Path("C:/Users/Rynn/Desktop/Axium Industries/Projects/VLM-YOLO-Construction")
-    
-    # Source directories (augmented data)
-    train_aug_images = base_dir / "data/images/train_augmented"
-    train_aug_labels = base_dir / "data/labels/train_augmented"
-    
-    # Destination directories
-    train_images = base_dir / "data/images/train"
-    train_labels = base_dir / "data/labels/train"
-    val_images = base_dir / "data/images/val"
-    val_labels = base_dir / "data/labels/val"
-    
-    # Clear existing train/val directories
-    for dir_path in [train_images, train_labels, val_images, val_labels]:
-        if dir_path.exists():
-            shutil.rmtree(dir_path)
-        dir_path.mkdir(parents=True, exist_ok=True)
-    
-    # Get all augmented image files
-    image_files = list(train_aug_images.glob("*.jpg"))
-    print(f"Found {len(image_files)} augmented images")
-    
-    # Shuffle for random split
-    random.seed(42)  # For reproducible results
-    random.shuffle(image_files)
-    
-    # Split: 80% train, 20% validation (at least 6 images for validation)
-    val_count = max(6, int(len(image_files) * 0.2))
-    train_count = len(image_files) - val_count
-    
-    print(f"Splitting into {train_count} training and {val_count} validation images")
-    
-    # Copy training files
-    for i, img_file in enumerate(image_files[:train_count]):
-        # Copy image
-        shutil.copy2(img_file, train_images / img_file.name)
-        
-        # Copy corresponding label
-        label_file = train_aug_labels / (img_file.stem + ".txt")
-        if label_file.exists():
-            shutil.copy2(label_file, train_labels / label_file.name)
-        else:
-            print(f"Warning: No label found for {img_file.name}")
-    
-    # Copy validation files
-    for i, img_file in enumerate(image_files[train_count:]):
-        # Copy image
-        shutil.copy2(img_file, val_images / img_file.name)
-        
-        # Copy corresponding label
-        label_file = train_aug_labels / (img_file.stem + ".txt")
+    groups = {}
+    for image_file, label_file, _ in samples:
+        groups.setdefault(source_key(image_file.stem, pattern), []).append((image_file, label_file))
+
+    strata = {}
+    for key, members in sorted(groups.items()):
+        mean_labels = sum(len(read_labels(label_file)) for _, label_file in members) / len(members)
+        strata.setdefault(stratum(round(mean_labels)), []).append(key)
+
+    rng = random.Random(seed)
+    val_groups = set()
+    for bucket in sorted(strata):
+        keys = strata[bucket]
+        rng.shuffle(keys)
+        target = val_ratio * sum(len(groups[key]) for key in keys)
+        taken = 0
+        for key in keys:
+            if taken >= target:
+                break
+            if taken + len(groups[key]) / 2 > target:
+                # Closer to the target without this group; a smaller one may still fit
+                continue
+            val_groups.add(key)
+            taken += len(groups[key])
+
+    # Top up to min_val samples, but never empty the train split
+    train_groups = [key for key in sorted(groups) if key not in val_groups]
+    rng.shuffle(train_groups)
+    val_samples = sum(len(groups[key]) for key in val_groups)
+    while val_samples < min_val and len(train_groups) > 1:
+        key = train_groups.pop()
+        val_groups.add(key)
+        val_samples += len(groups[key])
+
+    return {image_file.name: ('val' if key in val_groups else 'train')
+            for key, members in groups.items() for image_file, _ in members}
+
+
+def place(src, dst, link):
+    """Hardlink, symlink or copy src to dst; returns the mode actually used."""
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    if link == "hard":
+        try:
+            os.link(src, dst)
+            return "hard"
+        except OSError:
+            # Different filesystem or no hardlink support
+            link = "sym"
+    if link == "sym":
+        try:
+            dst.symlink_to(Path(src).resolve())
+            return "sym"
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def load_manifest(manifest_path):
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"version": MANIFEST_VERSION, "params": None, "fingerprint": None, "files": {}}
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    tmp_path.replace(manifest_path)
+
+
+def create_validation_split(data_dir=DEFAULT_DATA_DIR, source="train_augmented", val_ratio=0.2, min_val=6,
+                            seed=42, link="hard", force=False):
+    """
+    Create a leakage-free train/validation split of data/{images,labels}/<source> in
+    data/{images,labels}/{train,val}, made of links instead of copies and recorded in
+    data/split_manifest.json. A re-run with the same parameters on unchanged sources
+    does nothing.
+    """
+    data_dir = Path(data_dir)
+    source_images = data_dir / "images" / source
+    source_labels = data_dir / "labels" / source
+    split_dirs = {
+        split: (data_dir / "images" / split, data_dir / "labels" / split)
+        for split in ("train", "val")
+    }
+    if not source_images.exists():
+        raise FileNotFoundError(f"Source images not found at {source_images}")
+
+    manifest_path = data_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    params = {"source": source, "val_ratio": val_ratio, "min_val": min_val, "seed": seed, "link": link}
+
+    samples, fingerprint = scan_sources(source_images, source_labels)
+    print(f"Found {len(samples)} images in {source_images}")
+
+    if not force and manifest.get("params") == params and manifest.get("fingerprint") == fingerprint:
+        existing = {split: set(os.listdir(images_dir)) if images_dir.exists() else set()
+                    for split, (images_dir, _) in split_dirs.items()}
+        if all(name in existing[entry["split"]] for name, entry in manifest["files"].items()):
+            counts = {split: sum(1 for entry in manifest["files"].values() if entry["split"] == split)
+                      for split in split_dirs}
+            print(f"Split is up to date: {counts['train']} training and {counts['val']} validation images")
+            return counts
+
+    assignments = assign_splits(samples, val_ratio=val_ratio, min_val=min_val, seed=seed)
+
+    for images_dir, labels_dir in split_dirs.values():
+        images_dir.mkdir(parents=True, exist_ok=True)
+        labels_dir.mkdir(parents=True, exist_ok=True)
+
+    # Remove everything in the split folders that is not where the new split wants it
+    # (moved samples, removed sources and files not placed by this tool)
+    removed = 0
+    for split, (images_dir, labels_dir) in split_dirs.items():
+        wanted = {name for name, assigned in assignments.items() if assigned == split}
+        wanted_labels = {Path(name).stem + ".txt" for name in wanted}
+        for directory, keep in ((images_dir, wanted), (labels_dir, wanted_labels)):
+            for path in directory.iterdir():
+                if path.name not in keep and not path.is_dir():
+                    path.unlink()
+                    removed += 1
+
+    files = {}
+    placed = 0
+    for image_file, label_file, state in samples:
+        split = assignments[image_file.name]
+        images_dir, labels_dir = split_dirs[split]
+        previous = manifest["files"].get(image_file.name)
+        current = (previous and previous["split"] == split and previous["state"] == state
+                   and previous["requested"] == link and (images_dir / image_file.name).exists()
+                   and (labels_dir / label_file.name).exists() == label_file.exists())
+        if current and not force:
+            files[image_file.name] = previous
+            continue
+        mode = place(image_file, images_dir / image_file.name, link)
         if label_file.exists():
-            shutil.copy2(label_file, val_labels / label_file.name)
+            place(label_file, labels_dir / label_file.name, link)
         else:
-            print(f"Warning: No label found for {img_file.name}")
-    
-    print(f"Successfully created train/val split:")
-    print(f"  Training: {len(list(train_images.glob('*.jpg')))} images")
-    print(f"  Validation: {len(list(val_images.glob('*.jpg')))} images")
-    
-    # Verify labels exist
-    train_label_count = len(list(train_labels.glob("*.txt")))
-    val_label_count = len(list(val_labels.glob("*.txt")))
-    print(f"  Training labels: {train_label_count}")
-    print(f"  Validation labels: {val_label_count}")
+            print(f"Warning: No label found for {image_file.name}")
+        files[image_file.name] = {"split": split, "source": source_key(image_file.stem),
+                                  "state": state, "requested": link, "link": mode}
+        placed += 1
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "params": params,
+        "fingerprint": fingerprint,
+        "created_at": datetime.now().isoformat(),
+        "files": files,
+    }
+    save_manifest(manifest_path, manifest)
+
+    counts = {split: sum(1 for entry in files.values() if entry["split"] == split) for split in split_dirs}
+    groups = {split: len(set(entry["source"] for entry in files.values() if entry["split"] == split))
+              for split in split_dirs}
+    print(f"Successfully created train/val split ({placed} linked, {removed} removed):")
+    print(f"  Training: {counts['train']} images from {groups['train']} source images")
+    print(f"  Validation: {counts['val']} images from {groups['val']} source images")
+    return counts
+
 
 if __name__ == "__main__":
-    create_validation_split()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create a leakage-free train/val split grouped by source image")
+    parser.add_argument("--data-dir", type=str, default=str(DEFAULT_DATA_DIR), help="Dataset root with images/ and labels/")
+    parser.add_argument("--source", type=str, default="train_augmented", help="Subfolder of images/ and labels/ to split")
+    parser.add_argument("--val-ratio", type=float, default=0.2, help="Fraction of samples for validation")
+    parser.add_argument("--min-val", type=int, default=6, help="Minimum validation samples")
+    parser.add_argument("--seed", type=int, default=42, help="Seed for the group shuffle")
+    parser.add_argument("--link", choices=["hard", "sym", "copy"], default="hard", help="How split files point at the sources")
+    parser.add_argument("--force", action="store_true", help="Rebuild every link even if the manifest is current")
+    args = parser.parse_args()
+
+    create_validation_split(
+        data_dir=args.data_dir,
+        source=args.source,
+        val_ratio=args.val_ratio,
+        min_val=args.min_val,
+        seed=args.seed,
+        link=args.link,
+        force=args.force,
+    )
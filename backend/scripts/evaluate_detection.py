@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Offline detection evaluation.
+
+Runs YoloService's tiled detection over a labeled split for every combination of weights
+and detection parameters, and reports accuracy, latency percentiles and peak memory.
+Precision and recall are measured on the served response (min_score_* and max_det_*
+applied); mAP50 and mAP50-95 rank every merged detection the model scores, without those
+cutoffs, so they describe the detector rather than the thresholds. Configurations
+not beaten on both latency and the chosen accuracy metric form the Pareto front;
+their parameters are written out as JSON for settings.detection_params_file.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from yolo_labels import IMAGE_EXTENSIONS, read_labels, to_absolute
+
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+PROJECT_ROOT = BACKEND_ROOT.parent
+DEFAULT_IMAGES = PROJECT_ROOT / "data" / "images" / "val"
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def rss_mb():
+    """Resident memory in MB, None if unknown (see app.core.metrics.rss_bytes)."""
+    from app.core.metrics import rss_bytes
+    rss = rss_bytes()
+    return rss / 1024 ** 2 if rss is not None else None
+
+
+class PeakMemory:
+    """Samples resident memory in a background thread while active (peak_mb stays None if unknown)."""
+
+    def __init__(self, interval_s=0.01):
+        self.interval_s = interval_s
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _update(self):
+        current = rss_mb()
+        if current is not None:
+            self.peak_mb = current if self.peak_mb is None else max(self.peak_mb, current)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self._update()
+            self._stop.wait(self.interval_s)
+
+    def __enter__(self):
+        self.peak_mb = None
+        self._update()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._update()
+
+
+def box_iou(a, b):
+    """IoU matrix between N x 4 and M x 4 xyxy boxes."""
+    iw = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    ih = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match_image(pred_boxes, pred_scores, pred_classes, gt_boxes, gt_classes):
+    """
+    Greedy score-ordered matching per class at every IoU threshold.
+    Returns a (predictions, thresholds) true-positive matrix in the given prediction order.
+    """
+    tp = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(pred_boxes) == 0 or len(gt_boxes) == 0:
+        return tp
+    iou = box_iou(pred_boxes, gt_boxes)
+    iou[pred_classes[:, None] != gt_classes[None, :]] = 0
+    order = np.argsort(-pred_scores, kind="stable")
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        taken = np.zeros(len(gt_boxes), dtype=bool)
+        for i in order:
+            candidates = np.where(taken, 0, iou[i])
+            j = int(np.argmax(candidates))
+            if candidates[j] >= threshold:
+                taken[j] = True
+                tp[i, t] = True
+    return tp
+
+
+def average_precision(tp, scores, n_gt):
+    """Area under the interpolated precision/recall curve (101 recall points, COCO style)."""
+    if n_gt == 0 or len(tp) == 0:
+        return 0.0
+    order = np.argsort(-scores, kind="stable")
+    hits = np.cumsum(tp[order])
+    recall = hits / n_gt
+    precision = hits / np.arange(1, len(tp) + 1)
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    points = np.linspace(0, 1, 101)
+    index = np.searchsorted(recall, points, side="left")
+    return float(np.mean(np.where(index < len(precision), precision[np.minimum(index, len(precision) - 1)], 0.0)))
+
+
+def _concatenate(records):
+    tp = np.concatenate([r[0] for r in records]) if records else np.zeros((0, len(IOU_THRESHOLDS)), dtype=bool)
+    scores = np.concatenate([r[1] for r in records]) if records else np.zeros(0)
+    classes = np.concatenate([r[2] for r in records]) if records else np.zeros(0)
+    gt_classes = np.concatenate([r[3] for r in records]) if records else np.zeros(0)
+    return tp, scores, classes, gt_classes
+
+
+def detection_metrics(served, ranked):
+    """
+    Metrics from per-image (tp, scores, classes, gt classes) records: precision and recall
+    of the ``served`` responses, mAP50 and mAP50-95 over the uncut ``ranked`` detections.
+    """
+    tp, _, _, gt_classes = _concatenate(served)
+    n_gt = len(gt_classes)
+    true_positives = int(tp[:, 0].sum())
+    served_predictions = len(tp)
+
+    tp, scores, classes, gt_classes = _concatenate(ranked)
+    ap = []
+    for cls in np.unique(np.concatenate([classes, gt_classes])):
+        mask = classes == cls
+        class_gt = int((gt_classes == cls).sum())
+        if class_gt == 0:
+            continue
+        ap.append([average_precision(tp[mask, t], scores[mask], class_gt) for t in range(len(IOU_THRESHOLDS))])
+    ap = np.array(ap) if ap else np.zeros((0, len(IOU_THRESHOLDS)))
+    return {
+        "precision": true_positives / served_predictions if served_predictions else 0.0,
+        "recall": true_positives / n_gt if n_gt else 0.0,
+        "mAP50": float(ap[:, 0].mean()) if len(ap) else 0.0,
+        "mAP50_95": float(ap.mean()) if len(ap) else 0.0,
+        "predictions": int(served_predictions),
+        "ranked_predictions": int(len(tp)),
+        "ground_truth": int(n_gt),
+    }
+
+
+def load_split(images_dir, labels_dir=None, limit=None):
+    images_dir = Path(images_dir)
+    # YOLO layout: .../images/<split> next to .../labels/<split>
+    labels_dir = Path(labels_dir) if labels_dir else Path(str(images_dir).replace("images", "labels"))
+    images = sorted(p for p in images_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    if limit:
+        images = images[:limit]
+    return [(path, labels_dir / f"{path.stem}.txt") for path in images]
+
+
+def parse_grid(items):
+    """['slice_size=512,640', 'overlap=0.2,0.3'] -> list of override dicts (cartesian product)."""
+    axes = []
+    for item in items or []:
+        key, _, values = item.partition("=")
+        parsed = []
+        for value in values.split(","):
+            try:
+                parsed.append(json.loads(value))
+            except json.JSONDecodeError:
+                parsed.append(value)
+        axes.append([(key, value) for value in parsed])
+    return [dict(combo) for combo in itertools.product(*axes)] if axes else [{}]
+
+
+def config_name(overrides):
+    return ",".join(f"{key}={value}" for key, value in sorted(overrides.items())) or "default"
+
+
+def image_record(response, labels, width, height):
+    """(tp, scores, classes, gt classes) of one detection response against the image's labels."""
+    gt_boxes = to_absolute(labels, width, height)
+    pred_boxes = np.array([[b.x, b.y, b.x + b.w, b.y + b.h] for b in response.boxes], dtype=np.float64).reshape(-1, 4)
+    pred_scores = np.array(response.scores, dtype=np.float64)
+    pred_classes = np.array([int(c) for c in response.classes], dtype=np.int64)
+    gt_classes = labels[:, 0].astype(np.int64)
+    tp = match_image(pred_boxes, pred_scores, pred_classes, gt_boxes, gt_classes)
+    return tp, pred_scores, pred_classes, gt_classes
+
+
+def evaluate(service, params, samples, warmup=1):
+    """Run one configuration over the split; returns metrics, latency and memory."""
+    from app.services.tiling import merge_detections, plan_regions
+
+    for path, _ in samples[:warmup]:
+        with Image.open(path) as image:
+            service.detect(image.convert("RGB"), params)
+
+    # Same merging and area filter, but nothing cut by min_score_* or max_det_*
+    uncut = params.uncapped()
+    served, ranked, latencies = [], [], []
+    with PeakMemory() as memory:
+        for path, label_file in samples:
+            with Image.open(path) as image:
+                img = image.convert("RGB")
+            # What service.detect does, keeping the raw detections for the uncut ranking
+            started = time.perf_counter()
+            raw = service.predict_regions(img, plan_regions(img.size, params), params=params)
+            response = merge_detections(raw, img.size, params)
+            latencies.append(time.perf_counter() - started)
+
+            width, height = img.size
+            labels = read_labels(label_file)
+            served.append(image_record(response, labels, width, height))
+            ranked.append(image_record(merge_detections(raw, img.size, uncut, min_score=0.0), labels, width, height))
+
+    latencies_ms = np.array(latencies) * 1000
+    result = detection_metrics(served, ranked)
+    result.update({
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies_ms, 50)), 2),
+            "p90": round(float(np.percentile(latencies_ms, 90)), 2),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 2),
+            "mean": round(float(latencies_ms.mean()), 2),
+        } if len(latencies_ms) else {},
+        "peak_rss_mb": round(memory.peak_mb, 1) if memory.peak_mb is not None else None,
+        "images": len(samples),
+    })
+    return result
+
+
+def pareto_front(rows, metric):
+    """Mark rows no other row beats on both p50 latency (lower) and metric (higher)."""
+    for row in rows:
+        latency, score = row["latency_ms"]["p50"], row[metric]
+        row["pareto"] = not any(
+            other is not row
+            and other["latency_ms"]["p50"] <= latency and other[metric] >= score
+            and (other["latency_ms"]["p50"] < latency or other[metric] > score)
+            for other in rows
+        )
+    return rows
+
+
+def write_report(rows, output_dir, metric):
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "report.json", "w") as f:
+        json.dump(rows, f, indent=2)
+
+    header = f"| pareto | weights | config | {metric} | precision | recall | mAP50 | mAP50-95 | p50 ms | p90 ms | p99 ms | peak MB |"
+    lines = [header, "|" + "|".join("---" for _ in range(12)) + "|"]
+    for row in sorted(rows, key=lambda r: r["latency_ms"]["p50"]):
+        lines.append(
+            f"| {'*' if row['pareto'] else ''} | {row['weights_name']} | {row['config']} | {row[metric]:.4f} "
+            f"| {row['precision']:.4f} | {row['recall']:.4f} | {row['mAP50']:.4f} | {row['mAP50_95']:.4f} "
+            f"| {row['latency_ms']['p50']} | {row['latency_ms']['p90']} | {row['latency_ms']['p99']} | {row['peak_rss_mb']} |"
+        )
+    table = "\n".join(lines)
+    with open(output_dir / "report.md", "w") as f:
+        f.write(table + "\n")
+
+    params_dir = output_dir / "pareto_params"
+    params_dir.mkdir(exist_ok=True)
+    for index, row in enumerate(r for r in rows if r["pareto"]):
+        with open(params_dir / f"{index:02d}_{row['weights_name']}.json", "w") as f:
+            json.dump(row["params"], f, indent=2)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate detection accuracy and speed across configurations")
+    parser.add_argument("--images", type=str, default=str(DEFAULT_IMAGES), help="Directory of validation images")
+    parser.add_argument("--labels", type=str, default=None, help="Label directory (default: images path with images -> labels)")
+    parser.add_argument("--weights", nargs="+", default=None, help="Weights to compare (default: the deployed weights)")
+    parser.add_argument("--grid", nargs="*", default=None, metavar="PARAM=V1,V2",
+                        help="DetectionParams values to sweep, e.g. slice_size=512,640 overlap=0.2,0.3")
+    parser.add_argument("--configs", type=str, default=None, help="JSON file with a list of DetectionParams overrides (added to --grid)")
+    parser.add_argument("--metric", choices=["mAP50", "mAP50_95", "recall", "precision"], default="mAP50",
+                        help="Accuracy metric for the Pareto front")
+    parser.add_argument("--limit", type=int, default=None, help="Evaluate only the first N images")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed images per configuration")
+    parser.add_argument("--output", type=str, default=None, help="Report directory (default: data/eval/<timestamp>)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BACKEND_ROOT))
+    from app.core.config import settings
+    from app.services.yolo_service import YoloService
+
+    samples = load_split(args.images, args.labels, args.limit)
+    if not samples:
+        raise SystemExit(f"No images found in {args.images}")
+
+    overrides = parse_grid(args.grid)
+    if args.configs:
+        with open(args.configs, "r") as f:
+            overrides += json.load(f)
+    weights_list = args.weights or [settings.yolo_weights]
+    output_dir = Path(args.output) if args.output else BACKEND_ROOT / "data" / "eval" / datetime.now().strftime("%Y%m%d_%H%M%S")
+    print(f"Evaluating {len(weights_list)} weights x {len(overrides)} configurations on {len(samples)} images")
+
+    rows = []
+    for weights in weights_list:
+        service = YoloService(weights=weights)
+        if service.model is None:
+            raise SystemExit(f"Could not load weights {weights}")
+        for override in overrides:
+            params = service.params.model_copy(update=override)
+            result = evaluate(service, params, samples, warmup=args.warmup)
+            result.update({
+                "weights": str(weights),
+                "weights_name": Path(weights).parent.parent.name or Path(weights).stem,
+                "config": config_name(override),
+                "params": params.model_dump(),
+            })
+            rows.append(result)
+            print(f"  {result['weights_name']} [{result['config']}]: {args.metric}={result[args.metric]:.4f} "
+                  f"p50={result['latency_ms']['p50']}ms peak={result['peak_rss_mb']}MB")
+
+    pareto_front(rows, args.metric)
+    print()
+    print(write_report(rows, output_dir, args.metric))
+    print(f"\nReport written to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
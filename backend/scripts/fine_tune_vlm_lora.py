@@ -1,53 +1,341 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, Trainer
-from peft import get_peft_model, LoraConfig, TaskType
+#!/usr/bin/env python3
+"""
+LoRA fine-tuning of Qwen2-VL on the feedback triplets written by the API.
+
+Triplets ({"image", "instruction", "output"}) are streamed from the JSONL file the
+TrainingService appends to, images go through the Qwen2-VL processor (preprocessed
+tensors are cached across epochs), and samples of similar length are batched together
+so padding stays small. Prompts use the same chat format as VLMService at inference.
+"""
+
+import argparse
+import inspect
 import json
+import math
+import random
+import time
+from collections import OrderedDict
 from pathlib import Path
 
-# Load triplet dataset (image, instruction, output)
-def load_triplet_dataset(path):
-    with open(path, 'r') as f:
-        return json.load(f)
+import torch
+from PIL import Image
+from torch.utils.data import IterableDataset
+from transformers import AutoProcessor, Qwen2VLForConditionalGeneration, Trainer, TrainerCallback, TrainingArguments
+from peft import get_peft_model, LoraConfig, TaskType
 
-if __name__ == "__main__":
-    dataset = load_triplet_dataset("data/vlm_triplets.json")
-    model = AutoModelForCausalLM.from_pretrained("Qwen/Qwen2-VL-7B-Instruct", device_map="auto")
-    tokenizer = AutoTokenizer.from_pretrained("Qwen/Qwen2-VL-7B-Instruct")
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+
+DEFAULT_DATA = BACKEND_ROOT / "data" / "finetune" / "train.jsonl"
+DEFAULT_MODEL = "Qwen/Qwen2-VL-7B-Instruct"
+DEFAULT_OUTPUT = "models/vlm_adapters/latest"
+
+# Must match app.services.vlm_service so the adapter sees the prompts it is served with
+SYSTEM_MESSAGE = ("You are a floorplan assistant specialized in detecting electrical symbols "
+                  "and returning coordinates and counts as JSON where requested.")
+IMAGE_PAD = "<|image_pad|>"
+IGNORE_INDEX = -100
+
+
+def count_triplets(path):
+    """Number of non-empty lines, without parsing them."""
+    with open(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def resolve_image(path, image_root):
+    """Feedback stores image paths as the client sent them; try them as given, then under the roots."""
+    candidate = Path(path)
+    if candidate.is_file():
+        return candidate
+    for root in (image_root, BACKEND_ROOT, BACKEND_ROOT.parent):
+        if root is not None and (Path(root) / path).is_file():
+            return Path(root) / path
+    return None
+
+
+class ImageTensorCache:
+    """LRU cache of processor outputs (pixel_values, image_grid_thw) bounded in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, pixel_values, grid_thw):
+        size = pixel_values.numel() * pixel_values.element_size()
+        if size > self.max_bytes:
+            return
+        self._data[key] = (pixel_values, grid_thw)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, (old, _) = self._data.popitem(last=False)
+            self.current_bytes -= old.numel() * old.element_size()
+
+
+class TripletStream(IterableDataset):
+    """Streams tokenized multimodal samples from a triplet JSONL file.
+
+    Lines are read lazily and shuffled within ``shuffle_buffer``. Samples are then taken in
+    windows of ``bucket_batches * batch_size``, sorted by length within the window and emitted
+    in runs of ``batch_size``, so each batch the DataLoader forms holds samples of similar
+    length. The order of the runs is shuffled.
+    """
+
+    def __init__(self, path, processor, batch_size, bucket_batches=16, shuffle_buffer=1024,
+                 image_root=None, max_length=2048, cache_mb=2048, seed=42):
+        self.path = Path(path)
+        self.processor = processor
+        self.tokenizer = processor.tokenizer
+        self.batch_size = batch_size
+        self.bucket_batches = bucket_batches
+        self.shuffle_buffer = shuffle_buffer
+        self.image_root = image_root
+        self.max_length = max_length
+        self.cache = ImageTensorCache(cache_mb * 1024 ** 2)
+        self.merge = processor.image_processor.merge_size ** 2
+        self.seed = seed
+        self.epoch = 0
+        self.skipped = 0
+        self._length = count_triplets(self.path)
+
+    def __len__(self):
+        return self._length
+
+    def _lines(self, rng):
+        buffer = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                buffer.append(line)
+                if len(buffer) >= self.shuffle_buffer:
+                    yield buffer.pop(rng.randrange(len(buffer)))
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _image_tensors(self, image_path):
+        stat = image_path.stat()
+        key = (str(image_path), stat.st_mtime_ns, stat.st_size)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        with Image.open(image_path) as img:
+            out = self.processor.image_processor(images=[img.convert("RGB")], return_tensors="pt")
+        self.cache.put(key, out["pixel_values"], out["image_grid_thw"])
+        return out["pixel_values"], out["image_grid_thw"]
+
+    def _encode(self, line):
+        try:
+            triplet = json.loads(line)
+            image_path = resolve_image(triplet["image"], self.image_root)
+            if image_path is None:
+                raise FileNotFoundError(triplet["image"])
+            pixel_values, grid_thw = self._image_tensors(image_path)
+        except (ValueError, KeyError, OSError) as e:
+            self.skipped += 1
+            print(f"Skipping triplet: {e}")
+            return None
+        messages = [
+            {"role": "system", "content": [{"type": "text", "text": SYSTEM_MESSAGE}]},
+            {"role": "user", "content": [{"type": "image"}, {"type": "text", "text": triplet["instruction"]}]},
+        ]
+        prompt = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        prompt = prompt.replace(IMAGE_PAD, IMAGE_PAD * int(grid_thw[0].prod() // self.merge), 1)
+        prompt_ids = self.tokenizer(prompt, add_special_tokens=False)["input_ids"]
+        answer_ids = self.tokenizer(f"{triplet['output']}<|im_end|>\n", add_special_tokens=False)["input_ids"]
+        input_ids = (prompt_ids + answer_ids)[:self.max_length]
+        # Only the answer is learned; the prompt (and image) tokens are context
+        labels = ([IGNORE_INDEX] * len(prompt_ids) + answer_ids)[:self.max_length]
+        if all(label == IGNORE_INDEX for label in labels):
+            self.skipped += 1
+            print(f"Skipping triplet longer than {self.max_length} tokens: {triplet['image']}")
+            return None
+        return {
+            "input_ids": torch.tensor(input_ids, dtype=torch.long),
+            "labels": torch.tensor(labels, dtype=torch.long),
+            "pixel_values": pixel_values,
+            "image_grid_thw": grid_thw,
+        }
+
+    def _buckets(self, window, rng):
+        window.sort(key=lambda s: len(s["input_ids"]))
+        runs = [window[i:i + self.batch_size] for i in range(0, len(window), self.batch_size)]
+        # Only a short final run may break the batch alignment, so keep it last
+        tail = runs.pop() if runs and len(runs[-1]) < self.batch_size else None
+        rng.shuffle(runs)
+        for run in runs + ([tail] if tail else []):
+            yield from run
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+        window_size = self.batch_size * self.bucket_batches
+        window = []
+        for line in self._lines(rng):
+            sample = self._encode(line)
+            if sample is None:
+                continue
+            window.append(sample)
+            if len(window) == window_size:
+                yield from self._buckets(window, rng)
+                window = []
+        yield from self._buckets(window, rng)
+
+
+class PaddedCollator:
+    """Right-pads token sequences and concatenates image patches along the patch axis."""
+
+    def __init__(self, pad_token_id, image_token_id=None, with_mm_token_types=False):
+        self.pad_token_id = pad_token_id
+        self.image_token_id = image_token_id
+        self.with_mm_token_types = with_mm_token_types
+
+    def __call__(self, samples):
+        length = max(len(s["input_ids"]) for s in samples)
+        input_ids = torch.full((len(samples), length), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(samples), length), IGNORE_INDEX, dtype=torch.long)
+        attention_mask = torch.zeros((len(samples), length), dtype=torch.long)
+        for i, s in enumerate(samples):
+            n = len(s["input_ids"])
+            input_ids[i, :n] = s["input_ids"]
+            labels[i, :n] = s["labels"]
+            attention_mask[i, :n] = 1
+        batch = {
+            "input_ids": input_ids,
+            "labels": labels,
+            "attention_mask": attention_mask,
+            "pixel_values": torch.cat([s["pixel_values"] for s in samples]),
+            "image_grid_thw": torch.cat([s["image_grid_thw"] for s in samples]),
+        }
+        if self.with_mm_token_types:
+            # Newer transformers locate image tokens for M-RoPE through these
+            batch["mm_token_type_ids"] = (input_ids == self.image_token_id).int()
+        return batch
+
+
+class ThroughputCallback(TrainerCallback):
+    """Prints samples/s and tokens/s over each logging interval, in the Trainer's log format."""
+
+    def __init__(self, batch_size, grad_accum):
+        self.samples_per_step = batch_size * grad_accum
+        self.started = None
+        self.step = 0
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.started = time.perf_counter()
+        self.step = state.global_step
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        if self.started is None or state.global_step == self.step:
+            return
+        elapsed = time.perf_counter() - self.started
+        samples_per_s = (state.global_step - self.step) * self.samples_per_step / elapsed
+        print({"samples_per_second": round(samples_per_s, 3), "epoch": round(state.epoch or 0.0, 2)})
+        self.started = time.perf_counter()
+        self.step = state.global_step
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoRA fine-tuning of Qwen2-VL on feedback triplets")
+    parser.add_argument("--data", default=str(DEFAULT_DATA), help="Triplet JSONL written by the API")
+    parser.add_argument("--image-root", default=None, help="Directory relative image paths are resolved against")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--epochs", type=float, default=3)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--grad-accum", type=int, default=1)
+    parser.add_argument("--lr", type=float, default=5e-5)
+    parser.add_argument("--max-length", type=int, default=2048, help="Token limit per sample, image included")
+    parser.add_argument("--max-pixels", type=int, default=1024 * 28 * 28, help="Image resize budget (fewer image tokens)")
+    parser.add_argument("--bucket-batches", type=int, default=16, help="Batches per length-sorting window")
+    parser.add_argument("--shuffle-buffer", type=int, default=1024)
+    parser.add_argument("--image-cache-mb", type=int, default=2048)
+    parser.add_argument("--no-gradient-checkpointing", action="store_true")
+    parser.add_argument("--logging-steps", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not Path(args.data).is_file():
+        raise SystemExit(f"No training data at {args.data}; submit feedback first")
+
+    processor = AutoProcessor.from_pretrained(args.model, max_pixels=args.max_pixels)
+    dataset = TripletStream(args.data, processor, args.batch_size, bucket_batches=args.bucket_batches,
+                            shuffle_buffer=args.shuffle_buffer, image_root=args.image_root,
+                            max_length=args.max_length, cache_mb=args.image_cache_mb, seed=args.seed)
+    print(f"Training on {len(dataset)} triplets from {args.data}")
+
+    use_cuda = torch.cuda.is_available()
+    dtype = torch.bfloat16 if use_cuda else torch.float32
+    model = Qwen2VLForConditionalGeneration.from_pretrained(args.model, device_map="auto" if use_cuda else None,
+                                                            torch_dtype=dtype)
+    gradient_checkpointing = not args.no_gradient_checkpointing
+    if gradient_checkpointing:
+        # Checkpointed blocks need inputs that require grad while the base weights are frozen
+        model.enable_input_require_grads()
+        model.config.use_cache = False
 
     lora_config = LoraConfig(
         r=16, lora_alpha=32, target_modules=["q_proj", "v_proj"],
         lora_dropout=0.05, bias="none", task_type=TaskType.CAUSAL_LM
     )
-
     model = get_peft_model(model, lora_config)
+    model.print_trainable_parameters()
 
-    training_args = TrainingArguments(
-        output_dir="models/vlm_adapters/latest",
-        per_device_train_batch_size=1,
-        learning_rate=5e-5,
-        num_train_epochs=3,
-        save_strategy="epoch"
+    forward_params = inspect.signature(model.get_base_model().forward).parameters
+    collator = PaddedCollator(
+        pad_token_id=processor.tokenizer.pad_token_id or 0,
+        image_token_id=processor.tokenizer.convert_tokens_to_ids(IMAGE_PAD),
+        with_mm_token_types="mm_token_type_ids" in forward_params,
     )
 
-    # Build dummy dataset class
-    class SimpleDataset:
-        def __init__(self, data):
-            self.data = data
-        def __len__(self):
-            return len(self.data)
-        def __getitem__(self, idx):
-            item = self.data[idx]
-            input_text = f"Instruction: {item['instruction']}\nAnswer:"
-            inputs = tokenizer(input_text, return_tensors="pt")
-            labels = tokenizer(item["output"], return_tensors="pt")["input_ids"]
-            inputs["labels"] = labels
-            return inputs
+    training_args = TrainingArguments(
+        output_dir=args.output,
+        per_device_train_batch_size=args.batch_size,
+        gradient_accumulation_steps=args.grad_accum,
+        learning_rate=args.lr,
+        num_train_epochs=args.epochs,
+        save_strategy="epoch",
+        logging_steps=args.logging_steps,
+        gradient_checkpointing=gradient_checkpointing,
+        bf16=use_cuda,
+        # The stream yields tokenized samples; keep every field for the collator
+        remove_unused_columns=False,
+        dataloader_num_workers=0,
+        # Dispatching slices every tensor to the batch size, which would cut pixel_values (patches x dim)
+        accelerator_config={"dispatch_batches": False},
+        report_to=[],
+        seed=args.seed,
+    )
 
     trainer = Trainer(
         model=model,
         args=training_args,
-        train_dataset=SimpleDataset(dataset)
+        train_dataset=dataset,
+        data_collator=collator,
+        callbacks=[ThroughputCallback(args.batch_size, args.grad_accum)],
     )
 
+    started = time.perf_counter()
     trainer.train()
-    model.save_pretrained("models/vlm_adapters/latest")
+    elapsed = time.perf_counter() - started
+    samples = math.ceil(len(dataset) * args.epochs) - dataset.skipped
+    print(f"Trained in {elapsed:.1f}s ({samples / max(elapsed, 1e-9):.2f} samples/s), "
+          f"image cache hits {dataset.cache.hits}/{dataset.cache.hits + dataset.cache.misses}, "
+          f"skipped {dataset.skipped}")
+    model.save_pretrained(args.output)
     print("LoRA adapter fine-tuned and saved.")
+
+
+if __name__ == "__main__":
+    main()
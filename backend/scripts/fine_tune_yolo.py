@@ -1,12 +1,22 @@
 from ultralytics import YOLO
 import os
+import sys
+import json
+import math
+import random
 import argparse
 import shutil
+from datetime import datetime
 from pathlib import Path
-from sahi_preprocess import slice_dataset, create_sliced_yaml
+import yaml
+from sahi_preprocess import slice_dataset, create_sliced_yaml, pack_sliced_dataset, PackedShard
+from compile_feedback import compile_feedback, load_manifest, save_manifest
 
-def prepare_sliced_dataset(use_sahi: bool, project_root: str):
-    """Prepare sliced dataset if SAHI is enabled."""
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def prepare_sliced_dataset(use_sahi: bool, project_root: str, force: bool = False):
+    """Prepare sliced dataset if SAHI is enabled; only changed source images are re-sliced."""
     if not use_sahi:
         return "data/config.yaml"
     
@@ -24,7 +34,8 @@ def prepare_sliced_dataset(use_sahi: bool, project_root: str):
         slice_height=512,
         slice_width=512,
         overlap_height_ratio=0.3,
-        overlap_width_ratio=0.3
+        overlap_width_ratio=0.3,
+        force=force
     )
     
     # Create YAML config for sliced dataset
@@ -32,22 +43,273 @@ def prepare_sliced_dataset(use_sahi: bool, project_root: str):
     
     return str(sliced_yaml_path)
 
+def prepare_packed_dataset(project_root: str, force: bool = False):
+    """Slice (incrementally) and pack the sliced splits into memory-mapped shards, skipping unchanged splits."""
+    sliced_yaml = prepare_sliced_dataset(True, project_root, force=force)
+    packed_dir = Path(project_root) / "data" / "packed_dataset"
+    pack_sliced_dataset(Path(sliced_yaml).parent, packed_dir, force=force)
+    return str(packed_dir / "data.yaml")
+
+def source_trainer(open_source):
+    """
+    DetectionTrainer whose datasets read samples from open_source(img_path) instead of
+    decoding one image file and parsing one label file per sample. A source has
+    names, shape(i) -> (h, w), labels_for(i) -> N x 5 YOLO rows and load_bgr(i);
+    paths for which open_source returns None are loaded from files as usual.
+    """
+    import cv2
+    import numpy as np
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils import colorstr
+    from ultralytics.utils.torch_utils import de_parallel
+
+    class SourceYOLODataset(YOLODataset):
+        def __init__(self, *args, source=None, **kwargs):
+            self.source = source
+            super().__init__(*args, **kwargs)
+
+        def get_img_files(self, img_path):
+            return [str(Path(img_path) / name) for name in self.source.names]
+
+        def get_labels(self):
+            labels = []
+            for i, im_file in enumerate(self.im_files):
+                rows = np.array(self.source.labels_for(i), dtype=np.float32).reshape(-1, 5)
+                labels.append({
+                    "im_file": im_file,
+                    "shape": tuple(self.source.shape(i)),
+                    "cls": rows[:, 0:1],
+                    "bboxes": rows[:, 1:5],
+                    "segments": [],
+                    "keypoints": None,
+                    "normalized": True,
+                    "bbox_format": "xywh",
+                })
+            return labels
+
+        def load_image(self, i, rect_mode=True):
+            """Same resizing and buffering as BaseDataset.load_image, reading the image from the source."""
+            if self.ims[i] is not None:
+                return self.ims[i], self.im_hw0[i], self.im_hw[i]
+            im = self.source.load_bgr(i)
+            h0, w0 = im.shape[:2]
+            if rect_mode:
+                r = self.imgsz / max(h0, w0)
+                if r != 1:
+                    w, h = (min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz))
+                    im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+            elif not (h0 == w0 == self.imgsz):
+                im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+            if self.augment:
+                self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+                self.buffer.append(i)
+                if 1 < len(self.buffer) >= self.max_buffer_length:
+                    j = self.buffer.pop(0)
+                    if self.cache != "ram":
+                        self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+            return im, (h0, w0), im.shape[:2]
+
+    class SourceDetectionTrainer(DetectionTrainer):
+        def build_dataset(self, img_path, mode="train", batch=None):
+            source = open_source(img_path)
+            if source is None:
+                return super().build_dataset(img_path, mode, batch)
+            gs = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+            return SourceYOLODataset(
+                img_path=img_path,
+                imgsz=self.args.imgsz,
+                batch_size=batch,
+                augment=mode == "train",
+                hyp=self.args,
+                rect=self.args.rect or mode == "val",
+                cache=self.args.cache or None,
+                single_cls=self.args.single_cls or False,
+                stride=gs,
+                pad=0.0 if mode == "train" else 0.5,
+                prefix=colorstr(f"{mode}: "),
+                task=self.args.task,
+                classes=self.args.classes,
+                data=self.data,
+                fraction=self.args.fraction if mode == "train" else 1.0,
+                source=source,
+            )
+
+    return SourceDetectionTrainer
+
+def packed_trainer():
+    """DetectionTrainer reading the splits that are packed shards straight from the memory-mapped tiles."""
+    return source_trainer(lambda path: PackedShard(path) if PackedShard.is_shard(path) else None)
+
+def deployed_weights():
+    """Path of the weights served by the backend: the promoted registry version, else settings.yolo_weights."""
+    sys.path.insert(0, str(BACKEND_ROOT))
+    from app.core.config import settings
+    from app.services.model_registry import ModelRegistry
+    # Same lookup as YoloService, with the registry found from the backend directory
+    model_dir = Path(settings.model_dir)
+    registry = ModelRegistry(str((model_dir if model_dir.is_absolute() else BACKEND_ROOT / model_dir) / "registry"))
+    weights = Path(registry.active_path("yolo") or settings.yolo_weights)
+    # The backend resolves relative paths from its own directory
+    return weights if weights.is_absolute() else (BACKEND_ROOT / weights).resolve()
+
+def list_images(images_dir):
+    images_dir = Path(images_dir)
+    if not images_dir.exists():
+        return []
+    return sorted(p for p in images_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+def validation_metrics(model, data_yaml, imgsz, device, batch):
+    """mAP/precision/recall of a model on the fixed val split."""
+    metrics = model.val(data=data_yaml, split="val", imgsz=imgsz, device=device, batch=batch, plots=False, verbose=False)
+    return {
+        "precision": float(metrics.box.mp),
+        "recall": float(metrics.box.mr),
+        "mAP50": float(metrics.box.map50),
+        "mAP50_95": float(metrics.box.map),
+    }
+
+def prepare_incremental_dataset(project_root, replay_ratio, min_replay, seed):
+    """
+    Build the train list for an incremental run: feedback slices not yet trained on
+    plus a random replay subset of previously seen tiles. Validation stays on the
+    base sliced val split so before/after metrics are comparable.
+    """
+    data_dir = Path(project_root) / "data"
+    feedback_dir = data_dir / "feedback_dataset"
+    base_dir = data_dir / "sliced_dataset"
+    feedback_images = feedback_dir / "sliced" / "train" / "images"
+    
+    # Pick up any feedback submitted since the last compile
+    compile_feedback(output_dir=feedback_dir, base_yaml=base_dir / "data.yaml")
+    manifest = load_manifest(feedback_dir / "manifest.json")
+    
+    new_ids = [fid for fid, entry in manifest["entries"].items() if not entry.get("trained_at")]
+    delta = [feedback_images / name for fid in new_ids for name in manifest["entries"][fid]["slices"]]
+    
+    # Replay pool: the base training tiles plus feedback already trained on
+    seen = set(str(p) for p in delta)
+    replay_pool = [p for p in list_images(base_dir / "train" / "images") + list_images(feedback_images) if str(p) not in seen]
+    replay_count = min(len(replay_pool), max(min_replay, int(len(delta) * replay_ratio))) if delta else 0
+    replay = random.Random(seed).sample(replay_pool, replay_count)
+    
+    run_dir = data_dir / "incremental"
+    run_dir.mkdir(parents=True, exist_ok=True)
+    train_list = run_dir / "train.txt"
+    with open(train_list, "w") as f:
+        f.writelines(f"{p.absolute()}\n" for p in delta + replay)
+    
+    with open(data_dir / "config.yaml", "r") as f:
+        names = (yaml.safe_load(f) or {}).get("names", {0: "distribution_board"})
+    val_dir = base_dir / "val" / "images"
+    if not val_dir.exists():
+        raise FileNotFoundError(f"Fixed validation split not found at {val_dir}; run with --use-sahi once first")
+    data_yaml = run_dir / "data.yaml"
+    with open(data_yaml, "w") as f:
+        yaml.dump({"train": str(train_list.absolute()), "val": str(val_dir.absolute()), "nc": len(names), "names": names}, f, default_flow_style=False)
+    
+    return str(data_yaml), new_ids, len(delta), len(replay)
+
+def mark_feedback_trained(project_root, feedback_ids, weights_path):
+    manifest_path = Path(project_root) / "data" / "feedback_dataset" / "manifest.json"
+    manifest = load_manifest(manifest_path)
+    trained_at = datetime.now().isoformat()
+    for fid in feedback_ids:
+        if fid in manifest["entries"]:
+            manifest["entries"][fid]["trained_at"] = trained_at
+            manifest["entries"][fid]["trained_weights"] = str(weights_path)
+    save_manifest(manifest_path, manifest)
+
+def incremental_finetune(args, project_root):
+    """Warm-start from the deployed weights and train briefly on the feedback delta."""
+    weights = Path(args.model) if args.model else deployed_weights()
+    if not weights.exists():
+        raise FileNotFoundError(f"Deployed weights not found at: {weights}")
+    
+    data_yaml, feedback_ids, delta_count, replay_count = prepare_incremental_dataset(
+        project_root, args.replay_ratio, args.min_replay, args.seed
+    )
+    if delta_count == 0:
+        print("No new feedback samples since the last incremental run, nothing to train.")
+        return None
+    
+    # The train set is already (1 + replay_ratio) x delta, so a fixed epoch count keeps
+    # the run time proportional to the delta
+    epochs = args.epochs or args.inc_epochs
+    print(f"Incremental run: {delta_count} new tiles from {len(feedback_ids)} feedback items, "
+          f"{replay_count} replay tiles, {epochs} epochs from {weights}")
+    
+    before = validation_metrics(YOLO(str(weights)), data_yaml, args.imgsz, args.device, args.batch)
+    
+    model = YOLO(str(weights))
+    model.train(
+        data=data_yaml,
+        epochs=epochs,
+        imgsz=args.imgsz,
+        device=args.device,
+        batch=args.batch,
+        lr0=args.inc_lr0,
+        warmup_epochs=0,  # weights are already trained, no warmup needed
+        name="incremental_train"
+    )
+    best = Path(model.trainer.save_dir) / "weights" / "best.pt"
+    after = validation_metrics(YOLO(str(best)), data_yaml, args.imgsz, args.device, args.batch)
+    
+    mark_feedback_trained(project_root, feedback_ids, best)
+    
+    report = {
+        "base_weights": str(weights),
+        "new_weights": str(best),
+        "feedback_items": len(feedback_ids),
+        "delta_tiles": delta_count,
+        "replay_tiles": replay_count,
+        "epochs": epochs,
+        "before": before,
+        "after": after,
+    }
+    with open(Path(model.trainer.save_dir) / "incremental_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    
+    print("\nValidation on fixed val split:")
+    print(f"  {'metric':<10} {'before':>8} {'after':>8} {'delta':>8}")
+    for key in before:
+        print(f"  {key:<10} {before[key]:>8.4f} {after[key]:>8.4f} {after[key] - before[key]:>+8.4f}")
+    print(f"New weights: {best}")
+    return report
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Fine-tune YOLO model with optional SAHI preprocessing")
     parser.add_argument("--use-sahi", action="store_true", help="Enable SAHI slicing for training")
-    parser.add_argument("--epochs", type=int, default=50, help="Number of training epochs")
+    parser.add_argument("--epochs", type=int, default=None, help="Number of training epochs (default: 50, or --inc-epochs with --incremental)")
     parser.add_argument("--batch", type=int, default=16, help="Batch size")
     parser.add_argument("--imgsz", type=int, default=640, help="Image size")
     parser.add_argument("--device", default=0, help="Device to use (0 for GPU, 'cpu' for CPU)")
-    parser.add_argument("--model", default="yolov8s.pt", help="Model to use")
+    parser.add_argument("--model", default=None, help="Model to use (default: yolov8s.pt, or the deployed weights with --incremental)")
+    parser.add_argument("--incremental", action="store_true", help="Warm-start from the deployed weights and train on new feedback only")
+    parser.add_argument("--replay-ratio", type=float, default=2.0, help="Replay tiles per new tile in incremental mode")
+    parser.add_argument("--min-replay", type=int, default=32, help="Minimum replay tiles in incremental mode")
+    parser.add_argument("--inc-epochs", type=int, default=3, help="Epochs of an incremental run when --epochs is not given")
+    parser.add_argument("--inc-lr0", type=float, default=0.001, help="Initial learning rate in incremental mode")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for replay sampling")
+    parser.add_argument("--reslice", action="store_true", help="Re-slice every image instead of only changed ones")
+    parser.add_argument("--packed", action="store_true", help="Train from memory-mapped packed shards of the sliced dataset (implies --use-sahi)")
     
     args = parser.parse_args()
     
     # Get the project root directory (two levels up from this script)
     project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     
+    if args.incremental:
+        incremental_finetune(args, project_root)
+        print("✅ Incremental YOLO fine-tuning complete.")
+        sys.exit(0)
+    
     # Prepare dataset (sliced or original)
-    config_path = prepare_sliced_dataset(args.use_sahi, project_root)
+    if args.packed:
+        args.use_sahi = True
+        config_path = prepare_packed_dataset(project_root, force=args.reslice)
+    else:
+        config_path = prepare_sliced_dataset(args.use_sahi, project_root, force=args.reslice)
     
     print(f"Using config file: {config_path}")
     
@@ -58,14 +320,15 @@ if __name__ == "__main__":
     # Initialize and train model
     print(f"🚀 Starting YOLO training with {'SAHI sliced' if args.use_sahi else 'original'} dataset...")
     
-    model = YOLO(args.model)
+    model = YOLO(args.model or "yolov8s.pt")
     model.train(
         data=config_path,
-        epochs=args.epochs,
+        epochs=args.epochs or 50,
         imgsz=args.imgsz,
         device=args.device,
         batch=args.batch,
-        name=f"sahi_train" if args.use_sahi else "train"
+        name=f"sahi_train" if args.use_sahi else "train",
+        **({"trainer": packed_trainer()} if args.packed else {})
     )
     
     # Export model
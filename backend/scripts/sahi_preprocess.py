@@ -1,181 +1,559 @@
+import hashlib
+import json
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 from pathlib import Path
+import numpy as np
+from PIL import Image
 from sahi import AutoDetectionModel
 from sahi.utils.cv import read_image
 from sahi.utils.file import download_from_url
 from sahi.slicing import slice_image
 import yaml
+from yolo_labels import read_labels, write_labels
 
-def slice_dataset(input_dir, output_dir, slice_height=512, slice_width=512, overlap_height_ratio=0.3, overlap_width_ratio=0.3):
+MANIFEST_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+IMAGE_PATTERNS = ('*.jpg', '*.png', '*.jpeg')
+
+
+def load_manifest(manifest_path):
+    manifest_path = Path(manifest_path)
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {"version": MANIFEST_VERSION, "slice_params": None, "entries": {}}
+
+
+def save_manifest(manifest_path, manifest):
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    tmp_path.replace(manifest_path)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_state(path, previous=None):
+    """Size, mtime and content hash of a file (None if missing); the hash is reused while size and mtime match."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    stat = path.stat()
+    state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if previous and previous.get('size') == state['size'] and previous.get('mtime_ns') == state['mtime_ns']:
+        state['sha256'] = previous['sha256']
+    else:
+        state['sha256'] = file_digest(path)
+    return state
+
+
+# Labels keep a slice when more than this fraction of their area falls inside it
+# (low, so small symbols cut by a slice border are not lost)
+MIN_INTERSECTION_RATIO = 0.01
+
+
+def project_labels(labels, origins, slice_width, slice_height, image_width, image_height,
+                   min_ratio=MIN_INTERSECTION_RATIO):
+    """
+    Intersect every label with every slice window in one broadcast.
+    Returns (keep, boxes, hits): keep is a (slices, labels) mask of labels that go into a
+    slice, boxes the clipped labels in slice-normalized YOLO format (slices, labels, 4),
+    and hits the mask of labels touching a slice at all (kept or below the ratio).
+    """
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    cx, cy = labels[:, 1] * image_width, labels[:, 2] * image_height
+    w, h = labels[:, 3] * image_width, labels[:, 4] * image_height
+    x_min, y_min, x_max, y_max = cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2
+
+    sx_min, sy_min = origins[:, 0:1], origins[:, 1:2]
+    ix_min = np.maximum(x_min[None, :], sx_min)
+    iy_min = np.maximum(y_min[None, :], sy_min)
+    ix_max = np.minimum(x_max[None, :], sx_min + slice_width)
+    iy_max = np.minimum(y_max[None, :], sy_min + slice_height)
+    iw, ih = ix_max - ix_min, iy_max - iy_min
+
+    hits = (iw > 0) & (ih > 0)
+    area = w * h
+    ratio = np.divide(np.clip(iw, 0, None) * np.clip(ih, 0, None), area[None, :],
+                      out=np.zeros_like(iw), where=area[None, :] > 0)
+    keep = hits & (ratio > min_ratio)
+    boxes = np.stack([
+        ((ix_min + ix_max) / 2 - sx_min) / slice_width,
+        ((iy_min + iy_max) / 2 - sy_min) / slice_height,
+        iw / slice_width,
+        ih / slice_height,
+    ], axis=-1)
+    return keep, np.clip(boxes, 0, 1), hits
+
+
+def slice_image_with_labels(image_file, original_labels, images_out_dir, labels_out_dir, slice_height=512, slice_width=512, overlap_height_ratio=0.3, overlap_width_ratio=0.3, counters=None):
+    """
+    Slice a single image and project its YOLO labels into every slice.
+    Returns the slice file names written and the number of slice labels created.
+    Per-slice statistics are added to ``counters`` when given.
+    """
+    image_file = Path(image_file)
+    images_out_dir = Path(images_out_dir)
+    labels_out_dir = Path(labels_out_dir)
+    
+    # Slice the image
+    slice_image_result = slice_image(
+        image=str(image_file),
+        output_file_name=None,
+        output_dir=None,
+        slice_height=slice_height,
+        slice_width=slice_width,
+        overlap_height_ratio=overlap_height_ratio,
+        overlap_width_ratio=overlap_width_ratio,
+        out_ext=".jpg",
+        verbose=0
+    )
+    orig_width = slice_image_result.original_image_width
+    orig_height = slice_image_result.original_image_height
+
+    original_labels = np.asarray(original_labels, dtype=np.float64).reshape(-1, 5)
+    keep, boxes, hits = project_labels(original_labels, slice_image_result.starting_pixels,
+                                       slice_width, slice_height, orig_width, orig_height)
+
+    slice_names = []
+    total_labels_created = 0
+    for index, slice_info in enumerate(slice_image_result):
+        starting_pixel = slice_info['starting_pixel']
+        slice_filename = f"{image_file.stem}_slice_{starting_pixel[0]}_{starting_pixel[1]}.jpg"
+        Image.fromarray(slice_info['image']).save(images_out_dir / slice_filename)
+
+        kept = np.flatnonzero(keep[index])
+        write_labels(labels_out_dir / f"{slice_filename.replace('.jpg', '.txt')}",
+                     np.column_stack([original_labels[kept, 0], boxes[index, kept]]))
+
+        slice_names.append(slice_filename)
+        total_labels_created += len(kept)
+        if counters is not None:
+            counters['slices'] = counters.get('slices', 0) + 1
+            counters['empty_slices'] = counters.get('empty_slices', 0) + int(len(kept) == 0)
+            counters['labels_below_ratio'] = counters.get('labels_below_ratio', 0) + int(hits[index].sum() - len(kept))
+
+    if counters is not None:
+        counters['labels_created'] = counters.get('labels_created', 0) + total_labels_created
+    return slice_names, total_labels_created
+
+
+def _slice_task(task):
+    """Slice one image for slice_dataset; runs in a worker process.
+    Returns (image file, counters, error, {slice name: content hashes}).
+    """
+    image_file, label_file, images_out_dir, labels_out_dir, params = task
+    counters = {'images': 1}
+    if not label_file.exists():
+        return image_file, {'missing_label': 1}, None, {}
+    original_labels = read_labels(label_file)
+    if not len(original_labels):
+        return image_file, {'no_labels': 1}, None, {}
+    counters['source_labels'] = len(original_labels)
+    try:
+        slice_names, _ = slice_image_with_labels(image_file, original_labels, images_out_dir, labels_out_dir,
+                                                 counters=counters, **params)
+    except Exception as e:
+        return image_file, {'failed': 1}, str(e), {}
+    slices = {
+        name: {'image': file_digest(Path(images_out_dir) / name),
+               'label': file_digest(Path(labels_out_dir) / name.replace('.jpg', '.txt'))}
+        for name in slice_names
+    }
+    return image_file, counters, None, slices
+
+
+def _remove_slices(output_path, split, slice_names):
+    for name in slice_names:
+        (output_path / split / 'images' / name).unlink(missing_ok=True)
+        (output_path / split / 'labels' / name.replace('.jpg', '.txt')).unlink(missing_ok=True)
+
+
+def _entry_current(entry, output_path, split):
+    """Whether a manifest entry's slices are all still on disk."""
+    return all((output_path / split / 'images' / name).exists()
+               and (output_path / split / 'labels' / name.replace('.jpg', '.txt')).exists()
+               for name in entry.get('slices', {}))
+
+
+def slice_dataset(input_dir, output_dir, slice_height=512, slice_width=512, overlap_height_ratio=0.3, overlap_width_ratio=0.3, workers=None, force=False):
     """
     Slice dataset using SAHI for better small object detection.
     Using smaller slices (512x512) with more overlap to better capture small objects.
+
+    Incremental: output_dir/manifest.json records the content hash of every source image
+    and label file with the slicing parameters, and the slices produced from them. Only
+    sources that are new or changed (or whose slices went missing) are sliced again, the
+    slices of removed sources and any unlisted files are deleted, and changed parameters
+    (or ``force``) re-slice everything. Images are sliced in parallel, one per task, on
+    ``workers`` processes (all cores by default, 1 to run in this process). Returns the
+    summary counters per split.
     """
     input_path = Path(input_dir)
     output_path = Path(output_dir)
+    workers = workers or os.cpu_count() or 1
+    params = dict(slice_height=slice_height, slice_width=slice_width,
+                  overlap_height_ratio=overlap_height_ratio, overlap_width_ratio=overlap_width_ratio)
     
     # Create output directories
     for split in ['train', 'val']:
         (output_path / split / 'images').mkdir(parents=True, exist_ok=True)
         (output_path / split / 'labels').mkdir(parents=True, exist_ok=True)
+
+    manifest_path = output_path / MANIFEST_NAME
+    manifest = load_manifest(manifest_path)
+    entries = manifest['entries']
+    if force or manifest.get('slice_params') not in (None, params):
+        print("Slice parameters changed, re-slicing all images" if not force else "Re-slicing all images")
+        for key, entry in entries.items():
+            _remove_slices(output_path, key.split('/', 1)[0], entry.get('slices', {}))
+        entries.clear()
+    manifest['slice_params'] = params
     
-    # Process each split
+    summary = {}
     for split in ['train', 'val']:
         images_dir = input_path / split 
         labels_dir = Path(str(input_path).replace('images', 'labels')) / split  # Point to labels directory
-        
-        if not images_dir.exists():
+        counters = {'unchanged': 0, 'sliced': 0, 'removed': 0, 'orphans_removed': 0}
+        summary[split] = counters
+        image_files = []
+        if images_dir.exists():
+            image_files = sorted(p for pattern in IMAGE_PATTERNS for p in images_dir.glob(pattern))
+        else:
             print(f"Warning: {images_dir} does not exist, skipping...")
-            continue
-            
-        print(f"Processing {split} split...")
-        
-        # Get all image files
-        image_files = list(images_dir.glob('*.jpg')) + list(images_dir.glob('*.png')) + list(images_dir.glob('*.jpeg'))
-        
-        total_labels_created = 0
-        
+
+        # Sources that are new, changed or lost their slices; the rest are left alone
+        tasks = []
+        states = {}
         for image_file in image_files:
-            print(f"  Processing {image_file.name}...")
-            
-            # Get corresponding label file
+            key = f"{split}/{image_file.name}"
             label_file = labels_dir / f"{image_file.stem}.txt"
-            
-            if not label_file.exists():
-                print(f"    Warning: No label file found for {image_file.name}")
+            previous = entries.get(key)
+            state = {
+                'image': file_state(image_file, previous and previous.get('image')),
+                'label': file_state(label_file, previous and previous.get('label')),
+            }
+            if previous and all((previous.get(k) or {}).get('sha256') == (state[k] or {}).get('sha256')
+                                for k in ('image', 'label')) and _entry_current(previous, output_path, split):
+                # Keep refreshed stat info so the next run does not hash again
+                previous.update(state)
+                counters['unchanged'] += 1
                 continue
-            
-            # Read original labels
-            original_labels = []
-            with open(label_file, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line:
-                        parts = line.split()
-                        if len(parts) == 5:
-                            class_id = int(parts[0])
-                            x_center = float(parts[1])
-                            y_center = float(parts[2])
-                            width = float(parts[3])
-                            height = float(parts[4])
-                            original_labels.append((class_id, x_center, y_center, width, height))
-            
-            if not original_labels:
-                print(f"    No labels found in {label_file.name}")
+            if previous:
+                _remove_slices(output_path, split, previous.get('slices', {}))
+            states[str(image_file)] = (key, state)
+            tasks.append((image_file, label_file, output_path / split / 'images', output_path / split / 'labels', params))
+
+        # Sources that disappeared take their slices with them
+        present = {f"{split}/{p.name}" for p in image_files}
+        for key in [k for k in entries if k.startswith(f"{split}/") and k not in present]:
+            _remove_slices(output_path, split, entries.pop(key).get('slices', {}))
+            counters['removed'] += 1
+
+        if tasks:
+            print(f"Processing {split} split: {len(tasks)} of {len(image_files)} images to slice "
+                  f"on {min(workers, len(tasks))} workers...")
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+                results = list(pool.map(_slice_task, tasks))
+        else:
+            results = [_slice_task(task) for task in tasks]
+        for image_file, image_counters, error, slices in results:
+            key, state = states[str(image_file)]
+            if error:
+                # Not recorded, so the next run retries it
+                print(f"  Failed to slice {image_file.name}: {error}")
+                _remove_slices(output_path, split, slices)
+            else:
+                entries[key] = {**state, 'slices': slices, 'sliced_at': datetime.now().isoformat()}
+                counters['sliced'] += 1
+            for name, value in image_counters.items():
+                counters[name] = counters.get(name, 0) + value
+
+        # Anything on disk the manifest does not know about (e.g. from runs before it existed)
+        known = {name for key, entry in entries.items() if key.startswith(f"{split}/") for name in entry.get('slices', {})}
+        for path in list((output_path / split / 'images').iterdir()) + list((output_path / split / 'labels').iterdir()):
+            if path.with_suffix('.jpg').name not in known:
+                path.unlink()
+                counters['orphans_removed'] += 1
+
+        print(f"Completed {split} split: {counters['sliced']} sliced, {counters['unchanged']} unchanged, "
+              f"{counters['removed']} removed, {counters['orphans_removed']} orphaned files deleted; "
+              f"{counters.get('slices', 0)} new slices ({counters.get('empty_slices', 0)} empty), "
+              f"{counters.get('labels_created', 0)} labels created, "
+              f"{counters.get('labels_below_ratio', 0)} below the {MIN_INTERSECTION_RATIO} area ratio, "
+              f"{counters.get('missing_label', 0)} without label file, {counters.get('no_labels', 0)} without labels, "
+              f"{counters.get('failed', 0)} failed")
+    save_manifest(manifest_path, manifest)
+    return summary
+
+
+def verify_sliced_dataset(input_dir, output_dir, check_hashes=True):
+    """
+    Check a sliced dataset against its manifest.
+    Reports sources that changed or disappeared since slicing, new unsliced sources, slices
+    missing from disk, slices whose content no longer matches (with ``check_hashes``) and
+    files the manifest does not list. Returns a dict of lists; all empty means consistent.
+    """
+    input_path = Path(input_dir)
+    output_path = Path(output_dir)
+    manifest = load_manifest(output_path / MANIFEST_NAME)
+    entries = manifest['entries']
+    report = {'stale_sources': [], 'removed_sources': [], 'unsliced_sources': [],
+              'missing_slices': [], 'corrupt_slices': [], 'unlisted_files': []}
+    for split in ['train', 'val']:
+        images_dir = input_path / split
+        labels_dir = Path(str(input_path).replace('images', 'labels')) / split
+        image_files = sorted(p for pattern in IMAGE_PATTERNS for p in images_dir.glob(pattern)) if images_dir.exists() else []
+        present = set()
+        for image_file in image_files:
+            key = f"{split}/{image_file.name}"
+            present.add(key)
+            entry = entries.get(key)
+            if entry is None:
+                report['unsliced_sources'].append(key)
                 continue
-                
-            print(f"    Found {len(original_labels)} original labels")
-            
-            # Slice the image
-            slice_image_result = slice_image(
-                image=str(image_file),
-                output_file_name=None,
-                output_dir=None,
-                slice_height=slice_height,
-                slice_width=slice_width,
-                overlap_height_ratio=overlap_height_ratio,
-                overlap_width_ratio=overlap_width_ratio,
-                out_ext=".jpg",
-                verbose=0
-            )
-            
-            # Get original image dimensions
-            from PIL import Image
-            with Image.open(image_file) as img:
-                orig_width, orig_height = img.size
-            
-            slice_count = 0
-            # Process each slice
-            for slice_info in slice_image_result:
-                slice_count += 1
-                
-                # Get slice information - SAHI API returns dict now
-                slice_image_array = slice_info['image']
-                starting_pixel = slice_info['starting_pixel']
-                
-                # Convert slice to PIL Image and save
-                slice_pil = Image.fromarray(slice_image_array)
-                slice_filename = f"{image_file.stem}_slice_{starting_pixel[0]}_{starting_pixel[1]}.jpg"
-                slice_image_path = output_path / split / 'images' / slice_filename
-                slice_pil.save(slice_image_path)
-                
-                # Create corresponding labels for this slice
-                slice_labels = []
-                
-                # Convert original labels to slice coordinates
-                for class_id, x_center, y_center, width, height in original_labels:
-                    # Convert normalized coordinates to absolute coordinates
-                    abs_x_center = x_center * orig_width
-                    abs_y_center = y_center * orig_height
-                    abs_width = width * orig_width
-                    abs_height = height * orig_height
-                    
-                    # Calculate bounding box corners
-                    x_min = abs_x_center - abs_width / 2
-                    y_min = abs_y_center - abs_height / 2
-                    x_max = abs_x_center + abs_width / 2
-                    y_max = abs_y_center + abs_height / 2
-                    
-                    # Calculate slice boundaries
-                    slice_x_min = starting_pixel[0]
-                    slice_y_min = starting_pixel[1]
-                    slice_x_max = starting_pixel[0] + slice_width
-                    slice_y_max = starting_pixel[1] + slice_height
-                    
-                    # Check if bounding box intersects with slice
-                    intersect_x_min = max(x_min, slice_x_min)
-                    intersect_y_min = max(y_min, slice_y_min)
-                    intersect_x_max = min(x_max, slice_x_max)
-                    intersect_y_max = min(y_max, slice_y_max)
-                    
-                    # Check if there's a valid intersection
-                    if intersect_x_min < intersect_x_max and intersect_y_min < intersect_y_max:
-                        # Calculate intersection area
-                        intersection_area = (intersect_x_max - intersect_x_min) * (intersect_y_max - intersect_y_min)
-                        original_area = abs_width * abs_height
-                        
-                        # Use much lower threshold for very small objects (1% instead of 10%)
-                        min_threshold = 0.01
-                        intersection_ratio = intersection_area / original_area if original_area > 0 else 0
-                        
-                        if intersection_ratio > min_threshold:
-                            # Convert intersection to slice-relative coordinates
-                            new_x_center = (intersect_x_min + intersect_x_max) / 2 - slice_x_min
-                            new_y_center = (intersect_y_min + intersect_y_max) / 2 - slice_y_min
-                            new_width = intersect_x_max - intersect_x_min
-                            new_height = intersect_y_max - intersect_y_min
-                            
-                            # Normalize to slice dimensions
-                            new_x_center /= slice_width
-                            new_y_center /= slice_height
-                            new_width /= slice_width
-                            new_height /= slice_height
-                            
-                            # Ensure coordinates are within bounds
-                            new_x_center = max(0, min(1, new_x_center))
-                            new_y_center = max(0, min(1, new_y_center))
-                            new_width = max(0, min(1, new_width))
-                            new_height = max(0, min(1, new_height))
-                            
-                            slice_labels.append(f"{class_id} {new_x_center:.6f} {new_y_center:.6f} {new_width:.6f} {new_height:.6f}\n")
-                            print(f"    Added label to slice {slice_count}: class={class_id}, ratio={intersection_ratio:.3f}")
-                        else:
-                            print(f"    Skipped label in slice {slice_count}: class={class_id}, ratio={intersection_ratio:.3f} (below {min_threshold})")
-                
-                # Save slice labels
-                slice_label_path = output_path / split / 'labels' / f"{slice_filename.replace('.jpg', '.txt')}"
-                with open(slice_label_path, 'w') as f:
-                    f.writelines(slice_labels)
-                
-                total_labels_created += len(slice_labels)
-                
-                if slice_labels:
-                    print(f"    Slice {slice_count}: {len(slice_labels)} labels")
-            
-            print(f"  Created {slice_count} slices from {image_file.name}")
-        
-        print(f"Completed {split} split: {total_labels_created} total labels created")
+            label_file = labels_dir / f"{image_file.stem}.txt"
+            for kind, path in (('image', image_file), ('label', label_file)):
+                state = file_state(path, entry.get(kind)) if not check_hashes else (
+                    {'sha256': file_digest(path)} if path.exists() else None)
+                if (state or {}).get('sha256') != (entry.get(kind) or {}).get('sha256'):
+                    report['stale_sources'].append(key)
+                    break
+        report['removed_sources'] += [k for k in entries if k.startswith(f"{split}/") and k not in present]
+
+        known = set()
+        for key, entry in entries.items():
+            if not key.startswith(f"{split}/"):
+                continue
+            for name, hashes in entry.get('slices', {}).items():
+                known.add(name)
+                for kind, path in (('image', output_path / split / 'images' / name),
+                                   ('label', output_path / split / 'labels' / name.replace('.jpg', '.txt'))):
+                    if not path.exists():
+                        report['missing_slices'].append(str(path.relative_to(output_path)))
+                    elif check_hashes and file_digest(path) != hashes[kind]:
+                        report['corrupt_slices'].append(str(path.relative_to(output_path)))
+        for sub in ('images', 'labels'):
+            directory = output_path / split / sub
+            if directory.exists():
+                report['unlisted_files'] += [str(p.relative_to(output_path)) for p in sorted(directory.iterdir())
+                                             if p.with_suffix('.jpg').name not in known]
+    return report
+
+# Packed shard layout: tiles.u8 holds every tile as one contiguous uint8 array
+# (count x tile_height x tile_width x 3, RGB, zero padded to the tile size) that is
+# memory-mapped on load; sizes/offsets/labels are .npy tables and the label rows of
+# tile i are labels[offsets[i]:offsets[i + 1]] as (class_id, x_center, y_center, width, height).
+SHARD_VERSION = 1
+SHARD_INDEX = 'index.json'
+SHARD_TILES = 'tiles.u8'
+
+
+class ShardWriter:
+    """Append tiles and their YOLO labels to a packed shard directory."""
+
+    def __init__(self, shard_dir, tile_height=512, tile_width=512, meta=None):
+        self.shard_dir = Path(shard_dir)
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self.tile_height = tile_height
+        self.tile_width = tile_width
+        self.meta = meta or {}
+        self.names = []
+        self.sizes = []
+        self.offsets = [0]
+        self.labels = []
+        self._tiles_tmp = self.shard_dir / (SHARD_TILES + '.tmp')
+        self._tiles = open(self._tiles_tmp, 'wb')
+
+    def add(self, name, tile, labels=()):
+        """Append one RGB uint8 tile (h x w x 3, at most the tile size) and its label rows."""
+        tile = np.asarray(tile, dtype=np.uint8)
+        height, width = tile.shape[:2]
+        if tile.ndim != 3 or tile.shape[2] != 3:
+            raise ValueError(f"{name}: expected an h x w x 3 tile, got shape {tile.shape}")
+        if height > self.tile_height or width > self.tile_width:
+            raise ValueError(f"{name}: {width}x{height} tile exceeds shard tile size {self.tile_width}x{self.tile_height}")
+        if (height, width) != (self.tile_height, self.tile_width):
+            padded = np.zeros((self.tile_height, self.tile_width, 3), dtype=np.uint8)
+            padded[:height, :width] = tile
+            tile = padded
+        self._tiles.write(memoryview(np.ascontiguousarray(tile)))
+        rows = np.asarray(labels, dtype=np.float32).reshape(-1, 5)
+        self.labels.append(rows)
+        self.offsets.append(self.offsets[-1] + len(rows))
+        self.names.append(name)
+        self.sizes.append((height, width))
+
+    def close(self):
+        if self._tiles.closed:
+            return
+        self._tiles.close()
+        labels = np.concatenate(self.labels) if self.labels else np.zeros((0, 5), dtype=np.float32)
+        np.save(self.shard_dir / 'labels.npy', labels)
+        np.save(self.shard_dir / 'offsets.npy', np.asarray(self.offsets, dtype=np.int64))
+        np.save(self.shard_dir / 'sizes.npy', np.asarray(self.sizes, dtype=np.int32).reshape(-1, 2))
+        self._tiles_tmp.replace(self.shard_dir / SHARD_TILES)
+        # The index is written last, so a shard without one is incomplete
+        save_manifest(self.shard_dir / SHARD_INDEX, {
+            'version': SHARD_VERSION,
+            'count': len(self.names),
+            'tile_height': self.tile_height,
+            'tile_width': self.tile_width,
+            'channels': 3,
+            'labels': int(len(labels)),
+            'names': self.names,
+            'meta': self.meta,
+            'packed_at': datetime.now().isoformat(),
+        })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._tiles.close()
+            self._tiles_tmp.unlink(missing_ok=True)
+
+
+class PackedShard:
+    """Read-only view of a packed shard; tiles and labels are views into memory-mapped files."""
+
+    def __init__(self, shard_dir):
+        self.shard_dir = Path(shard_dir)
+        index_path = self.shard_dir / SHARD_INDEX
+        if not index_path.exists():
+            raise FileNotFoundError(f"No packed shard at {self.shard_dir} (missing {SHARD_INDEX})")
+        with open(index_path, 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        if self.index.get('version') != SHARD_VERSION:
+            raise ValueError(f"Unsupported shard version {self.index.get('version')} in {self.shard_dir}")
+        self.names = self.index['names']
+        shape = (self.index['count'], self.index['tile_height'], self.index['tile_width'], self.index['channels'])
+        # np.memmap refuses empty files
+        self.tiles = (np.memmap(self.shard_dir / SHARD_TILES, dtype=np.uint8, mode='r', shape=shape)
+                      if shape[0] else np.zeros(shape, dtype=np.uint8))
+        self.sizes = np.load(self.shard_dir / 'sizes.npy', mmap_mode='r')
+        self.offsets = np.load(self.shard_dir / 'offsets.npy', mmap_mode='r')
+        self.labels = np.load(self.shard_dir / 'labels.npy', mmap_mode='r')
+
+    @staticmethod
+    def is_shard(path):
+        return (Path(path) / SHARD_INDEX).exists()
+
+    def __len__(self):
+        return len(self.names)
+
+    def tile(self, i):
+        height, width = self.sizes[i]
+        return self.tiles[i, :height, :width]
+
+    def labels_for(self, i):
+        return self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    def shape(self, i):
+        return tuple(int(v) for v in self.sizes[i])
+
+    def load_bgr(self, i):
+        """Contiguous BGR copy of a tile, as cv2.imread would return it."""
+        return np.ascontiguousarray(self.tile(i)[..., ::-1])
+
+    def __getitem__(self, i):
+        return self.tile(i), self.labels_for(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.names[i], self.tile(i), self.labels_for(i)
+
+
+def pack_yolo_folder(images_dir, labels_dir, shard_dir, meta=None):
+    """Pack a YOLO images/labels folder pair into a shard; returns the number of tiles."""
+    images_dir, labels_dir = Path(images_dir), Path(labels_dir)
+    image_files = sorted(p for pattern in IMAGE_PATTERNS for p in images_dir.glob(pattern))
+    # The tile size is the largest image, read from the headers only
+    sizes = [Image.open(p).size for p in image_files]
+    tile_width = max((w for w, _ in sizes), default=0)
+    tile_height = max((h for _, h in sizes), default=0)
+    with ShardWriter(shard_dir, tile_height, tile_width, meta) as writer:
+        for image_file in image_files:
+            with Image.open(image_file) as image:
+                tile = np.asarray(image.convert('RGB'))
+            writer.add(image_file.name, tile, read_labels(labels_dir / f"{image_file.stem}.txt"))
+    return len(image_files)
+
+
+def manifest_digest(manifest, split):
+    """Digest of the slices a manifest lists for one split, with their content hashes."""
+    slices = {key: entry.get('slices', {}) for key, entry in manifest['entries'].items()
+              if key.startswith(f"{split}/")}
+    payload = json.dumps({'slice_params': manifest.get('slice_params'), 'slices': slices}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def pack_sliced_dataset(sliced_dir, packed_dir, force=False):
+    """Pack every split of a sliced dataset into packed_dir/<split> and write a data.yaml pointing at the shards.
+
+    A split is only repacked when the sliced manifest changed since its shard was written (or
+    with ``force``); the digest of the manifest is kept in the shard's index meta. Sliced
+    folders without a manifest are always repacked.
+    """
+    sliced_dir, packed_dir = Path(sliced_dir), Path(packed_dir)
+    manifest = load_manifest(sliced_dir / MANIFEST_NAME)
+    counts = {}
+    for split in ['train', 'val']:
+        images_dir = sliced_dir / split / 'images'
+        if not images_dir.exists():
+            continue
+        shard_dir = packed_dir / split
+        meta = {'source': str(images_dir.absolute())}
+        if manifest['entries']:
+            meta['manifest_digest'] = manifest_digest(manifest, split)
+            if not force and PackedShard.is_shard(shard_dir):
+                index = load_manifest(shard_dir / SHARD_INDEX)
+                if index.get('version') == SHARD_VERSION and index.get('meta') == meta:
+                    counts[split] = index['count']
+                    print(f"{split} shard in {shard_dir} is up to date ({counts[split]} tiles)")
+                    continue
+        if shard_dir.exists():
+            shutil.rmtree(shard_dir)
+        counts[split] = pack_yolo_folder(images_dir, sliced_dir / split / 'labels', shard_dir, meta=meta)
+        print(f"Packed {counts[split]} {split} tiles into {shard_dir}")
+
+    config = {}
+    if (sliced_dir / 'data.yaml').exists():
+        with open(sliced_dir / 'data.yaml', 'r') as f:
+            config = yaml.safe_load(f) or {}
+    config.update({'path': str(packed_dir.absolute()), 'train': 'train', 'val': 'val', 'packed': True})
+    with open(packed_dir / 'data.yaml', 'w') as f:
+        yaml.dump(config, f, default_flow_style=False)
+    return counts
+
+
+def unpack_shard(shard_dir, output_dir):
+    """Write a shard back out as a plain YOLO folder (output_dir/images, output_dir/labels)."""
+    shard = PackedShard(shard_dir)
+    images_out = Path(output_dir) / 'images'
+    labels_out = Path(output_dir) / 'labels'
+    images_out.mkdir(parents=True, exist_ok=True)
+    labels_out.mkdir(parents=True, exist_ok=True)
+    for name, tile, labels in shard:
+        Image.fromarray(np.asarray(tile)).save(images_out / name, quality=95)
+        write_labels(labels_out / f"{Path(name).stem}.txt", labels)
+    return len(shard)
+
 
 def create_sliced_yaml(output_dir, original_yaml_path):
     """Create YAML config file for sliced dataset"""
@@ -205,15 +583,37 @@ if __name__ == "__main__":
     import argparse
     
     parser = argparse.ArgumentParser(description='Slice dataset using SAHI')
-    parser.add_argument('--input_dir', type=str, required=True, help='Input dataset directory')
+    parser.add_argument('--input_dir', type=str, help='Input dataset directory (required unless --unpack)')
     parser.add_argument('--output_dir', type=str, required=True, help='Output directory for sliced dataset')
     parser.add_argument('--slice_height', type=int, default=512, help='Slice height (default: 512)')
     parser.add_argument('--slice_width', type=int, default=512, help='Slice width (default: 512)')
     parser.add_argument('--overlap_height_ratio', type=float, default=0.3, help='Height overlap ratio (default: 0.3)')
     parser.add_argument('--overlap_width_ratio', type=float, default=0.3, help='Width overlap ratio (default: 0.3)')
     parser.add_argument('--yaml_path', type=str, help='Original dataset YAML file path')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='Re-slice every image, ignoring the manifest (and repack with --pack_dir)')
+    parser.add_argument('--verify', action='store_true', help='Only check the sliced dataset against its manifest')
+    parser.add_argument('--pack_dir', type=str, help='Also pack the sliced splits into memory-mappable shards here')
+    parser.add_argument('--unpack', type=str, metavar='SHARD_DIR', help='Only convert a packed shard back to a YOLO folder in --output_dir')
     
     args = parser.parse_args()
+
+    if args.unpack:
+        count = unpack_shard(args.unpack, args.output_dir)
+        print(f"Unpacked {count} tiles from {args.unpack} into {args.output_dir}")
+        raise SystemExit(0)
+    if not args.input_dir:
+        parser.error('--input_dir is required')
+
+    if args.verify:
+        report = verify_sliced_dataset(args.input_dir, args.output_dir)
+        problems = {key: items for key, items in report.items() if items}
+        for key, items in problems.items():
+            print(f"{key}: {len(items)}")
+            for item in items[:20]:
+                print(f"  {item}")
+        print("Sliced dataset is consistent with its manifest" if not problems else "Sliced dataset has problems")
+        raise SystemExit(1 if problems else 0)
     
     print("Starting SAHI dataset slicing...")
     print(f"Input: {args.input_dir}")
@@ -228,11 +628,16 @@ if __name__ == "__main__":
         slice_height=args.slice_height,
         slice_width=args.slice_width,
         overlap_height_ratio=args.overlap_height_ratio,
-        overlap_width_ratio=args.overlap_width_ratio
+        overlap_width_ratio=args.overlap_width_ratio,
+        workers=args.workers,
+        force=args.force
     )
     
     # Create YAML config if provided
     if args.yaml_path:
         create_sliced_yaml(args.output_dir, args.yaml_path)
+
+    if args.pack_dir:
+        pack_sliced_dataset(args.output_dir, args.pack_dir, force=args.force)
     
     print("SAHI dataset slicing completed!")
\ No newline at end of file
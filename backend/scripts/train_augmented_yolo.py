@@ -6,19 +6,46 @@ This should provide much better results with proper data diversity.
 
 from ultralytics import YOLO
 import os
+import argparse
+import yaml
 
-def train_with_augmented_data():
-    """Train YOLO model with the augmented dataset."""
+def lazy_training_config(multiplier, seed, spec):
+    """data.yaml for augmenting the original images at load time instead of from disk copies."""
+    from augment_original_data import AugmentationSpec, write_lazy_dataset
+    with open("../../data/config.yaml", "r") as f:
+        names = (yaml.safe_load(f) or {}).get("names", {0: "distribution_board"})
+    data_yaml = write_lazy_dataset(
+        "../../data/lazy_augmented",
+        "../../data/images/original",
+        "../../data/labels/original",
+        names,
+        multiplier=multiplier,
+        seed=seed,
+        spec=AugmentationSpec.parse(spec),
+    )
+    return str(data_yaml)
+
+def train_with_augmented_data(lazy=False, multiplier=15, seed=0, spec=None):
+    """Train YOLO model with the augmented dataset (generated at load time with lazy=True)."""
     
     print("Training YOLO with Augmented Dataset")
     print("=" * 50)
     
+    data = "../../data/config.yaml"
+    extra = {}
+    if lazy:
+        from augment_original_data import open_lazy_split
+        from fine_tune_yolo import source_trainer
+        data = lazy_training_config(multiplier, seed, spec)
+        extra["trainer"] = source_trainer(open_lazy_split)
+        print(f"Augmenting {multiplier} copies per original image at load time ({data})")
+    
     # Use YOLOv8n (nano) for better performance with small datasets
     model = YOLO("yolov8s.pt")
     
     # Training configuration optimized for augmented small dataset
     results = model.train(
-        data="../../data/config.yaml",
+        data=data,
         epochs=100,                # Reduced epochs for better convergence
         batch=2,                   # Smaller batch size for stability
         imgsz=640,
@@ -57,7 +84,8 @@ def train_with_augmented_data():
         name="augmented_train",
         exist_ok=True,
         verbose=True,
-        device="0"                # Use GPU if available
+        device="0",               # Use GPU if available
+        **extra
     )
     
     print("✅ Training complete with augmented dataset!")
@@ -81,6 +109,13 @@ def train_with_augmented_data():
     return "runs/detect/augmented_train/weights/best.pt"
 
 if __name__ == "__main__":
-    model_path = train_with_augmented_data()
+    parser = argparse.ArgumentParser(description="Train YOLO with the augmented dataset")
+    parser.add_argument("--lazy", action="store_true", help="Augment the original images at load time instead of reading the augmented copies")
+    parser.add_argument("--multiplier", type=int, default=15, help="Augmented samples per original image with --lazy")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for augmentation choice, split and noise with --lazy")
+    parser.add_argument("--spec", type=str, default=None, help="Augmentations to draw from with --lazy, e.g. 'hflip:2,rot90,blur'")
+    args = parser.parse_args()
+    
+    model_path = train_with_augmented_data(lazy=args.lazy, multiplier=args.multiplier, seed=args.seed, spec=args.spec)
     print(f"\n🎯 New model saved to: {model_path}")
     print(f"📋 Next step: Update backend config to use this model")
\ No newline at end of file
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+YOLO label I/O shared by the dataset scripts.
+
+Labels are handled as N x 5 float arrays (class_id, x_center, y_center, width,
+height, normalized to the image size); float64 by default so a read, transform and
+write round trip prints the same digits as arithmetic on Python floats. A whole split can be loaded into a single
+LabelTable (one array plus an image index) for statistics and filtering.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+LABEL_FORMAT = "%d %.6f %.6f %.6f %.6f"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+EMPTY_LABELS = np.zeros((0, 5), dtype=np.float64)
+
+
+class LabelFormatError(ValueError):
+    pass
+
+
+def parse_labels(text, strict=False, source="<labels>", dtype=np.float64):
+    """Parse YOLO label text; lines without exactly 5 fields are skipped (or raise with strict)."""
+    lines = [parts for parts in (line.split() for line in text.splitlines()) if parts]
+    if not lines:
+        return EMPTY_LABELS.astype(dtype)
+    # A total of 5 fields per line is not enough: a 4-field and a 6-field line would be re-chunked
+    if all(len(parts) == 5 for parts in lines):
+        # Every line has 5 fields: parse all numbers in one go
+        try:
+            return np.array(lines, dtype=dtype).reshape(-1, 5)
+        except ValueError:
+            pass  # a field is not a number: find it line by line
+    rows = []
+    for number, parts in enumerate(lines, 1):
+        try:
+            if len(parts) != 5:
+                raise ValueError(f"expected 5 fields, got {len(parts)}")
+            rows.append([float(part) for part in parts])
+        except ValueError as e:
+            if strict:
+                raise LabelFormatError(f"{source}:{number}: {e}") from e
+    return np.array(rows, dtype=dtype).reshape(-1, 5)
+
+
+def read_labels(label_file, strict=False, dtype=np.float64):
+    """Labels of one file as an N x 5 array (empty if the file does not exist)."""
+    label_file = Path(label_file)
+    if not label_file.exists():
+        return EMPTY_LABELS.astype(dtype)
+    with open(label_file, 'r') as f:
+        return parse_labels(f.read(), strict=strict, source=str(label_file), dtype=dtype)
+
+
+def format_labels(labels):
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+    return "".join(LABEL_FORMAT % tuple(row) + "\n" for row in labels)
+
+
+def write_labels(label_file, labels):
+    with open(label_file, 'w') as f:
+        f.write(format_labels(labels))
+
+
+def validate_labels(labels):
+    """Mask of rows that are valid YOLO boxes: integer class >= 0, center in [0, 1], size in (0, 1]."""
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+    cls, xy, wh = labels[:, 0], labels[:, 1:3], labels[:, 3:5]
+    return ((cls >= 0) & (cls == np.round(cls))
+            & np.all((xy >= 0) & (xy <= 1), axis=1)
+            & np.all((wh > 0) & (wh <= 1), axis=1))
+
+
+def to_absolute(labels, width, height):
+    """Normalized YOLO rows -> N x 4 absolute x_min, y_min, x_max, y_max pixel boxes."""
+    labels = np.asarray(labels, dtype=np.float64).reshape(-1, 5)
+    cx, cy = labels[:, 1] * width, labels[:, 2] * height
+    w, h = labels[:, 3] * width, labels[:, 4] * height
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+
+def to_normalized(boxes, class_ids, width, height, clip=True):
+    """N x 4 absolute x_min, y_min, x_max, y_max boxes -> normalized YOLO rows."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if clip:
+        boxes = np.clip(boxes, 0, [width, height, width, height])
+    labels = np.empty((len(boxes), 5), dtype=np.float64)
+    labels[:, 0] = np.asarray(class_ids, dtype=np.float64).reshape(-1)
+    labels[:, 1] = (boxes[:, 0] + boxes[:, 2]) / 2 / width
+    labels[:, 2] = (boxes[:, 1] + boxes[:, 3]) / 2 / height
+    labels[:, 3] = (boxes[:, 2] - boxes[:, 0]) / width
+    labels[:, 4] = (boxes[:, 3] - boxes[:, 1]) / height
+    return labels
+
+
+class LabelTable:
+    """All labels of a split: labels (M x 5), image_index (M,) into names, and per-name offsets."""
+
+    def __init__(self, names, labels, image_index):
+        self.names = list(names)
+        self.labels = labels
+        self.image_index = image_index
+        counts = np.bincount(image_index, minlength=len(self.names)) if len(self.names) else np.zeros(0, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def labels_for(self, i):
+        return self.labels[self.offsets[i]:self.offsets[i + 1]]
+
+    def counts(self):
+        """Labels per image."""
+        return np.diff(self.offsets)
+
+    def class_counts(self):
+        return {int(cls): int(count) for cls, count in zip(*np.unique(self.labels[:, 0], return_counts=True))}
+
+    def select(self, mask):
+        """Table with only the label rows where mask is true (images are kept, possibly empty)."""
+        mask = np.asarray(mask, dtype=bool)
+        return LabelTable(self.names, self.labels[mask], self.image_index[mask])
+
+    def images_where(self, mask):
+        """Names of images having at least one label row where mask is true."""
+        return [self.names[i] for i in np.unique(self.image_index[np.asarray(mask, dtype=bool)])]
+
+    def stats(self):
+        counts = self.counts()
+        valid = validate_labels(self.labels)
+        area = self.labels[:, 3] * self.labels[:, 4]
+        return {
+            "images": len(self.names),
+            "labels": int(len(self.labels)),
+            "empty_images": int((counts == 0).sum()),
+            "max_labels_per_image": int(counts.max()) if len(counts) else 0,
+            "invalid_labels": int((~valid).sum()),
+            "classes": self.class_counts(),
+            "box_area_quantiles": ([round(float(q), 6) for q in np.quantile(area, [0.05, 0.5, 0.95])]
+                                   if len(area) else []),
+        }
+
+
+def scan_labels(labels_dir, images_dir=None, strict=False, dtype=np.float32):
+    """
+    Load every label file of a split into one LabelTable. With images_dir, the table
+    lists every image (label files without an image are ignored, images without a label
+    file have no rows); otherwise it lists every label file. Stored as float32 by
+    default, which is plenty for statistics and filtering.
+    """
+    labels_dir = Path(labels_dir)
+    if images_dir is not None:
+        with os.scandir(images_dir) as entries:
+            names = sorted(e.name for e in entries if e.name.lower().endswith(IMAGE_EXTENSIONS))
+        label_files = [labels_dir / (Path(name).stem + ".txt") for name in names]
+    else:
+        with os.scandir(labels_dir) as entries:
+            names = sorted(e.name for e in entries if e.name.endswith(".txt"))
+        label_files = [labels_dir / name for name in names]
+
+    arrays = [read_labels(label_file, strict=strict, dtype=dtype) for label_file in label_files]
+    labels = np.concatenate(arrays) if arrays else EMPTY_LABELS.astype(dtype)
+    image_index = np.repeat(np.arange(len(arrays), dtype=np.int32), [len(a) for a in arrays])
+    return LabelTable(names, labels, image_index)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Label statistics and validation for a YOLO split")
+    parser.add_argument("labels_dir", type=str, help="Directory of YOLO .txt label files")
+    parser.add_argument("--images-dir", type=str, default=None, help="Matching image directory (lists images without labels too)")
+    parser.add_argument("--strict", action="store_true", help="Fail on malformed lines instead of skipping them")
+    parser.add_argument("--list-invalid", action="store_true", help="Print the images with invalid label rows")
+    args = parser.parse_args()
+
+    table = scan_labels(args.labels_dir, args.images_dir, strict=args.strict)
+    print(json.dumps(table.stats(), indent=2))
+    if args.list_invalid:
+        for name in table.images_where(~validate_labels(table.labels)):
+            print(name)
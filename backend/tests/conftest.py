@@ -0,0 +1,9 @@
+import sys
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+
+# app.* from the backend root, the dataset scripts import their siblings directly
+for path in (BACKEND_ROOT, BACKEND_ROOT / "scripts"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from augment_original_data import (YOLOTransforms, flip_boxes_horizontal, flip_boxes_vertical,
+                                   rotate_boxes_90, rotate_boxes_270)
+
+LABELS = np.array([[0, 0.2, 0.3, 0.1, 0.4], [5, 0.75, 0.6, 0.3, 0.2]])
+
+
+def test_rotate_90_maps_x_y_to_one_minus_y_x():
+    rotated = rotate_boxes_90(LABELS)
+    np.testing.assert_allclose(rotated, [[0, 0.7, 0.2, 0.4, 0.1], [5, 0.4, 0.75, 0.2, 0.3]])
+
+
+def test_rotate_270_maps_x_y_to_y_one_minus_x():
+    rotated = rotate_boxes_270(LABELS)
+    np.testing.assert_allclose(rotated, [[0, 0.3, 0.8, 0.4, 0.1], [5, 0.6, 0.25, 0.2, 0.3]])
+
+
+def test_rotations_round_trip():
+    np.testing.assert_allclose(rotate_boxes_270(rotate_boxes_90(LABELS)), LABELS)
+    np.testing.assert_allclose(rotate_boxes_90(rotate_boxes_270(LABELS)), LABELS)
+    four = LABELS
+    for _ in range(4):
+        four = rotate_boxes_90(four)
+    np.testing.assert_allclose(four, LABELS)
+
+
+def test_flips_are_their_own_inverse():
+    np.testing.assert_allclose(flip_boxes_horizontal(LABELS)[:, 1], [0.8, 0.25])
+    np.testing.assert_allclose(flip_boxes_vertical(LABELS)[:, 2], [0.7, 0.4])
+    np.testing.assert_allclose(flip_boxes_horizontal(flip_boxes_horizontal(LABELS)), LABELS)
+    np.testing.assert_allclose(flip_boxes_vertical(flip_boxes_vertical(LABELS)), LABELS)
+
+
+def test_box_transforms_do_not_modify_their_input():
+    labels = LABELS.copy()
+    for transform in (rotate_boxes_90, rotate_boxes_270, flip_boxes_horizontal, flip_boxes_vertical):
+        transform(labels)
+    np.testing.assert_array_equal(labels, LABELS)
+
+
+def pixel_label(mask):
+    """YOLO label (without class) of the bounding box of the non-zero pixels of ``mask``."""
+    ys, xs = np.nonzero(mask)
+    height, width = mask.shape
+    x0, x1, y0, y1 = xs.min(), xs.max() + 1, ys.min(), ys.max() + 1
+    return [(x0 + x1) / 2 / width, (y0 + y1) / 2 / height, (x1 - x0) / width, (y1 - y0) / height]
+
+
+@pytest.mark.parametrize("aug", ["hflip", "vflip", "rot90", "rot270"])
+def test_boxes_follow_the_image(aug):
+    # A non-square image, so a rotation that swapped the wrong axes would show
+    image = np.zeros((200, 320, 3), dtype=np.uint8)
+    image[40:80, 30:130] = 255
+    boxes = np.array([[1] + pixel_label(image[:, :, 0])])
+    out_image, out_boxes = YOLOTransforms().apply(aug, image, boxes)
+    assert out_boxes[0, 0] == 1
+    np.testing.assert_allclose(out_boxes[0, 1:], pixel_label(out_image[:, :, 0]), atol=1e-9)
@@ -0,0 +1,55 @@
+from app.core.cache import LRUCache
+
+
+def cache(max_bytes=10):
+    # Values are sized by their length
+    return LRUCache(max_bytes, sizeof=len)
+
+
+def test_get_counts_hits_and_misses():
+    c = cache()
+    c.put("a", "xx")
+    assert c.get("a") == "xx"
+    assert c.get("b", "default") == "default"
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used_until_within_budget():
+    c = cache()
+    c.put("a", "xxxx")
+    c.put("b", "xxxx")
+    c.get("a")  # b is now the least recently used
+    c.put("c", "xxxx")
+    assert "a" in c and "c" in c and "b" not in c
+    assert c.current_bytes == 8
+    assert c.stats()["evictions"] == 1
+
+
+def test_replacing_a_key_updates_its_size():
+    c = cache()
+    c.put("a", "xxxxxx")
+    c.put("a", "xx")
+    assert c.current_bytes == 2 and len(c) == 1
+    c.put("b", "xxxxxxxx")
+    assert len(c) == 2 and c.current_bytes == 10
+
+
+def test_value_larger_than_budget_is_not_cached():
+    c = cache()
+    c.put("a", "xx")
+    c.put("big", "x" * 11)
+    assert "big" not in c and "a" in c
+    # Replacing a key with an oversized value drops the old entry
+    c.put("a", "x" * 11)
+    assert "a" not in c and c.current_bytes == 0
+
+
+def test_pop_and_clear_release_bytes():
+    c = cache()
+    c.put("a", "xxx")
+    c.put("b", "xx")
+    assert c.pop("a") == "xxx" and c.pop("a") is None
+    assert c.current_bytes == 2
+    c.clear()
+    assert len(c) == 0
+    assert c.stats() == {"entries": 0, "bytes": 0, "max_bytes": 10, "hits": 0, "misses": 0, "evictions": 0}
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sahi")
+from sahi_preprocess import project_labels
+
+WIDTH, HEIGHT = 1000, 600
+# Two 512 slices side by side, overlapping between x = 488 and 512
+ORIGINS = [(0, 0), (488, 0)]
+
+
+def label(cls, x0, y0, x1, y1):
+    """YOLO label of a pixel box in the WIDTH x HEIGHT image."""
+    return [cls, (x0 + x1) / 2 / WIDTH, (y0 + y1) / 2 / HEIGHT, (x1 - x0) / WIDTH, (y1 - y0) / HEIGHT]
+
+
+def project(labels, **kwargs):
+    return project_labels(np.array(labels, dtype=np.float64), ORIGINS, 512, 512, WIDTH, HEIGHT, **kwargs)
+
+
+def test_label_inside_one_slice_is_renormalized_to_it():
+    keep, boxes, hits = project([label(0, 80, 90, 120, 110)])
+    assert keep[:, 0].tolist() == [True, False]
+    assert hits[:, 0].tolist() == [True, False]
+    np.testing.assert_allclose(boxes[0, 0], [100 / 512, 100 / 512, 40 / 512, 20 / 512])
+
+
+def test_label_across_slice_border_is_clipped_into_both():
+    keep, boxes, _ = project([label(3, 480, 200, 520, 220)])
+    assert keep[:, 0].tolist() == [True, True]
+    # Slice 0 sees x 480..512, slice 1 sees x 488..520 (32 px of 40 each time)
+    np.testing.assert_allclose(boxes[0, 0], [496 / 512, 210 / 512, 32 / 512, 20 / 512])
+    np.testing.assert_allclose(boxes[1, 0], [16 / 512, 210 / 512, 32 / 512, 20 / 512])
+
+
+def test_small_overlap_below_ratio_is_a_hit_but_not_kept():
+    # 7 of 105 px fall into slice 0
+    labels = [label(1, 505, 300, 610, 320)]
+    keep, _, hits = project(labels, min_ratio=0.1)
+    assert hits[:, 0].tolist() == [True, True]
+    assert keep[:, 0].tolist() == [False, True]
+    # The default ratio is low so symbols cut by a border are kept
+    keep, _, _ = project(labels)
+    assert keep[:, 0].tolist() == [True, True]
+
+
+def test_label_below_the_slices_touches_none():
+    keep, _, hits = project([label(2, 100, 540, 140, 580)])
+    assert not hits.any() and not keep.any()
+
+
+def test_shapes_follow_slices_and_labels():
+    keep, boxes, hits = project([label(0, 80, 90, 120, 110), label(3, 480, 200, 520, 220),
+                                 label(2, 100, 540, 140, 580)])
+    assert keep.shape == hits.shape == (2, 3)
+    assert boxes.shape == (2, 3, 4)
+    assert ((boxes >= 0) & (boxes <= 1)).all()
+    keep, boxes, hits = project(np.zeros((0, 5)))
+    assert keep.shape == (2, 0) and boxes.shape == (2, 0, 4)
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from app.services.tiling import DetectionParams, greedy_nmm, merge_detections, slice_regions, EMPTY_DETECTIONS
+
+
+def dets(*rows):
+    return np.array(rows, dtype=np.float32).reshape(-1, 6)
+
+
+@pytest.mark.parametrize("width,height", [(1000, 600), (2000, 1500), (513, 512), (4096, 3000)])
+def test_slice_regions_cover_image_with_full_size_slices(width, height):
+    regions = slice_regions(width, height, size=512, overlap=0.3)
+    covered = np.zeros((height, width), dtype=bool)
+    for x0, y0, x1, y1 in regions:
+        assert (x1 - x0, y1 - y0) == (512, 512)
+        assert 0 <= x0 and 0 <= y0 and x1 <= width and y1 <= height
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    assert len(set(regions)) == len(regions)
+
+
+def test_slice_regions_small_image_is_one_region():
+    assert slice_regions(300, 200, size=512) == [(0, 0, 300, 200)]
+
+
+@pytest.mark.parametrize("width,height", [(1000, 600), (2000, 1500), (4096, 3000)])
+def test_slice_regions_match_sahi(width, height):
+    slicing = pytest.importorskip("sahi.slicing")
+    expected = slicing.get_slice_bboxes(height, width, slice_height=512, slice_width=512,
+                                        overlap_height_ratio=0.3, overlap_width_ratio=0.3)
+    assert slice_regions(width, height, size=512, overlap=0.3) == [tuple(box) for box in expected]
+
+
+def test_greedy_nmm_joins_box_cut_by_slice_border():
+    # Halves of one symbol seen by two slices, plus the full-image detection of it
+    merged = greedy_nmm(dets([100, 100, 160, 150, 0.6, 1], [140, 100, 200, 150, 0.4, 2],
+                             [100, 100, 200, 150, 0.9, 3]))
+    # Matches are checked against the highest scoring box, which keeps its score and class
+    assert len(merged) == 1
+    np.testing.assert_allclose(merged[0], [100, 100, 200, 150, 0.9, 3], rtol=1e-6)
+
+
+def test_greedy_nmm_matches_against_the_kept_box_not_the_union():
+    merged = greedy_nmm(dets([100, 100, 160, 150, 0.9, 1], [120, 100, 200, 150, 0.7, 2],
+                             [150, 100, 200, 150, 0.4, 3]))
+    # The last box overlaps the union but only a fifth of itself lies in the top box
+    np.testing.assert_allclose(merged[:, :5], [[100, 100, 200, 150, 0.9], [150, 100, 200, 150, 0.4]], rtol=1e-6)
+
+
+def test_greedy_nmm_uses_intersection_over_smaller_area():
+    # A small box inside a large one has a low IoU but an IOS of 1
+    merged = greedy_nmm(dets([0, 0, 100, 100, 0.5, 0], [10, 10, 20, 20, 0.8, 1]), 0.5)
+    assert len(merged) == 1
+    np.testing.assert_allclose(merged[0], [0, 0, 100, 100, 0.8, 1], rtol=1e-6)
+
+
+def test_greedy_nmm_keeps_separate_boxes_in_score_order():
+    merged = greedy_nmm(dets([0, 0, 10, 10, 0.3, 0], [50, 50, 60, 60, 0.6, 1], [0, 5, 10, 15, 0.5, 2]))
+    # The first and last boxes overlap by half their area: exactly the threshold
+    np.testing.assert_allclose(merged[:, 4], [0.6, 0.5], rtol=1e-6)
+    np.testing.assert_allclose(merged[1, :4], [0, 0, 10, 15])
+
+
+def test_greedy_nmm_empty():
+    assert greedy_nmm(EMPTY_DETECTIONS).shape == (0, 6)
+
+
+def test_merge_detections_applies_served_score_cutoff():
+    params = DetectionParams()
+    raw = dets([10, 10, 60, 60, 0.9, 0], [100, 100, 150, 150, 0.5, 1])
+    # Unsliced images use min_score_full
+    assert merge_detections(raw, (400, 400), params).scores == [pytest.approx(0.9)]
+    # Sliced images use the lower min_score_sliced
+    assert len(merge_detections(raw, (1000, 1000), params).scores) == 2
+    # An explicit cutoff overrides both, including zero
+    assert len(merge_detections(raw, (400, 400), params, min_score=0).scores) == 2
+    assert merge_detections(raw, (1000, 1000), params, min_score=0.95).scores == []
+
+
+def test_merge_detections_caps_to_max_det_unless_uncapped():
+    params = DetectionParams()
+    raw = dets(*[[i * 20, 0, i * 20 + 15, 15, 0.7 + i * 0.01, 0] for i in range(15)])
+    capped = merge_detections(raw, (400, 400), params)
+    assert len(capped.boxes) == params.max_det_full
+    # The highest scoring detections are the ones kept
+    assert capped.scores == sorted(capped.scores, reverse=True)
+    assert min(capped.scores) == pytest.approx(0.7 + 5 * 0.01)
+    assert len(merge_detections(raw, (400, 400), params.uncapped()).boxes) == 15
+
+
+def test_merge_detections_unsliced_drops_tiny_boxes_and_clamps():
+    params = DetectionParams()
+    response = merge_detections(dets([1, 1, 4, 4, 0.9, 0], [350, 380, 450, 420, 0.8, 2]), (400, 400), params)
+    assert [(b.x, b.y, b.w, b.h) for b in response.boxes] == [(350, 380, 50, 20)]
+    assert response.classes == ["2"]
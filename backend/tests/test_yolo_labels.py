@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from yolo_labels import (EMPTY_LABELS, LabelFormatError, format_labels, parse_labels, read_labels,
+                         to_absolute, to_normalized, validate_labels, write_labels)
+
+
+def test_parse_labels_reads_rows():
+    labels = parse_labels("0 0.5 0.5 0.2 0.1\n\n3 0.25 0.75 0.1 0.3\n")
+    np.testing.assert_array_equal(labels, [[0, 0.5, 0.5, 0.2, 0.1], [3, 0.25, 0.75, 0.1, 0.3]])
+    assert labels.dtype == np.float64
+
+
+def test_parse_labels_empty_text():
+    assert parse_labels("").shape == (0, 5)
+    assert parse_labels(" \n\n").shape == (0, 5)
+    assert parse_labels("", dtype=np.float32).dtype == np.float32
+
+
+def test_parse_labels_does_not_rechunk_mixed_field_counts():
+    # 4 + 6 fields is 10 numbers, which would reshape into two bogus 5-field rows
+    text = "1 0.5 0.5 0.2\n2 0.1 0.2 0.3 0.4 0.9\n0 0.5 0.5 0.2 0.2\n"
+    np.testing.assert_array_equal(parse_labels(text), [[0, 0.5, 0.5, 0.2, 0.2]])
+    with pytest.raises(LabelFormatError, match=r"a.txt:1: expected 5 fields, got 4"):
+        parse_labels(text, strict=True, source="a.txt")
+
+
+def test_parse_labels_skips_unparsable_lines_unless_strict():
+    text = "0 0.5 0.5 0.2 0.2\n1 0.5 nope 0.2 0.2\n"
+    np.testing.assert_array_equal(parse_labels(text), [[0, 0.5, 0.5, 0.2, 0.2]])
+    with pytest.raises(LabelFormatError, match=r"a.txt:2:"):
+        parse_labels(text, strict=True, source="a.txt")
+
+
+def test_labels_round_trip_through_a_file(tmp_path):
+    labels = np.array([[0, 0.123456, 0.5, 0.2, 0.1], [7, 0.9, 0.1, 0.05, 0.05]])
+    label_file = tmp_path / "a.txt"
+    write_labels(label_file, labels)
+    assert label_file.read_text().splitlines()[0] == "0 0.123456 0.500000 0.200000 0.100000"
+    np.testing.assert_array_equal(read_labels(label_file), labels)
+    np.testing.assert_array_equal(read_labels(tmp_path / "missing.txt"), EMPTY_LABELS)
+    assert format_labels(EMPTY_LABELS) == ""
+
+
+def test_validate_labels():
+    labels = np.array([[0, 0.5, 0.5, 0.2, 0.2], [-1, 0.5, 0.5, 0.2, 0.2], [1.5, 0.5, 0.5, 0.2, 0.2],
+                       [1, 1.2, 0.5, 0.2, 0.2], [1, 0.5, 0.5, 0.0, 0.2]])
+    assert validate_labels(labels).tolist() == [True, False, False, False, False]
+
+
+def test_absolute_and_normalized_boxes_invert_each_other():
+    labels = np.array([[2, 0.5, 0.25, 0.2, 0.1]])
+    boxes = to_absolute(labels, 200, 400)
+    np.testing.assert_allclose(boxes, [[80, 80, 120, 120]])
+    np.testing.assert_allclose(to_normalized(boxes, [2], 200, 400), labels)
+    # Boxes running past the image are clipped to it
+    np.testing.assert_allclose(to_normalized([[-10, 0, 20, 40]], [0], 200, 400), [[0, 0.05, 0.05, 0.1, 0.1]])